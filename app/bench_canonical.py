@@ -0,0 +1,240 @@
+# app/bench_canonical.py — canonical question matcher: threshold calibration and latency
+#
+# Usage:  python -m app.bench_canonical [sheet.csv] [--size 4000] [--rounds 20]
+#
+# Builds a scratch question bank from the seeded canonical questions and their
+# aliases (migrate.ALIASES_MAP, seed_questions.SEED) and runs labelled user
+# questions through canonical_index.match the way /ask routes them (listing
+# questions exact-only):
+#   paraphrases     — should land on the given canonical question
+#   non-paraphrases — same template, different topic; should match nothing
+# It sweeps CANONICAL_TRIGRAM_MIN (FTS coverage at its default) and then
+# CANONICAL_FTS_MIN_COVERAGE (trigram at its default), reporting correct /
+# wrong / missed hits and precision / recall for each value.
+# The bank is then padded to --size questions with templated filler built from
+# Sanskrit words of the sheet (words used by the labelled set are left out) and
+# the trigram step is timed against the previous matcher (every trigram of the
+# full normalized text scanned), plus the whole match() call, p50/p95.
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (user question, canonical question it should match or None)
+LABELLED: List[Tuple[str, Optional[str]]] = [
+    ("what does gita say on surrender", "What does the Gita say about surrender?"),
+    ("What does Krishna teach about surrender?", "What does the Gita say about surrender?"),
+    ("why is surrender so central in gita", "Why is surrender central in the Gita?"),
+    ("how do I practice surrender", "How can one practice surrender according to the Gita?"),
+    ("what are the three gunas in the gita", "What are the three gunas?"),
+    ("how do the gunas bind the soul", "How do the three gunas bind the soul?"),
+    ("how can i rise above the gunas", "How can one rise beyond the gunas?"),
+    ("what food should one eat as per the gita", "What food should I eat according to the Gita?"),
+    ("how does food affect my mind", "How does food affect the mind in the Gita?"),
+    ("how does the bhagavad gita teach meditation", "How does the Gita teach meditation?"),
+    ("how can one practice meditation", "How does the Gita teach meditation?"),
+    ("how to steady a wandering mind", "How to steady the wandering mind?"),
+    ("is the mind hard to control", "Is the mind hard to control? What does Krishna say?"),
+    ("what is karma yoga in the gita", "What is Karma Yoga?"),
+    ("how can i act without attachment to the results", "How to act without attachment to results?"),
+    ("how do i develop equanimity", "How can I develop equanimity?"),
+    ("what does the gita say about the atman self", "What does the Gita say about the Self (Atman)?"),
+    ("why should we not grieve over death", "Why should one not grieve over death?"),
+    ("what is the ladder of the fall in gita", "What is the ladder of fall described in the Gita?"),
+    ("how does desire and anger lead to ruin", "How do desire and anger lead to ruin?"),
+    ("what is vishvarupa the universal form", "What is the universal form (Vishvarupa) in the Gita?"),
+    ("significance of om in the gita", "What is the significance of OM in the Gita?"),
+    ("what are the 3 gates of hell", "What are the three gates to hell?"),
+    ("what are the marks of sthita prajna", "What are the marks of a sthita-prajna?"),
+    ("how does the sthitaprajna live", "How does a sthita-prajna live?"),
+    ("what are the divine qualities in chapter 16", "What are the divine qualities listed in Chapter 16?"),
+    ("what are the qualities of a real devotee", "What are the qualities of a true devotee?"),
+    ("What is bhakti devotion", "What is Bhakti (devotion) in the Gita?"),
+    ("Which verses talk about food?", None),
+    ("Which verses talk about duty?", None),
+    ("Which verses teach about anger?", None),
+    ("What is yoga?", None),
+    ("What is dharma?", None),
+    ("Who is Arjuna?", None),
+    ("How does the Gita define the mind?", None),
+    ("What are the qualities of a leader?", None),
+    ("What are the three worlds?", None),
+    ("Why is karma important?", None),
+    ("What is the significance of the conch?", None),
+    ("What does the Gita say about sleep?", None),
+    ("How can one practice charity?", None),
+    ("What is the nature of time?", None),
+]
+TRIGRAM_SWEEP = [0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70, 0.75, 0.80, 0.85, 0.90]
+COVERAGE_SWEEP = [0.25, 0.34, 0.40, 0.50, 0.60, 0.67, 0.75, 1.00]
+FILLER_TEMPLATES = [
+    "What does the Gita say about {}?", "Which verses talk about {}?", "What is {} in the Gita?",
+    "How can one practise {}?", "Why is {} important?", "What are the marks of {}?",
+    "How does {} affect the mind?", "What does Krishna teach about {}?",
+]
+
+def _bank() -> List[Tuple[str, int]]:
+    from .migrate import ALIASES_MAP
+    from .seed_questions import SEED
+
+    out = {q: 1 for q in ALIASES_MAP}
+    for _, text, _, priority, _ in SEED:
+        out.setdefault(text, priority)
+    return list(out.items())
+
+def _filler(sheet: str, size: int, exclude: set) -> List[Tuple[str, int]]:
+    import csv
+
+    from .canonical_index import normalize
+
+    words = set()
+    with open(sheet, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            words.update(w for w in normalize(row.get("roman") or "").split() if len(w) >= 5)
+    words = sorted(words - exclude)
+    rng = random.Random(7)
+    out, seen = [], set()
+    while len(out) < size:
+        topic = " ".join(rng.sample(words, 2))
+        text = rng.choice(FILLER_TEMPLATES).format(topic)
+        if text not in seen:
+            seen.add(text)
+            out.append((text, 5))
+    return out
+
+def _load(path: str, questions: Sequence[Tuple[str, int]]) -> None:
+    from .migrate import SCHEMA_SQL, seed_aliases
+
+    con = sqlite3.connect(path)
+    con.executescript("DROP TABLE IF EXISTS question_aliases; DROP TABLE IF EXISTS questions_fts; "
+                      "DROP TABLE IF EXISTS questions;")
+    con.executescript(SCHEMA_SQL)
+    con.executemany("INSERT INTO questions(micro_topic_id, priority, source, question_text) VALUES(0, ?, 'bench', ?)",
+                    [(p, t) for t, p in questions])
+    seed_aliases(con.cursor())
+    con.commit()
+    con.close()
+
+def _score(route) -> Dict[str, float]:
+    from . import canonical_index
+
+    correct = wrong = missed = 0
+    for q, want in LABELLED:
+        hit = canonical_index.match(q, fuzzy=not route(q))
+        got = hit["question_text"] if hit else None
+        if got is None:
+            missed += want is not None
+        elif got == want:
+            correct += 1
+        else:
+            wrong += 1
+    positives = sum(w is not None for _, w in LABELLED)
+    return {"correct": correct, "wrong": wrong, "missed": missed,
+            "precision": correct / (correct + wrong) if correct + wrong else 1.0,
+            "recall": correct / positives}
+
+def _report(label: str, value: float, r: Dict[str, float]) -> None:
+    print(f"{label:>10s}={value:<5.2f} correct={r['correct']:<3d} wrong={r['wrong']:<3d} "
+          f"missed={r['missed']:<3d} precision={r['precision']:.3f} recall={r['recall']:.3f}")
+
+def _baseline_index(idx) -> Tuple[Dict[str, List[int]], List[int]]:
+    """The previous layout: trigrams of every full normalized text (questions + aliases)."""
+    from .canonical_index import _trigrams
+
+    postings: Dict[str, List[int]] = {}
+    sizes: List[int] = []
+    for i, norm in enumerate(idx.exact):
+        g = _trigrams(norm)
+        sizes.append(len(g))
+        for tg in g:
+            postings.setdefault(tg, []).append(i)
+    return postings, sizes
+
+def _baseline_match(postings: Dict[str, List[int]], sizes: List[int], norm: str, t: float) -> Optional[int]:
+    from .canonical_index import _trigrams
+
+    q = _trigrams(norm)
+    shared: Counter = Counter()
+    for tg in q:
+        for i in postings.get(tg, ()):
+            shared[i] += 1
+    best = None
+    for i, n in shared.items():
+        score = 2.0 * n / (len(q) + sizes[i])
+        if score >= t and (best is None or score > best[0]):
+            best = (score, i)
+    return best[1] if best else None
+
+def _ms(fn, rounds: int) -> List[float]:
+    out = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t) * 1000.0)
+    return out
+
+def _p95(samples: List[float]) -> float:
+    samples = sorted(samples)
+    return samples[int(0.95 * (len(samples) - 1))]
+
+def main():
+    ap = argparse.ArgumentParser(description="Calibrate and time the canonical question matcher")
+    ap.add_argument("sheet", nargs="?", default="gita_verses_clean.csv")
+    ap.add_argument("--size", type=int, default=4000)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="gita-bench-canonical-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "gita.db")
+    os.environ.setdefault("LLM_PROVIDER", "stub")  # main is imported for its routing check only
+    from . import canonical_index, db
+    from .main import _is_verses_listing_query as listing
+
+    db.DB_PATH = os.environ["DB_PATH"]
+    db.init_db()
+    bank = _bank()
+    _load(db.DB_PATH, bank)
+    canonical_index.reload()
+    tri_default, cov_default = canonical_index.TRIGRAM_MIN, canonical_index.FTS_MIN_COVERAGE
+    positives = sum(w is not None for _, w in LABELLED)
+    print(f"[bench_canonical] bank={len(bank)} questions, labelled={len(LABELLED)} "
+          f"({positives} paraphrases, {len(LABELLED) - positives} non-paraphrases)")
+
+    for t in TRIGRAM_SWEEP:
+        canonical_index.TRIGRAM_MIN = t
+        _report("trigram", t, _score(listing))
+    canonical_index.TRIGRAM_MIN = tri_default
+    for c in COVERAGE_SWEEP:
+        canonical_index.FTS_MIN_COVERAGE = c
+        _report("coverage", c, _score(listing))
+    canonical_index.FTS_MIN_COVERAGE = cov_default
+
+    exclude = {w for q, want in LABELLED for w in canonical_index.normalize(f"{q} {want or ''}").split()}
+    exclude |= {w for text, _ in bank for w in canonical_index.normalize(text).split()}
+    _load(db.DB_PATH, bank + _filler(args.sheet, max(0, args.size - len(bank)), exclude))
+    idx_n = canonical_index.reload()
+    idx = canonical_index._index()
+    r = _score(listing)
+    print(f"[bench_canonical] padded bank={len(idx.questions)} questions, {idx_n} trigram entries "
+          f"(trigram={tri_default} coverage={cov_default}): correct={r['correct']} wrong={r['wrong']} "
+          f"missed={r['missed']}")
+
+    postings, sizes = _baseline_index(idx)
+    norms = [canonical_index.normalize(q) for q, _ in LABELLED]
+    keys = [canonical_index.content(n) for n in norms]
+    old = [x for n in norms for x in _ms(lambda: _baseline_match(postings, sizes, n, tri_default), args.rounds)]
+    new = [x for k in keys if k for x in _ms(lambda: canonical_index._trigram_match(idx, k), args.rounds)]
+    full = [x for q, _ in LABELLED for x in _ms(lambda: canonical_index.match(q, fuzzy=not listing(q)), args.rounds)]
+    print(f"{'step':28s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for name, lat in (("trigram, all trigrams (old)", old), ("trigram, prefix + df cap", new),
+                      ("match() end to end", full)):
+        print(f"{name:28s} {statistics.median(lat):8.3f} {_p95(lat):8.3f}")
+    db.close_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# app/bench_fts.py — verse FTS benchmark: relevance and latency of search_fts plans
+#
+# Usage:  python -m app.bench_fts [sheet.csv] [--scale 10] [--rounds 20] [--limit 60]
+#
+# Loads the sheet into a scratch DB (replicated --scale times, chapters shifted
+# so every copy is a new set of verses) and runs a fixed set of questions, each
+# with the verses a reader would expect near the top, through three plans:
+#   unranked     — MATCH joined to verses, LIMIT with no ORDER BY (the original query)
+#   ranked-join  — every match joined to verses, then ORDER BY weighted bm25 LIMIT
+#   ranked-topk  — db.SEARCH_FTS_SQL: top-k picked in the index, then joined
+# and reports MRR and recall of the expected verses within the top 10, plus
+# p50/p95 latency. A copy of the index without prefix indexes times a few
+# short prefix queries (`ka*`) with and without them. Last, a set of misspelt
+# Sanskrit questions reports how many find nothing as typed and after
+# query_norm.expand, and what the rewrite costs (cold = correction memo cleared).
+# Copies of a verse count as that verse, so relevance does not depend on --scale.
+# The questions avoid bare and/or/not, which search_fts treats as operators.
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# (question, verses expected near the top)
+QUERIES: List[Tuple[str, Sequence[Tuple[int, int]]]] = [
+    ("right to work but never to its fruits", [(2, 47)]),
+    ("he is never born nor does he ever die", [(2, 20)]),
+    ("whenever there is a decay of righteousness", [(4, 7), (4, 8)]),
+    ("skill in action", [(2, 50)]),
+    ("evenness of mind balanced in success or failure", [(2, 48)]),
+    ("the mind is restless, hard to control", [(6, 34), (6, 35)]),
+    ("offers me a leaf a flower a fruit water", [(9, 26)]),
+    ("splendour of a thousand suns", [(11, 12)]),
+    ("abandoning all dharmas take refuge in me", [(18, 66)]),
+    ("desire, anger, the foe", [(3, 37), (2, 62), (2, 63)]),
+    ("better is ones own duty", [(3, 35), (18, 47)]),
+    ("steady wisdom", [(2, 54), (2, 55), (2, 56)]),
+    ("foods which increase life purity strength", [(17, 8)]),
+    ("hates no creature, friendly, compassionate", [(12, 13)]),
+    ("no purifier like knowledge", [(4, 38)]),
+    ("the field, the knower of the field", [(13, 2), (13, 3)]),
+    ("heat, cold, pleasure, pain are impermanent", [(2, 14)]),
+    ("eternal portion of myself", [(15, 7)]),
+    ("surrender", [(18, 66), (18, 62)]),
+    ("meditation posture seat", [(6, 11), (6, 12), (6, 13)]),
+]
+PREFIX_QUERIES = ["ka*", "dh*", "yo*", "sat*", "pra*", "bh*"]
+MISSPELT = ["bhakthi", "saranagathi", "sthitha prajna", "gyana yog", "swadharm", "yudhishtir",
+            "dhritarashtr", "kurukshetr", "paramatama", "bhagvan", "vairagy", "moksh", "nishkam karm",
+            "brahmachari", "samatvam yog", "atma gyan"]
+TOP = 10
+
+def _scaled_rows(sheet: str, scale: int) -> List[Dict]:
+    from .ingest import load_sheet_to_rows
+
+    with open(sheet, "rb") as f:
+        rows = load_sheet_to_rows(f.read(), sheet)
+    return [dict(r, chapter=r["chapter"] + 18 * i) for i in range(scale) for r in rows]
+
+def _plans() -> Dict[str, Tuple[str, bool]]:
+    """name -> (SQL taking (match, [rank expr,] limit), whether it binds the rank expression)."""
+    from .db import FTS_RANK_EXPR, SEARCH_FTS_SQL
+
+    return {
+        "unranked": ("""
+            SELECT v.* FROM verses_fts JOIN verses AS v ON v.rowid = verses_fts.rowid
+            WHERE verses_fts MATCH ? LIMIT ?""", False),
+        "ranked-join": (f"""
+            SELECT v.* FROM verses_fts JOIN verses AS v ON v.rowid = verses_fts.rowid
+            WHERE verses_fts MATCH ? ORDER BY {FTS_RANK_EXPR.replace("bm25(", "bm25(verses_fts, ")} LIMIT ?""",
+                        False),
+        "ranked-topk": (SEARCH_FTS_SQL, True),
+    }
+
+def _ms(fn, rounds: int) -> List[float]:
+    out = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t) * 1000.0)
+    return out
+
+def _p95(samples: List[float]) -> float:
+    samples = sorted(samples)
+    return samples[int(0.95 * (len(samples) - 1))]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark verse FTS ranking and latency")
+    ap.add_argument("sheet", nargs="?", default="gita_verses_clean.csv")
+    ap.add_argument("--scale", type=int, default=1)
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--limit", type=int, default=60)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="gita-bench-fts-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "gita.db")
+    from . import db
+
+    db.DB_PATH = os.environ["DB_PATH"]
+    rows = _scaled_rows(args.sheet, args.scale)
+    db.init_db()
+    with db.writer() as conn:
+        db.bulk_upsert(conn, rows)
+    conn = db.get_conn()
+    matches = [(db.fts_match_query(q), want) for q, want in QUERIES]
+
+    print(f"[bench_fts] verses={len(rows)} queries={len(QUERIES)} rounds={args.rounds} "
+          f"limit={args.limit} weights={db.FTS_RANK_EXPR}")
+    print(f"{'plan':12s} {'MRR@10':>7s} {'recall@10':>10s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for name, (sql, binds_rank) in _plans().items():
+        rr, recall, lat = [], [], []
+        for m, want in matches:
+            params = (m, db.FTS_RANK_EXPR, args.limit) if binds_rank else (m, args.limit)
+            got: List[Tuple[int, int]] = []
+            for r in conn.execute(sql, params):
+                key = ((int(r["chapter"]) - 1) % 18 + 1, int(r["verse"]))
+                if key not in got:
+                    got.append(key)
+            top = got[:TOP]
+            rank = next((i for i, k in enumerate(top, start=1) if k in want), None)
+            rr.append(1.0 / rank if rank else 0.0)
+            recall.append(len(set(top) & set(want)) / len(want))
+            lat += _ms(lambda: conn.execute(sql, params).fetchall(), args.rounds)
+        print(f"{name:12s} {statistics.mean(rr):7.3f} {statistics.mean(recall):10.3f} "
+              f"{statistics.median(lat):8.3f} {_p95(lat):8.3f}")
+
+    # Same index without prefix=..., for the short prefix queries
+    with db.writer() as w:
+        cols = [r[1] for r in w.execute("PRAGMA table_info(verses_fts)")]
+        w.execute(db._fts_create_sql(cols).replace(f"  prefix='{db.FTS_PREFIX}',\n", "")
+                  .replace("verses_fts", "bench_noprefix", 1))
+        w.execute("INSERT INTO bench_noprefix(bench_noprefix) VALUES('rebuild')")
+    for table in ("verses_fts", "bench_noprefix"):
+        lat = []
+        for m in PREFIX_QUERIES:
+            lat += _ms(lambda: conn.execute(f"SELECT count(1) FROM {table} WHERE {table} MATCH ?", (m,)).fetchone(),
+                       args.rounds)
+        label = f"prefix {db.FTS_PREFIX!r}" if table == "verses_fts" else "no prefix"
+        print(f"[bench_fts] {label:12s} {' '.join(PREFIX_QUERIES)}: "
+              f"p50={statistics.median(lat):.3f}ms p95={_p95(lat):.3f}ms")
+
+    from . import query_norm
+
+    query_norm.reload()
+    zero = lambda q: not conn.execute(db.SEARCH_FTS_SQL, (db.fts_match_query(q), db.FTS_RANK_EXPR, 1)).fetchall()
+    before = sum(zero(q) for q in MISSPELT)
+    after = sum(zero(query_norm.expand(q)) for q in MISSPELT)
+    cold, warm = [], []
+    for q in MISSPELT:
+        for _ in range(args.rounds):
+            query_norm._INDEX.memo.clear()
+            cold += _ms(lambda: query_norm.expand(q), 1)
+            warm += _ms(lambda: query_norm.expand(q), 1)
+    print(f"[bench_fts] misspelt={len(MISSPELT)} zero-hit as typed={before} after expand={after} "
+          f"(index build {query_norm.stats()['build_ms']:.0f}ms)")
+    print(f"[bench_fts] expand cold p50={statistics.median(cold) * 1000:.0f}us p95={_p95(cold) * 1000:.0f}us  "
+          f"warm p50={statistics.median(warm) * 1000:.0f}us p95={_p95(warm) * 1000:.0f}us")
+    db.close_pool()
+
+if __name__ == "__main__":
+    main()
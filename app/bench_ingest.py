@@ -0,0 +1,143 @@
+# app/bench_ingest.py — sheet ingest benchmark: load_sheet_to_rows + bulk_upsert
+#
+# Usage:  python -m app.bench_ingest [sheet.csv] [--scale 10] [--rounds 3]
+#
+# The sheet is replicated --scale times (chapters shifted so every copy is a
+# new set of verses) to stand in for larger corpora. Each strategy runs twice
+# per round on a scratch DB:
+#   fresh    — empty verses table, every row inserted
+#   reingest — same sheet again, every row hits ON CONFLICT (the common re-upload)
+#
+#   legacy       — df.iterrows() loader + one execute() per row, every row re-rendered (the original path)
+#   executemany  — column-wise loader + one prepared executemany
+#   staging      — column-wise loader + TEMP staging table and one merge statement
+# Both bulk_upsert strategies skip rows that are already stored unchanged.
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import pandas as pd
+
+def _load_rows_iterrows(file_bytes: bytes) -> List[Dict]:
+    """The pre-vectorization CSV loader, kept here as the baseline."""
+    from .ingest import REQUIRED_COLS
+
+    def _coerce_int(x):
+        try:
+            return int(str(x).strip())
+        except Exception:
+            return None
+
+    df = pd.read_csv(io.BytesIO(file_bytes), keep_default_na=False)
+    cols = {c.strip().lower(): c for c in df.columns}
+    for rc in REQUIRED_COLS:
+        if rc not in cols:
+            raise ValueError(f"Missing required column: {rc}")
+
+    def _get(row, key_lower):
+        if key_lower not in cols:
+            return ""
+        val = row.get(cols[key_lower], "")
+        return "" if pd.isna(val) else str(val)
+
+    out: List[Dict] = []
+    for _, r in df.iterrows():
+        chap = _coerce_int(r[cols["chapter"]])
+        ver = _coerce_int(r[cols["verse"]])
+        if chap is None or ver is None:
+            continue
+        out.append({
+            "rownum": _coerce_int(r[cols["rownum"]]), "chapter": chap, "verse": ver,
+            **{k: _get(r, k) for k in ("audio_id", "sanskrit", "roman", "colloquial", "translation",
+                                       "capsule_url", "word_meanings", "title",
+                                       "commentary1", "commentary2", "commentary3")},
+        })
+    return out
+
+def _legacy_upsert(conn, rows: List[Dict]) -> int:
+    """The pre-vectorization bulk_upsert: every row written and re-rendered."""
+    from . import db
+    keys = []
+    for r in rows:
+        db.upsert_verse(conn, r)
+        keys.append((r["chapter"], r["verse"]))
+    db.refresh_render(conn, keys)
+    db.bump_verses_rev(conn)
+    conn.commit()
+    return len(rows)
+
+def _scaled_sheet(path: str, scale: int) -> bytes:
+    df = pd.read_csv(path, keep_default_na=False)
+    chap_col = next(c for c in df.columns if c.strip().lower() == "chapter")
+    base = pd.to_numeric(df[chap_col], errors="coerce")
+    copies = []
+    for i in range(scale):
+        d = df.copy()
+        d[chap_col] = (base + 18 * i).astype("Int64")
+        copies.append(d)
+    return pd.concat(copies, ignore_index=True).to_csv(index=False).encode("utf-8")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark sheet ingest strategies")
+    ap.add_argument("sheet", nargs="?", default="gita_verses_clean.csv")
+    ap.add_argument("--scale", type=int, default=10, help="copies of the sheet to ingest")
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="gita-ingest-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "gita.db")
+    from . import db
+    from .ingest import load_sheet_to_rows
+
+    data = _scaled_sheet(args.sheet, args.scale)
+    loaders = {
+        "legacy": lambda: _load_rows_iterrows(data),
+        "executemany": lambda: load_sheet_to_rows(data, "sheet.csv"),
+        "staging": lambda: load_sheet_to_rows(data, "sheet.csv"),
+    }
+    upserts = {
+        "legacy": _legacy_upsert,
+        "executemany": lambda conn, rows: db.bulk_upsert(conn, rows, strategy="executemany"),
+        "staging": lambda conn, rows: db.bulk_upsert(conn, rows, strategy="staging"),
+    }
+
+    results: Dict[str, Dict[str, List[float]]] = {}
+    n_rows = 0
+    for r in range(args.rounds):
+        for name, load in loaders.items():
+            db.close_pool()
+            db.DB_PATH = os.path.join(tmp, f"{name}-{r}.db")
+            db.init_db()
+            res = results.setdefault(name, {"load": [], "fresh": [], "reingest": []})
+
+            t0 = time.perf_counter()
+            rows = load()
+            res["load"].append((time.perf_counter() - t0) * 1000.0)
+            n_rows = len(rows)
+            for phase in ("fresh", "reingest"):
+                batch = [dict(x) for x in rows]
+                t0 = time.perf_counter()
+                with db.writer() as conn:
+                    upserts[name](conn, batch)
+                res[phase].append((time.perf_counter() - t0) * 1000.0)
+            db.close_pool()
+            os.remove(db.DB_PATH)
+
+    print(f"[bench_ingest] rows={n_rows} rounds={args.rounds} (median ms)")
+    print(f"{'strategy':12s} {'load':>9s} {'fresh':>9s} {'reingest':>9s} {'total':>9s}")
+    totals = {}
+    for name, res in results.items():
+        med = {k: statistics.median(v) for k, v in res.items()}
+        totals[name] = med["load"] + med["fresh"]
+        print(f"{name:12s} {med['load']:9.1f} {med['fresh']:9.1f} {med['reingest']:9.1f} {totals[name]:9.1f}")
+    reingest = {name: statistics.median(res["reingest"]) for name, res in results.items()}
+    for name in ("executemany", "staging"):
+        print(f"[bench_ingest] {name}: load+fresh {totals['legacy'] / max(totals[name], 1e-6):.1f}x, "
+              f"reingest {reingest['legacy'] / max(reingest[name], 1e-6):.1f}x vs legacy")
+
+if __name__ == "__main__":
+    main()
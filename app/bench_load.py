@@ -0,0 +1,368 @@
+# app/bench_load.py — end-to-end load test for /ask across routing modes
+#
+# Usage:
+#   python -m app.bench_load --spawn [--sheet gita_verses_clean.csv] [--workers 1]
+#   python -m app.bench_load --url http://127.0.0.1:8000
+#   common: [--duration 30 | --requests N] [--concurrency 16] [--mix explain=3,rag=1,...]
+#           [--stream] [--no-cache] [--seed 1] [--out bench.json] [--compare old.json]
+#
+# --spawn boots a throwaway app (scratch DB, seeded canonicals, ingested sheet)
+# under uvicorn with LLM_PROVIDER=stub, so results do not depend on a live API;
+# LLM_STUB_* variables in the environment shape the stub's latency. Against
+# --url, point the target at the stub yourself (LLM_PROVIDER=stub or
+# app.llm_stub_server) to keep runs comparable.
+#
+# Each kind in the mix is a question family aimed at one route. The report
+# gives p50/p95/p99 latency, requests/sec and error rate per kind (plus the
+# modes the server actually answered with) and overall, and is written as JSON
+# together with the git commit so runs can be compared with --compare.
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+DEFAULT_MIX = "explain=3,word_meaning=1,canonical=2,thematic_list=1,definition=1,model_only=2,rag=1"
+
+# The stub answers "" for the guarded model-only prompt of rag probes, so /ask
+# falls through to RAG synthesis over FTS hits (see llm.STUB_EMPTY_MATCH).
+RAG_TAG = "(rag probe)"
+RAG_EMPTY_MATCH = r"\AYou are a Bhagavad Gita tutor\. Answer clearly.*\(rag probe\)"
+
+_TOPICS = ["devotion", "duty", "the mind", "surrender", "desire", "equanimity", "knowledge",
+           "sacrifice", "faith", "food", "meditation", "the self", "action", "anger", "renunciation"]
+_TERMS = ["dharma", "yoga", "karma", "bhakti", "atman", "maya", "guna", "prakriti",
+          "sannyasa", "tapas", "yajna", "moksha", "samadhi", "buddhi", "ahankara"]
+_SITUATIONS = ["my work feels pointless", "a friend has betrayed me", "I am afraid of failing",
+               "my family disagrees with my choices", "I cannot stop worrying about money",
+               "success makes me restless", "I feel jealous of colleagues", "grief will not lift"]
+_ACTIONS = ["stay calm", "keep doing my duty", "find meaning", "make a hard decision",
+            "let go of resentment", "stay disciplined", "treat people fairly", "rest without guilt"]
+_VERSES_PER_CHAPTER = [47, 72, 43, 42, 29, 47, 30, 28, 34, 42, 55, 20, 35, 27, 20, 24, 28, 78]
+
+def _canonical_questions() -> List[str]:
+    from .seed_answers import ANSWERS
+    return list(ANSWERS)
+
+def make_question(kind: str, rng: random.Random, canon: List[str]) -> str:
+    if kind in ("explain", "word_meaning"):
+        ch = rng.randint(1, 18)
+        v = rng.randint(1, _VERSES_PER_CHAPTER[ch - 1])
+        return f"Explain {ch}:{v}" if kind == "explain" else f"Word meaning of {ch}:{v}"
+    if kind == "canonical":
+        return rng.choice(canon)
+    if kind == "thematic_list":
+        return f"Which verses talk about {rng.choice(_TOPICS)}?"
+    if kind == "definition":
+        return f"What is {rng.choice(_TERMS)}?"
+    if kind == "model_only":
+        return f"How can I {rng.choice(_ACTIONS)} when {rng.choice(_SITUATIONS)}?"
+    if kind == "rag":
+        return f"How does Krishna connect {rng.choice(_TOPICS)} with {rng.choice(_TOPICS)} {RAG_TAG}"
+    raise ValueError(f"unknown kind: {kind}")
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    out = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        k, _, w = part.partition("=")
+        out.append((k.strip(), float(w or 1)))
+    return out
+
+def percentile(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[i]
+
+def summarize(lat_ms: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    s = sorted(lat_ms)
+    n = len(s) + errors
+    return {
+        "requests": n,
+        "errors": errors,
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "rps": round(n / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(s, 50), 1),
+        "p95_ms": round(percentile(s, 95), 1),
+        "p99_ms": round(percentile(s, 99), 1),
+        "mean_ms": round(sum(s) / len(s), 1) if s else 0.0,
+        "max_ms": round(s[-1], 1) if s else 0.0,
+    }
+
+# ---------- HTTP ----------
+class Target:
+    def __init__(self, url: str, timeout: float):
+        u = urlparse(url)
+        self.host, self.port = u.hostname or "127.0.0.1", u.port or 80
+        self.timeout = timeout
+
+    def connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+def _post_json(conn: http.client.HTTPConnection, path: str, body: Dict[str, Any]) -> Tuple[int, bytes]:
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    rsp = conn.getresponse()
+    return rsp.status, rsp.read()
+
+def _ask_plain(conn, q: str, no_cache: bool) -> Tuple[bool, str, Optional[float]]:
+    status, raw = _post_json(conn, "/ask", {"question": q, "no_cache": no_cache})
+    if status != 200:
+        return False, f"http_{status}", None
+    return True, json.loads(raw).get("mode", "?"), None
+
+def _ask_stream(conn, q: str, no_cache: bool, t0: float) -> Tuple[bool, str, Optional[float]]:
+    conn.request("POST", "/ask/stream", body=json.dumps({"question": q, "no_cache": no_cache}),
+                 headers={"Content-Type": "application/json"})
+    rsp = conn.getresponse()
+    if rsp.status != 200:
+        rsp.read()
+        return False, f"http_{rsp.status}", None
+    mode, ttft, event = "?", None, ""
+    for line in rsp:  # chunked SSE; the server closes the body after "result"
+        line = line.decode("utf-8").rstrip("\n")
+        if line.startswith("event: "):
+            event = line[7:]
+            if event == "token" and ttft is None:
+                ttft = (time.perf_counter() - t0) * 1000.0
+        elif line.startswith("data: ") and event == "result":
+            mode = json.loads(line[6:]).get("mode", mode)
+    return mode != "?", mode, ttft
+
+# ---------- run ----------
+def run_load(target: Target, mix: List[Tuple[str, float]], concurrency: int,
+             duration: Optional[float], total: Optional[int], stream: bool, no_cache: bool,
+             seed: int, warmup: float) -> Dict[str, Any]:
+    canon = _canonical_questions()
+    kinds = [k for k, _ in mix]
+    weights = [w for _, w in mix]
+    lock = threading.Lock()
+    lat: Dict[str, List[float]] = {k: [] for k in kinds}
+    ttft: Dict[str, List[float]] = {k: [] for k in kinds}
+    errs: Dict[str, int] = {k: 0 for k in kinds}
+    modes: Dict[str, Dict[str, int]] = {k: {} for k in kinds}
+    issued = [0]
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def worker(idx: int) -> None:
+        rng = random.Random(seed * 1000 + idx)
+        conn = target.connect()
+        while not stop.is_set():
+            with lock:
+                measured = measuring.is_set()  # warmup requests finishing late are not counted
+                if total is not None and measured:
+                    if issued[0] >= total:
+                        break
+                    issued[0] += 1
+            kind = rng.choices(kinds, weights)[0]
+            q = make_question(kind, rng, canon)
+            t0 = time.perf_counter()
+            try:
+                ok, mode, first = (_ask_stream(conn, q, no_cache, t0) if stream
+                                   else _ask_plain(conn, q, no_cache))
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                ok, mode, first = False, type(e).__name__, None
+            if not ok:  # the server may drop keep-alive after an error; don't charge the next request
+                conn.close()
+                conn = target.connect()
+            ms = (time.perf_counter() - t0) * 1000.0
+            if not measured:
+                continue
+            with lock:
+                modes[kind][mode] = modes[kind].get(mode, 0) + 1
+                if ok:
+                    lat[kind].append(ms)
+                    if first is not None:
+                        ttft[kind].append(first)
+                else:
+                    errs[kind] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    if warmup > 0:
+        time.sleep(warmup)
+    with lock:
+        for k in kinds:
+            lat[k].clear(); ttft[k].clear(); errs[k] = 0; modes[k].clear()
+    measuring.set()
+    t_start = time.perf_counter()
+    if total is None:
+        time.sleep(duration or 30.0)
+        stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_start
+
+    by_kind = {}
+    for k in kinds:
+        row = summarize(lat[k], errs[k], elapsed)
+        row["modes"] = dict(sorted(modes[k].items(), key=lambda kv: -kv[1]))
+        if ttft[k]:
+            row["ttft_p50_ms"] = round(percentile(sorted(ttft[k]), 50), 1)
+            row["ttft_p95_ms"] = round(percentile(sorted(ttft[k]), 95), 1)
+        by_kind[k] = row
+    overall = summarize([x for k in kinds for x in lat[k]], sum(errs.values()), elapsed)
+    return {"elapsed_sec": round(elapsed, 2), "overall": overall, "by_kind": by_kind}
+
+# ---------- spawn ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_ready(target: Target, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with code {proc.returncode}")
+        try:
+            conn = target.connect()
+            conn.request("GET", "/debug/pool")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("app did not become ready")
+
+def spawn_app(sheet: str, workers: int, app_log: Optional[str]) -> Tuple[subprocess.Popen, str, str]:
+    """Scratch DB + seeded canonicals + ingested sheet, served by uvicorn on the stub LLM."""
+    tmp = tempfile.mkdtemp(prefix="gita-load-")
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": os.path.join(tmp, "gita.db"),
+        "DATA_DIR": tmp,
+        "CHROMA_DIR": os.path.join(tmp, "chroma"),
+        "LLM_PROVIDER": "stub",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "stub",
+        "LLM_STUB_EMPTY_MATCH": env.get("LLM_STUB_EMPTY_MATCH") or RAG_EMPTY_MATCH,
+    })
+    for mod in ("app.migrate", "app.seed_questions", "app.migrate", "app.seed_answers"):
+        subprocess.run([sys.executable, "-m", mod], env=env, check=True, stdout=subprocess.DEVNULL)
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(app_log, "ab") if app_log else subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    target = Target(url, 30.0)
+    try:
+        _wait_ready(target, proc)
+        boundary = "----gitabench"
+        with open(sheet, "rb") as f:
+            data = f.read()
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+                f"filename=\"{os.path.basename(sheet)}\"\r\nContent-Type: text/csv\r\n\r\n").encode() \
+            + data + f"\r\n--{boundary}--\r\n".encode()
+        conn = target.connect()
+        conn.request("POST", "/ingest_sheet_sql", body=body,
+                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        rsp = conn.getresponse()
+        print(f"[bench_load] ingest: {rsp.status} {rsp.read()[:200].decode(errors='replace')}")
+        conn.close()
+    except Exception:
+        proc.terminate()
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return proc, url, tmp
+
+# ---------- report ----------
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def print_report(res: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    cols = ("requests", "rps", "error_rate", "p50_ms", "p95_ms", "p99_ms")
+    print(f"{'kind':14s} " + " ".join(f"{c:>10s}" for c in cols) + "  modes")
+    rows = list(res["by_kind"].items()) + [("overall", res["overall"])]
+    base_rows = {**(baseline or {}).get("by_kind", {}), "overall": (baseline or {}).get("overall", {})}
+    for name, r in rows:
+        line = f"{name:14s} " + " ".join(f"{r.get(c, 0):>10}" for c in cols)
+        if name != "overall":
+            line += "  " + ",".join(f"{m}:{n}" for m, n in r.get("modes", {}).items())
+        print(line)
+        b = base_rows.get(name)
+        if b:
+            deltas = []
+            for c in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+                if b.get(c):
+                    deltas.append(f"{c} {100.0 * (r.get(c, 0) - b[c]) / b[c]:+.1f}%")
+            print(f"{'':14s} vs baseline: " + ", ".join(deltas))
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test /ask across routing modes")
+    ap.add_argument("--url", help="running app to target")
+    ap.add_argument("--spawn", action="store_true", help="boot a scratch app on the stub LLM")
+    ap.add_argument("--sheet", default="gita_verses_clean.csv", help="verse sheet ingested with --spawn")
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers with --spawn")
+    ap.add_argument("--app-log", help="append the spawned app's stderr (tracebacks) to this file")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"kind=weight list (default {DEFAULT_MIX})")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds to measure (ignored with --requests)")
+    ap.add_argument("--requests", type=int, help="stop after this many measured requests")
+    ap.add_argument("--warmup", type=float, default=3.0, help="seconds of unmeasured load first")
+    ap.add_argument("--stream", action="store_true", help="use /ask/stream and also report time to first token")
+    ap.add_argument("--no-cache", action="store_true", help="send no_cache=true (LLM + semantic caches bypassed)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--label", default="")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to diff against")
+    args = ap.parse_args()
+    if bool(args.url) == bool(args.spawn):
+        ap.error("pass exactly one of --url or --spawn")
+
+    proc, tmp, url = None, None, args.url
+    if args.spawn:
+        proc, url, tmp = spawn_app(args.sheet, args.workers, args.app_log)
+    try:
+        mix = parse_mix(args.mix)
+        print(f"[bench_load] {url} concurrency={args.concurrency} "
+              f"{'requests=%d' % args.requests if args.requests else 'duration=%ss' % args.duration} "
+              f"stream={args.stream} no_cache={args.no_cache}")
+        res = run_load(Target(url, args.timeout), mix, args.concurrency,
+                       None if args.requests else args.duration, args.requests,
+                       args.stream, args.no_cache, args.seed, args.warmup)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=15)
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    res["meta"] = {
+        "label": args.label, "commit": _git_commit(), "url": url, "spawned": args.spawn,
+        "workers": args.workers if args.spawn else None, "mix": dict(mix), "concurrency": args.concurrency,
+        "stream": args.stream, "no_cache": args.no_cache, "seed": args.seed, "started_at": time.time(),
+        "stub": {k: v for k, v in os.environ.items() if k.startswith("LLM_STUB_")},
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(res, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+        print(f"[bench_load] wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
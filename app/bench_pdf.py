@@ -0,0 +1,70 @@
+# app/bench_pdf.py — PDF page extraction throughput: serial vs process pool
+#
+# Usage:  python -m app.bench_pdf book.pdf [--repeat 10] [--workers 1,2,4] [--per-task 8] [--rounds 3]
+#
+# --repeat concatenates the PDF with itself to stand in for a full-length
+# commentary. Each worker count runs pdf_extract.iter_pages over the whole
+# document and reports pages/sec (median of --rounds); workers=1 is the
+# in-process serial path. The pool is started and warmed once per worker
+# count before timing, as it is in a long-running server. Every run is
+# checked against the serial output so ordering bugs show up as failures.
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import List, Optional
+
+from pypdf import PdfReader, PdfWriter
+
+from . import pdf_extract
+
+def _repeated(path: str, repeat: int) -> str:
+    """A temp copy of path concatenated repeat times (always a copy: rounds touch its mtime)."""
+    w = PdfWriter()
+    for _ in range(max(1, repeat)):
+        w.append(PdfReader(path))
+    fd, out = tempfile.mkstemp(prefix="gita-bench-", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        w.write(f)
+    return out
+
+def _run(path: str, workers: int, per_task: int) -> List[Optional[str]]:
+    return [text for _, text in pdf_extract.iter_pages(path, workers=workers, pages_per_task=per_task)]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark PDF page extraction")
+    ap.add_argument("pdf")
+    ap.add_argument("--repeat", type=int, default=1, help="concatenate the PDF this many times")
+    ap.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="comma-separated worker counts")
+    ap.add_argument("--per-task", type=int, default=pdf_extract.PAGES_PER_TASK)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    pdf_extract.PARALLEL_MIN_PAGES = 0  # benchmark the pool even on short inputs
+    path = _repeated(args.pdf, args.repeat)
+    try:
+        n = pdf_extract.page_count(path)
+        counts = sorted({max(1, int(w)) for w in args.workers.split(",") if w.strip()})
+        print(f"[bench_pdf] pages={n} per_task={args.per_task} rounds={args.rounds} cpus={os.cpu_count()}")
+        reference = _run(path, 1, args.per_task)
+        base = None
+        for w in counts:
+            if w > 1:
+                pdf_extract._pool(w).submit(pdf_extract.page_count, path).result()  # warm
+            secs = []
+            for r in range(args.rounds):
+                os.utime(path, ns=(time.time_ns(), time.time_ns() + r))  # cold per-worker reader cache
+                t0 = time.perf_counter()
+                out = _run(path, w, args.per_task)
+                secs.append(time.perf_counter() - t0)
+                if out != reference:
+                    raise SystemExit(f"[bench_pdf] workers={w}: output differs from serial extraction")
+            med = statistics.median(secs)
+            base = base or med
+            print(f"workers={w:<3d} {n / med:8.1f} pages/s  {med:7.2f}s  {base / med:5.2f}x")
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# app/bench_startup.py — boot-time benchmark for db.init_db
+#
+# Usage:  python -m app.bench_startup [sheet.csv] [rounds]
+#
+# Loads the sheet into a scratch DB, then times a worker boot two ways:
+#   full   — init_db(force=True): schema DDL + full verses_fts rebuild (the old boot path)
+#   warm   — init_db(): fingerprint check only
+# Each round closes the pool first so every boot opens fresh connections,
+# as a newly spawned worker process would.
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+def main():
+    sheet = sys.argv[1] if len(sys.argv) > 1 else "gita_verses_clean.csv"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    tmp = tempfile.mkdtemp(prefix="gita-bench-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "gita.db")
+    from . import db
+    from .ingest import load_sheet_to_rows
+
+    db.DB_PATH = os.environ["DB_PATH"]
+    with open(sheet, "rb") as f:
+        rows = load_sheet_to_rows(f.read(), sheet)
+    db.init_db()
+    with db.writer() as conn:
+        db.bulk_upsert(conn, rows)
+
+    def boot(force: bool) -> float:
+        db.close_pool()
+        t0 = time.perf_counter()
+        db.init_db(force=force)
+        return (time.perf_counter() - t0) * 1000.0
+
+    results = {}
+    for label, force in (("full", True), ("warm", False)):
+        boot(force)  # settle page cache
+        samples = [boot(force) for _ in range(rounds)]
+        results[label] = samples
+        print(f"[bench_startup] {label:5s} verses={len(rows)} rounds={rounds} "
+              f"median={statistics.median(samples):.2f}ms max={max(samples):.2f}ms")
+
+    speedup = statistics.median(results["full"]) / max(statistics.median(results["warm"]), 1e-6)
+    print(f"[bench_startup] warm boot is {speedup:.0f}x faster than a full rebuild")
+    db.close_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# app/bench_vectors.py — commentary vector backends: Chroma vs memory-mapped index
+#
+# Usage:  python -m app.bench_vectors [--chunks 20000] [--dim 1536] [--queries 200]
+#
+# Builds the same synthetic corpus (random unit vectors, 18 "commentators",
+# page/chapter metadata) in a scratch Chroma collection and in mmap indexes
+# stored as float32 and float16, then reports per backend:
+#   build   — time to add every chunk
+#   cold    — fresh interpreter: import, open and answer one query (a worker boot)
+#   p50/p95 — warm top-8 query latency, unfiltered and with a commentator filter
+#   disk    — bytes on disk
+# recall@8 is measured against exact float32 search, so the float16 and
+# Chroma (approximate HNSW) rows show what they give up; uniformly random
+# vectors are the worst case for HNSW, real embeddings cluster and recall
+# much better.
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+COLD_SNIPPET = r"""
+import sys, time, numpy as np
+t0 = time.perf_counter()
+kind, path, dim = sys.argv[1], sys.argv[2], int(sys.argv[3])
+q = np.random.default_rng(1).normal(size=dim).astype(np.float32)
+if kind == "chroma":
+    import chromadb
+    col = chromadb.PersistentClient(path=path).get_collection("bench")
+    col.query(query_embeddings=[q.tolist()], n_results=8)
+else:
+    from app.vector_index import MmapIndex
+    MmapIndex(path).query(q, 8)
+print(time.perf_counter() - t0)
+"""
+
+def _disk(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+def _latency(fn: Callable[[np.ndarray], List[str]], queries: np.ndarray) -> Dict[str, float]:
+    ms = []
+    for q in queries:
+        t = time.perf_counter()
+        fn(q)
+        ms.append((time.perf_counter() - t) * 1000.0)
+    ms.sort()
+    return {"p50": statistics.median(ms), "p95": ms[int(0.95 * (len(ms) - 1))]}
+
+def _cold(kind: str, path: str, dim: int) -> float:
+    out = subprocess.run([sys.executable, "-c", COLD_SNIPPET, kind, path, str(dim)],
+                         capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return float(out.stdout.strip().splitlines()[-1]) * 1000.0
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark commentary vector backends")
+    ap.add_argument("--chunks", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--skip-chroma", action="store_true")
+    args = ap.parse_args()
+
+    from .vector_index import MmapIndex
+
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(args.chunks, args.dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    ids = [f"c{i}" for i in range(args.chunks)]
+    docs = [f"chunk {i}" for i in range(args.chunks)]
+    metas = [{"topic": "gita", "commentator": f"commentator-{i % 18}", "page": i % 400, "chapter": i % 18 + 1}
+             for i in range(args.chunks)]
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    where = {"commentator": "commentator-3"}
+    exact = [set(np.argsort(-(vecs @ (q / np.linalg.norm(q))))[:8]) for q in queries]
+
+    def recall(fn) -> float:
+        got = [{int(i[1:]) for i in fn(q)} for q in queries]
+        return sum(len(g & e) for g, e in zip(got, exact)) / (8.0 * len(queries))
+
+    tmp = tempfile.mkdtemp(prefix="gita-vectors-")
+    rows = []
+    try:
+        backends = [("mmap/float32", "float32"), ("mmap/float16", "float16")]
+        if not args.skip_chroma:
+            backends.append(("chroma", None))
+        for name, dtype in backends:
+            path = os.path.join(tmp, name.replace("/", "-"))
+            t0 = time.perf_counter()
+            if dtype:
+                index = MmapIndex(path, dtype)
+                for a in range(0, args.chunks, 5000):
+                    index.add(ids[a:a + 5000], vecs[a:a + 5000], docs[a:a + 5000], metas[a:a + 5000])
+                search = lambda q, w=None: index.query(q, 8, w)["ids"][0]
+            else:
+                import chromadb
+                col = chromadb.PersistentClient(path=path).create_collection(
+                    "bench", metadata={"hnsw:space": "cosine"}, embedding_function=None)
+                for a in range(0, args.chunks, 5000):
+                    col.add(ids=ids[a:a + 5000], embeddings=vecs[a:a + 5000].tolist(),
+                            documents=docs[a:a + 5000], metadatas=metas[a:a + 5000])
+                search = lambda q, w=None: col.query(query_embeddings=[q.tolist()], n_results=8, where=w)["ids"][0]
+            build = (time.perf_counter() - t0) * 1000.0
+            rows.append((name, build, _cold("chroma" if not dtype else "mmap", path, args.dim),
+                         _latency(search, queries), _latency(lambda q: search(q, where), queries),
+                         recall(search), _disk(path)))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"[bench_vectors] chunks={args.chunks} dim={args.dim} queries={args.queries} (ms)")
+    print(f"{'backend':14s} {'build':>9s} {'cold':>8s} {'p50':>7s} {'p95':>7s} "
+          f"{'filt p50':>9s} {'filt p95':>9s} {'recall@8':>9s} {'disk MB':>8s}")
+    for name, build, cold, lat, flat, rec, disk in rows:
+        print(f"{name:14s} {build:9.0f} {cold:8.0f} {lat['p50']:7.2f} {lat['p95']:7.2f} "
+              f"{flat['p50']:9.2f} {flat['p95']:9.2f} {rec:9.3f} {disk / 1e6:8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# app/canonical_index.py — in-memory matcher for the canonical question bank
+#
+# The canonical fast path used to hand raw user text to questions_fts MATCH,
+# which raises on punctuation ("?"), and then fell back to a LIKE '%q%' scan.
+# Matching now goes, cheapest first:
+#
+#   1. exact   — normalized question text or a question_aliases entry (dict hit)
+#   2. trigram — Dice similarity over character trigrams of the content words
+#                (question templates and function words dropped, see STOPWORDS),
+#                accepted above CANONICAL_TRIGRAM_MIN. Candidates come from the
+#                postings of the query's rarest trigrams only: a Dice score of
+#                t needs at least t*|q|/(2-t) shared trigrams, so any match
+#                shares one of the |q| - that + 1 rarest (prefix filtering).
+#                Of those, trigrams in more than CANONICAL_TRIGRAM_MAX_DF of
+#                the entries (leftover template words) are not probed.
+#   3. fts     — questions_fts over the content words (all must occur), taking
+#                the best bm25 hit whose own content words are covered by the
+#                query to at least CANONICAL_FTS_MIN_COVERAGE
+#
+# Both thresholds are calibrated on paraphrase / non-paraphrase pairs by
+# `python -m app.bench_canonical`, which also times matching at 4k+ questions.
+#
+# Like verse_store, the index is an immutable snapshot swapped on reload; other
+# workers notice the question bank changing via a cheap count/max(id)
+# signature checked at most every CANONICAL_INDEX_CHECK_SEC.
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .db import get_conn
+
+TRIGRAM_MIN = float(os.getenv("CANONICAL_TRIGRAM_MIN", "0.62"))
+TRIGRAM_MAX_DF = float(os.getenv("CANONICAL_TRIGRAM_MAX_DF", "0.02"))  # share of entries; see _trigram_match
+FTS_MIN_COVERAGE = float(os.getenv("CANONICAL_FTS_MIN_COVERAGE", "0.67"))
+CHECK_SEC = float(os.getenv("CANONICAL_INDEX_CHECK_SEC", "5"))
+FTS_MAX_TOKENS = 16
+FTS_CANDIDATES = 5  # bm25-best hits checked for coverage
+DF_FLOOR = 64  # probe cap never below this, so small banks probe every trigram
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Words that only carry the question template ("which verses talk about",
+# "what does the gita say about", "according to the gita"), not its topic.
+# Interrogatives that change the intent (how, why, who, when, where) and
+# negation stay.
+STOPWORDS = frozenset("""
+    a an the of to in on for from about as at by with into per and or
+    is are was were be been being am do does did doing can could should would will shall may might must
+    i me my we us our you your one someone he his it its this that these those there
+    what which whom whose
+    gita gitas bhagavad bhagavadgita krishna lord
+    say says said tell tells teach teaches taught talk talks speak speaks mention mentions
+    describe describes described explain explains define defines according view
+    verse verses chapter chapters sloka slokas shloka shlokas
+    meaning significance importance important concept idea notion
+    please really exactly also
+""".split())
+
+def normalize(text: str) -> str:
+    """Lowercase, strip diacritics and punctuation, collapse whitespace."""
+    t = unicodedata.normalize("NFKD", text or "")
+    t = "".join(c for c in t if not unicodedata.combining(c)).lower()
+    return " ".join(_WORD_RE.findall(t.replace("_", " ")))
+
+def content(norm: str) -> str:
+    """Normalized text without STOPWORDS; '' when nothing topical is left."""
+    return " ".join(w for w in norm.split() if w not in STOPWORDS)
+
+def _trigrams(key: str) -> FrozenSet[str]:
+    s = f"  {key} "
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2))
+
+def fts_query(text: str) -> str:
+    """Content words as quoted FTS5 strings (implicit AND); '' if nothing usable."""
+    toks = content(normalize(text)).split()[:FTS_MAX_TOKENS]
+    return " ".join(f'"{t}"' for t in toks)
+
+class _Index:
+    __slots__ = ("questions", "terms", "exact", "entries", "grams", "postings", "sig", "loaded_at")
+
+    def __init__(self, questions: Dict[int, Tuple[str, int]], texts: List[Tuple[str, int, str]], sig: tuple):
+        # questions: qid -> (question_text, priority); texts: (text, qid, kind)
+        self.questions = questions
+        # qid -> content words of the question text, for the FTS coverage check
+        self.terms: Dict[int, FrozenSet[str]] = {
+            qid: frozenset(content(normalize(text)).split()) for qid, (text, _) in questions.items()
+        }
+        self.exact: Dict[str, Tuple[int, str]] = {}
+        # one trigram entry per distinct content key: (qid, key) and its trigram set
+        self.entries: List[Tuple[int, str]] = []
+        self.grams: List[FrozenSet[str]] = []
+        self.postings: Dict[str, List[int]] = {}
+        rank = lambda qid: (questions[qid][1], qid)
+        keys: Dict[str, int] = {}
+        for text, qid, kind in texts:
+            norm = normalize(text)
+            if not norm:
+                continue
+            prev = self.exact.get(norm)
+            if prev is None or rank(qid) < rank(prev[0]):
+                self.exact[norm] = (qid, kind)
+            key = content(norm)
+            if key and (key not in keys or rank(qid) < rank(keys[key])):
+                keys[key] = qid
+        for key, qid in keys.items():
+            i = len(self.entries)
+            g = _trigrams(key)
+            self.entries.append((qid, key))
+            self.grams.append(g)
+            for tg in g:
+                self.postings.setdefault(tg, []).append(i)
+        self.sig = sig
+        self.loaded_at = time.time()
+
+_INDEX: Optional[_Index] = None
+_LOAD_LOCK = threading.Lock()
+_last_check = 0.0
+
+def _signature(conn: sqlite3.Connection) -> tuple:
+    try:
+        row = conn.execute("""
+            SELECT (SELECT count(*) FROM questions), (SELECT max(id) FROM questions),
+                   (SELECT count(*) FROM question_aliases), (SELECT max(id) FROM question_aliases)
+        """).fetchone()
+        return tuple(row)
+    except sqlite3.OperationalError:  # question bank not migrated yet
+        return ()
+
+def reload() -> int:
+    """Rebuild the index from questions + question_aliases. Returns the entry count."""
+    global _INDEX, _last_check
+    with _LOAD_LOCK:
+        conn = get_conn()
+        sig = _signature(conn)
+        questions: Dict[int, Tuple[str, int]] = {}
+        texts: List[Tuple[str, int, str]] = []
+        if sig:
+            for r in conn.execute("SELECT id, question_text, priority FROM questions"):
+                questions[r["id"]] = (r["question_text"], r["priority"] if r["priority"] is not None else 5)
+                texts.append((r["question_text"], r["id"], "question"))
+            for r in conn.execute("SELECT question_id, alias FROM question_aliases"):
+                if r["question_id"] in questions:
+                    texts.append((r["alias"], r["question_id"], "alias"))
+        _INDEX = _Index(questions, texts, sig)
+        _last_check = time.time()
+        return len(_INDEX.entries)
+
+def _index() -> _Index:
+    global _last_check
+    idx = _INDEX
+    if idx is None:
+        reload()
+        return _INDEX
+    now = time.time()
+    if now - _last_check > CHECK_SEC:
+        _last_check = now
+        if _signature(get_conn()) != idx.sig:
+            reload()
+            return _INDEX
+    return idx
+
+def _hit(idx: _Index, qid: int, how: str, score: float) -> Dict[str, Any]:
+    text, priority = idx.questions[qid]
+    return {"id": qid, "question_text": text, "priority": priority, "match": how, "score": round(score, 3)}
+
+def _trigram_match(idx: _Index, key: str) -> Optional[Tuple[int, float]]:
+    q = _trigrams(key)
+    nq, t = len(q), TRIGRAM_MIN
+    # Dice >= t needs >= t*nq/(2-t) shared trigrams and an entry size within
+    # [t*nq/(2-t), (2-t)*nq/t]; only the rarest nq - need + 1 query trigrams are probed.
+    need = max(1, math.ceil(t * nq / (2.0 - t) - 1e-9)) if t > 0 else 1
+    lo, hi = t * nq / (2.0 - t), ((2.0 - t) * nq / t if t > 0 else math.inf)
+    probe = sorted(q, key=lambda tg: len(idx.postings.get(tg, ())))[:nq - need + 1]
+    cap = max(DF_FLOOR, TRIGRAM_MAX_DF * len(idx.entries))
+    cand = set()
+    for n, tg in enumerate(probe):
+        ids = idx.postings.get(tg, ())
+        if n and len(ids) > cap:
+            break  # the rest are as common or more: a match on those alone is a template match
+        cand.update(ids)
+    best: Optional[Tuple[Tuple[float, int, int], int, float]] = None
+    for i in cand:
+        g = idx.grams[i]
+        if not lo <= len(g) <= hi:
+            continue
+        score = 2.0 * len(q & g) / (nq + len(g))
+        if score < t:
+            continue
+        qid = idx.entries[i][0]
+        key = (-score, idx.questions[qid][1], qid)
+        if best is None or key < best[0]:
+            best = (key, qid, score)
+    return (best[1], best[2]) if best else None
+
+def _fts_match(idx: _Index, key: str, conn: sqlite3.Connection) -> Optional[Tuple[int, float]]:
+    terms = key.split()[:FTS_MAX_TOKENS]
+    fq = " ".join(f'"{t}"' for t in terms)
+    try:
+        rows = conn.execute("""
+            SELECT q.id
+            FROM questions_fts
+            JOIN questions q ON q.id = questions_fts.rowid
+            WHERE questions_fts MATCH ?
+            ORDER BY bm25(questions_fts) ASC, q.priority ASC
+            LIMIT ?
+        """, (fq, FTS_CANDIDATES)).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    # every query term is in the hit (implicit AND); also require the query to
+    # cover most of the hit, so "what is yoga" does not land on "what is karma yoga"
+    words = set(terms)
+    for row in rows:
+        have = idx.terms.get(row["id"])
+        if not have:
+            continue
+        cover = len(words & have) / len(have)
+        if cover >= FTS_MIN_COVERAGE:
+            return row["id"], cover
+    return None
+
+def match(q: str, conn: Optional[sqlite3.Connection] = None, fuzzy: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Best canonical question for q, or None:
+    {"id", "question_text", "priority", "match": exact|alias|trigram|fts, "score"}.
+    fuzzy=False stops after the exact/alias lookup.
+    """
+    idx = _index()
+    if not idx.questions:
+        return None
+    norm = normalize(q)
+    if not norm:
+        return None
+
+    hit = idx.exact.get(norm)
+    if hit:
+        return _hit(idx, hit[0], "exact" if hit[1] == "question" else "alias", 1.0)
+
+    key = content(norm)
+    if not fuzzy or not key:
+        return None
+
+    tri = _trigram_match(idx, key)
+    if tri:
+        return _hit(idx, tri[0], "trigram", tri[1])
+
+    fts = _fts_match(idx, key, conn or get_conn())
+    if fts and fts[0] in idx.questions:
+        return _hit(idx, fts[0], "fts", fts[1])
+    return None
+
+def stats() -> Dict[str, Any]:
+    idx = _index()
+    return {
+        "questions": len(idx.questions),
+        "entries": len(idx.entries),
+        "trigrams": len(idx.postings),
+        "trigram_min": TRIGRAM_MIN,
+        "fts_min_coverage": FTS_MIN_COVERAGE,
+        "loaded_at": idx.loaded_at,
+    }
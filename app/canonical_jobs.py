@@ -0,0 +1,378 @@
+# app/canonical_jobs.py — concurrent canonical answer generation
+#
+# A run fans generation calls out over a thread pool. Every call first takes
+# budget from a shared RateLimiter (requests/min and tokens/min token buckets),
+# so the pool can be wide without tripping provider limits. When a call is
+# rate limited anyway (HTTP 429), the limiter pauses every worker for the
+# Retry-After / exponential backoff interval and cuts its effective rate
+# (multiplicative decrease); successful calls restore it step by step
+# (additive increase). Results are written in batches by the coordinating
+# thread, one transaction per CANONICAL_FLUSH_ROWS rows or CANONICAL_FLUSH_SEC.
+#
+# Jobs started through /admin/canonicals/start are durable: the job and one
+# row per question live in SQLite (jobs / job_items), so progress survives a
+# restart and every uvicorn worker reports the same status. The process running
+# a job holds a lease (lease_owner / lease_until) that it renews while flushing
+# results; other processes wait on standby and take the job over, resuming at
+# the first pending item, only once the lease has expired.
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import llm
+from .db import get_conn, writer
+
+WORKERS = int(os.getenv("CANONICAL_WORKERS", "8"))
+RPM = float(os.getenv("CANONICAL_RPM", "300"))
+TPM = float(os.getenv("CANONICAL_TPM", "200000"))
+MAX_ATTEMPTS = int(os.getenv("CANONICAL_MAX_ATTEMPTS", "5"))
+FLUSH_ROWS = int(os.getenv("CANONICAL_FLUSH_ROWS", "25"))
+FLUSH_SEC = float(os.getenv("CANONICAL_FLUSH_SEC", "2"))
+LEASE_SEC = float(os.getenv("CANONICAL_LEASE_SEC", "30"))
+BACKOFF_BASE_SEC = 2.0
+BACKOFF_MAX_SEC = 60.0
+MIN_RATE_FRACTION = 0.1   # floor for the adaptive rate scale
+RECOVER_STEP = 0.05       # scale regained per successful call
+
+class TokenBucket:
+    """Continuous-refill bucket holding at most one minute of budget."""
+
+    def __init__(self, per_min: float):
+        self.per_min = per_min
+        self.tokens = per_min
+        self.stamp = time.monotonic()
+
+    def _refill(self, scale: float) -> None:
+        now = time.monotonic()
+        cap = self.per_min * scale
+        self.tokens = min(cap, self.tokens + (now - self.stamp) * cap / 60.0)
+        self.stamp = now
+
+    def wait_for(self, n: float, scale: float) -> float:
+        """Seconds until n tokens are available (0 if they are now). n is capped at capacity."""
+        self._refill(scale)
+        n = min(n, self.per_min * scale)
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) * 60.0 / (self.per_min * scale)
+
+    def take(self, n: float, scale: float) -> None:
+        self.tokens -= min(n, self.per_min * scale)
+
+class RateLimiter:
+    """Requests/min + tokens/min budget with AIMD adjustment on 429s."""
+
+    def __init__(self, rpm: float = RPM, tpm: float = TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, est_tokens: float, stop: Optional[Callable[[], bool]] = None) -> bool:
+        """Block until one request of ~est_tokens fits the budget. False if stop() fired first."""
+        while True:
+            if stop and stop():
+                return False
+            with self._lock:
+                delay = max(
+                    self.paused_until - time.monotonic(),
+                    self.requests.wait_for(1, self.scale),
+                    self.tokens.wait_for(est_tokens, self.scale),
+                )
+                if delay <= 0:
+                    self.requests.take(1, self.scale)
+                    self.tokens.take(est_tokens, self.scale)
+                    return True
+            time.sleep(min(delay, 0.5))
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.scale = min(1.0, self.scale + RECOVER_STEP)
+
+    def on_throttle(self, retry_after: float) -> None:
+        with self._lock:
+            self.throttled += 1
+            self.scale = max(MIN_RATE_FRACTION, self.scale * 0.5)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": round(self.requests.per_min * self.scale, 1),
+                "tpm": round(self.tokens.per_min * self.scale, 1),
+                "scale": round(self.scale, 3),
+                "throttled": self.throttled,
+                "paused_sec": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            }
+
+# Shared by every run in this process: the provider limits are per API key
+limiter = RateLimiter()
+
+def _retry_after(e: Exception, attempt: int) -> float:
+    return llm.retry_delay(e, attempt, BACKOFF_BASE_SEC, BACKOFF_MAX_SEC)
+
+def _call_with_backoff(generate: Callable[[Dict[str, Any]], Any], item: Dict[str, Any],
+                       est_tokens: float, stop: Callable[[], bool]) -> Tuple[str, Any]:
+    """("ok", result) | ("error", message) | ("stopped", None)"""
+    err = ""
+    for attempt in range(MAX_ATTEMPTS):
+        if not limiter.acquire(est_tokens, stop):
+            return "stopped", None
+        try:
+            result = generate(item)
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"
+            code = llm.error_status(e)
+            if code == 429:
+                limiter.on_throttle(_retry_after(e, attempt))
+                continue
+            if code is not None and code < 500:
+                break  # client error: retrying will not help
+            time.sleep(_retry_after(e, attempt))
+            continue
+        limiter.on_success()
+        return "ok", result
+    return "error", err
+
+def run_pool(items: List[Dict[str, Any]],
+             generate: Callable[[Dict[str, Any]], Any],
+             store_batch: Callable[[List[Tuple[Dict[str, Any], Any]]], None],
+             *,
+             store_failed: Optional[Callable[[List[Tuple[Dict[str, Any], str]]], None]] = None,
+             cost: Callable[[Dict[str, Any]], float] = lambda item: 2000.0,
+             workers: Optional[int] = None,
+             should_stop: Callable[[], bool] = lambda: False,
+             on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Generate every item on a pool of `workers` threads and hand finished
+    (item, result) pairs to store_batch in batches, from this thread only.
+    Items that exhausted their retries go to store_failed as (item, error).
+    on_progress receives {"processed", "stored", "errors", "last_error", "in_flight"}.
+    """
+    workers = max(1, workers or WORKERS)
+    counts: Dict[str, Any] = {"processed": 0, "stored": 0, "errors": 0, "last_error": "", "in_flight": 0}
+    buf: List[Tuple[Dict[str, Any], Any]] = []
+    failed: List[Tuple[Dict[str, Any], str]] = []
+    last_flush = time.monotonic()
+
+    def flush() -> None:
+        nonlocal buf, failed, last_flush
+        if buf:
+            store_batch(buf)
+            counts["stored"] += len(buf)
+            buf = []
+        if failed:
+            if store_failed:
+                store_failed(failed)
+            failed = []
+        last_flush = time.monotonic()
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="canonical")
+    try:
+        pending = {pool.submit(_call_with_backoff, generate, it, cost(it), should_stop): it for it in items}
+        while pending:
+            done, _ = wait(pending, timeout=FLUSH_SEC, return_when=FIRST_COMPLETED)
+            for f in done:
+                item = pending.pop(f)
+                if f.cancelled():
+                    continue
+                status, value = f.result()
+                if status == "ok":
+                    buf.append((item, value))
+                    counts["processed"] += 1
+                elif status == "error":
+                    counts["errors"] += 1
+                    counts["processed"] += 1
+                    counts["last_error"] = value
+                    failed.append((item, value))
+            if len(buf) + len(failed) >= FLUSH_ROWS or time.monotonic() - last_flush >= FLUSH_SEC:
+                flush()
+            counts["in_flight"] = min(workers, len(pending))
+            if on_progress:
+                on_progress(dict(counts))
+            if should_stop():
+                for f in pending:
+                    f.cancel()
+        flush()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    counts["in_flight"] = 0
+    if on_progress:
+        on_progress(dict(counts))
+    return counts
+
+# ---------- Durable jobs ----------
+KIND = "canonicals"
+ACTIVE = ("queued", "running")
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def create_job(conn: sqlite3.Connection, items: List[Dict[str, Any]], params: Dict[str, Any]) -> int:
+    """Insert a queued job and its items (call under db.writer())."""
+    cur = conn.execute(
+        "INSERT INTO jobs(kind, status, params, total, created_at) VALUES(?, 'queued', ?, ?, ?)",
+        (KIND, json.dumps(params), len(items), time.time()),
+    )
+    job_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO job_items(job_id, seq, payload) VALUES(?,?,?)",
+        [(job_id, i, json.dumps(it, ensure_ascii=False)) for i, it in enumerate(items)],
+    )
+    return job_id
+
+def active_job(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        "SELECT * FROM jobs WHERE kind=? AND status IN ('queued','running') ORDER BY id DESC LIMIT 1", (KIND,)
+    ).fetchone()
+
+def lease_alive(job: sqlite3.Row) -> bool:
+    return bool(job["lease_owner"]) and (job["lease_until"] or 0) > time.time()
+
+def reopen_last(conn: sqlite3.Connection) -> Optional[int]:
+    """Re-queue the latest stopped/failed job so its pending items run again (call under db.writer())."""
+    job = conn.execute("SELECT id, status FROM jobs WHERE kind=? ORDER BY id DESC LIMIT 1", (KIND,)).fetchone()
+    if not job or job["status"] not in ("stopped", "failed"):
+        return None
+    conn.execute("UPDATE jobs SET status='queued', stop_requested=0, finished_at=NULL WHERE id=?", (job["id"],))
+    return job["id"]
+
+def request_stop(conn: sqlite3.Connection) -> int:
+    """Flag the active job to stop (call under db.writer()). Returns rows flagged."""
+    return conn.execute(
+        "UPDATE jobs SET stop_requested=1 WHERE kind=? AND status IN ('queued','running')", (KIND,)
+    ).rowcount
+
+def status(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Latest job as stored, plus progress, throughput and ETA for the current run."""
+    job = conn.execute("SELECT * FROM jobs WHERE kind=? ORDER BY id DESC LIMIT 1", (KIND,)).fetchone()
+    if not job:
+        return {"running": False, "done": False, "job_id": None, "processed": 0, "total": 0, "percent": 0.0,
+                "limiter": limiter.stats()}
+    out = dict(job)
+    out["job_id"] = out.pop("id")
+    out["params"] = json.loads(out["params"] or "{}")
+    out["running"] = out["status"] in ACTIVE
+    out["done"] = not out["running"]
+    out["stop"] = bool(out.pop("stop_requested"))
+    out["lease_alive"] = lease_alive(job)
+    out["lease_is_self"] = out["lease_owner"] == OWNER
+    out["percent"] = round(100.0 * out["processed"] / out["total"], 2) if out["total"] else 0.0
+    # throughput since this run (re)started; ETA assumes it holds for the remainder
+    start = out.pop("run_started_at")
+    base = out.pop("run_base") or 0
+    end = out["finished_at"] or time.time()
+    elapsed = max(1e-6, end - start) if start else 0.0
+    rate = (out["processed"] - base) / elapsed if elapsed else 0.0
+    out["elapsed_sec"] = round(elapsed, 1)
+    out["per_min"] = round(rate * 60.0, 2)
+    out["eta_sec"] = round((out["total"] - out["processed"]) / rate, 1) if rate and out["running"] else None
+    out["limiter"] = limiter.stats()
+    return out
+
+def _claim(job_id: int) -> bool:
+    now = time.time()
+    with writer() as conn:
+        return conn.execute("""
+            UPDATE jobs SET lease_owner=?, lease_until=?, status='running',
+                   started_at=COALESCE(started_at, ?), run_started_at=?, run_base=processed
+            WHERE id=? AND status IN ('queued','running')
+              AND (lease_owner IS NULL OR lease_owner=? OR lease_until < ?)
+        """, (OWNER, now + LEASE_SEC, now, now, job_id, OWNER, now)).rowcount == 1
+
+def _renew(job_id: int) -> Tuple[bool, bool]:
+    """Extend our lease -> (still_held, stop_requested)."""
+    with writer() as conn:
+        if conn.execute("UPDATE jobs SET lease_until=? WHERE id=? AND lease_owner=?",
+                        (time.time() + LEASE_SEC, job_id, OWNER)).rowcount != 1:
+            return False, True
+        row = conn.execute("SELECT stop_requested FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return True, bool(row["stop_requested"])
+
+def _finish(job_id: int, status: str, error: str = "") -> None:
+    with writer() as conn:
+        conn.execute("""
+            UPDATE jobs SET status=?, finished_at=?, lease_owner=NULL, lease_until=0,
+                   last_error=CASE WHEN ?<>'' THEN ? ELSE last_error END
+            WHERE id=? AND lease_owner=?
+        """, (status, time.time(), error, error, job_id, OWNER))
+
+def run_job(job_id: int,
+            generate: Callable[[Dict[str, Any]], Any],
+            store_one: Callable[[sqlite3.Connection, Dict[str, Any], Any], None],
+            *,
+            cost: Callable[[Dict[str, Any]], float] = lambda item: 2000.0) -> bool:
+    """
+    Run (or resume) a durable job in this thread. While another live process
+    holds the lease this waits on standby and takes over if the lease lapses.
+    store_one(conn, item, result) persists one result inside the batch
+    transaction. Returns True if this process ran the job to an end state.
+    """
+    while not _claim(job_id):
+        job = get_conn().execute("SELECT status, lease_until FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if not job or job["status"] not in ACTIVE:
+            return False
+        time.sleep(max(1.0, (job["lease_until"] or 0) - time.time()) + random.uniform(0, 1.0))
+
+    conn = get_conn()
+    params = json.loads(conn.execute("SELECT params FROM jobs WHERE id=?", (job_id,)).fetchone()["params"] or "{}")
+    items = [
+        dict(json.loads(r["payload"]), _seq=r["seq"])
+        for r in conn.execute(
+            "SELECT seq, payload FROM job_items WHERE job_id=? AND status='pending' ORDER BY seq", (job_id,)
+        )
+    ]
+    state = {"held": True, "stop": False, "renewed": time.monotonic()}
+
+    # Both flushes update the job row first, guarded by lease_owner, in the same
+    # transaction as the results: once another process has taken the job over,
+    # the batch is dropped (the new owner regenerates those items) and the run stops.
+    def store_batch(batch: List[Tuple[Dict[str, Any], Any]]) -> None:
+        now = time.time()
+        with writer() as wc:
+            if wc.execute("UPDATE jobs SET processed=processed+?, stored=stored+?, lease_until=? "
+                          "WHERE id=? AND lease_owner=?",
+                          (len(batch), len(batch), now + LEASE_SEC, job_id, OWNER)).rowcount != 1:
+                state["held"] = False
+                return
+            for item, result in batch:
+                store_one(wc, item, result)
+            wc.executemany("UPDATE job_items SET status='done', error='', updated_at=? WHERE job_id=? AND seq=?",
+                           [(now, job_id, item["_seq"]) for item, _ in batch])
+
+    def store_failed(failed: List[Tuple[Dict[str, Any], str]]) -> None:
+        now = time.time()
+        with writer() as wc:
+            if wc.execute("UPDATE jobs SET processed=processed+?, errors=errors+?, last_error=? "
+                          "WHERE id=? AND lease_owner=?",
+                          (len(failed), len(failed), failed[-1][1], job_id, OWNER)).rowcount != 1:
+                state["held"] = False
+                return
+            wc.executemany("UPDATE job_items SET status='error', error=?, updated_at=? WHERE job_id=? AND seq=?",
+                           [(err, now, job_id, item["_seq"]) for item, err in failed])
+
+    def on_progress(counts: Dict[str, Any]) -> None:
+        # doubles as the stop-flag poll, so keep it near the flush cadence
+        if time.monotonic() - state["renewed"] >= min(LEASE_SEC / 3, FLUSH_SEC):
+            state["held"], state["stop"] = _renew(job_id)
+            state["renewed"] = time.monotonic()
+
+    try:
+        run_pool(items, generate, store_batch, store_failed=store_failed, cost=cost,
+                 workers=params.get("workers"), should_stop=lambda: state["stop"] or not state["held"],
+                 on_progress=on_progress)
+    except Exception as e:
+        _finish(job_id, "failed", f"{type(e).__name__}: {e}")
+        return True
+    if not state["held"]:
+        return False  # lease lost mid-run: the new owner carries on
+    held, stop = _renew(job_id)
+    _finish(job_id, "stopped" if stop else "done")
+    return True
@@ -1,16 +1,154 @@
+import hashlib
+import json
 import os
 import re
 import sqlite3
-from typing import Any, Dict, Iterable, List, Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .render import render_verse
 
 DB_PATH = os.getenv("DB_PATH", os.path.join(os.getenv("DATA_DIR", "/data"), "gita.db"))
+STMT_CACHE_SIZE = int(os.getenv("SQLITE_STMT_CACHE", "256"))
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# ---------- Connection pool ----------
+# Readers: one long-lived connection per thread (event loop thread, threadpool
+# workers), opened lazily and kept warm so the page cache and the prepared
+# statement cache survive across requests.
+# Writer: a single connection shared by ingest and canonical jobs, serialized
+# by _WRITER_LOCK so concurrent writers never fight over SQLite's write lock.
+
+_local = threading.local()
+_POOL_LOCK = threading.Lock()
+_WRITER_LOCK = threading.RLock()
+_writer: Optional[sqlite3.Connection] = None
+_writer_depth = 0  # nesting of `with writer()` in the thread holding _WRITER_LOCK
+_readers: List[sqlite3.Connection] = []
+_generation = 0
+_dir_ready = False
+_POOL_STATS = {
+    "readers_opened": 0,
+    "readers_reused": 0,
+    "writer_opened": 0,
+    "writer_acquired": 0,
+    "writer_wait_ms": 0.0,
+    "closed": 0,
+}
 
-def get_conn() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _bump(key: str, by: float = 1) -> None:
+    with _POOL_LOCK:
+        _POOL_STATS[key] += by
+
+def _open_conn(read_only: bool) -> sqlite3.Connection:
+    global _dir_ready
+    if not _dir_ready:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        _dir_ready = True
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=STMT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")  # per-connection; not persisted by SCHEMA_SQL
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
     return conn
 
+def get_conn() -> sqlite3.Connection:
+    """Return this thread's pooled read connection (opened on first use)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "generation", -1) == _generation:
+        _bump("readers_reused")
+        return conn
+    conn = _open_conn(read_only=True)
+    with _POOL_LOCK:
+        _readers.append(conn)
+        _POOL_STATS["readers_opened"] += 1
+        _local.generation = _generation
+    _local.conn = conn
+    return conn
+
+@contextmanager
+def writer() -> Iterator[sqlite3.Connection]:
+    """
+    Borrow the single writer connection. Commits on success, rolls back on error.
+    Re-entrant within a thread: only the outermost block commits or rolls back.
+    A nested block runs inside a SAVEPOINT, so an error in it undoes just its
+    own writes (and propagates); the outer transaction stays atomic.
+    """
+    global _writer, _writer_depth
+    t0 = time.perf_counter()
+    with _WRITER_LOCK:
+        _bump("writer_wait_ms", (time.perf_counter() - t0) * 1000.0)
+        _bump("writer_acquired")
+        if _writer is None:
+            _writer = _open_conn(read_only=False)
+            _bump("writer_opened")
+        conn = _writer
+        depth = _writer_depth
+        _writer_depth += 1
+        try:
+            if depth == 0:
+                try:
+                    yield conn
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            else:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")  # so releasing the savepoint cannot commit early
+                sp = f"writer_{depth}"
+                conn.execute(f"SAVEPOINT {sp}")
+                try:
+                    yield conn
+                except Exception:
+                    conn.execute(f"ROLLBACK TO {sp}")
+                    conn.execute(f"RELEASE {sp}")
+                    raise
+                conn.execute(f"RELEASE {sp}")
+        finally:
+            _writer_depth = depth
+
+def open_pool() -> None:
+    """Warm the calling thread's reader and the writer (used at app startup)."""
+    get_conn()
+    with writer():
+        pass
+
+def close_pool() -> None:
+    """Close every pooled connection; threads reopen lazily on next use."""
+    global _writer, _generation
+    with _WRITER_LOCK:
+        with _POOL_LOCK:
+            conns = list(_readers)
+            _readers.clear()
+            if _writer is not None:
+                conns.append(_writer)
+                _writer = None
+            _generation += 1
+            for c in conns:
+                try:
+                    c.close()
+                except Exception:
+                    pass
+            _POOL_STATS["closed"] += len(conns)
+    _local.conn = None
+
+def pool_stats() -> Dict[str, Any]:
+    with _POOL_LOCK:
+        out: Dict[str, Any] = dict(_POOL_STATS)
+        out["readers_open"] = len(_readers)
+        out["writer_open"] = _writer is not None
+    out["writer_wait_ms"] = round(out["writer_wait_ms"], 3)
+    out["stmt_cache_size"] = STMT_CACHE_SIZE
+    return out
+
+# Bump on any change to SCHEMA_SQL or the verses_fts layout. The fingerprint
+# below also hashes the DDL itself, so an edit without a bump is still caught.
+SCHEMA_VERSION = 11
+
 SCHEMA_SQL = r"""
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous=NORMAL;
@@ -33,20 +171,158 @@ CREATE TABLE IF NOT EXISTS verses (
   title TEXT,
   UNIQUE(chapter, verse)
 );
+
+-- Display-ready text per verse, written at ingest (see render.py)
+CREATE TABLE IF NOT EXISTS verse_render (
+  chapter INTEGER NOT NULL,
+  verse INTEGER NOT NULL,
+  explain TEXT NOT NULL,
+  list_title TEXT,
+  list_snippet TEXT,
+  rag_block TEXT,
+  rag_block_c2 TEXT,
+  PRIMARY KEY(chapter, verse)
+);
+
+-- Read-only view of the verses_fts terms per column, with document counts
+-- (see query_norm.py); resolves verses_fts by name, so FTS rebuilds keep it valid
+CREATE VIRTUAL TABLE IF NOT EXISTS verses_fts_vocab USING fts5vocab('verses_fts', 'col');
+
+CREATE TABLE IF NOT EXISTS schema_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+
+-- Completion cache for /ask LLM calls (see llm_cache.py)
+CREATE TABLE IF NOT EXISTS llm_cache (
+  key TEXT PRIMARY KEY,
+  model TEXT,
+  completion TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  last_used REAL NOT NULL,
+  hits INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used);
+
+-- Question-embedding answer cache for near-duplicate questions (see semantic_cache.py)
+CREATE TABLE IF NOT EXISTS semantic_cache (
+  id INTEGER PRIMARY KEY,
+  question TEXT NOT NULL,
+  model TEXT NOT NULL,
+  embedding BLOB NOT NULL,
+  response TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  last_used REAL NOT NULL,
+  hits INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_semantic_cache_last_used ON semantic_cache(last_used);
+
+-- Query-text embeddings for retrieval and the semantic cache (see embed_cache.py)
+CREATE TABLE IF NOT EXISTS embed_cache (
+  key TEXT PRIMARY KEY,
+  model TEXT NOT NULL,
+  embedding BLOB NOT NULL,
+  created_at REAL NOT NULL,
+  last_used REAL NOT NULL,
+  hits INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_embed_cache_last_used ON embed_cache(last_used);
+
+-- What each canonical answer pair was generated from (see main._canonical_input_hash)
+CREATE TABLE IF NOT EXISTS canonical_inputs (
+  question_id INTEGER PRIMARY KEY,
+  input_hash TEXT NOT NULL,
+  model TEXT NOT NULL,
+  updated_at REAL NOT NULL
+);
+
+-- Durable background jobs (see canonical_jobs.py); a lease marks the process running one
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY,
+  kind TEXT NOT NULL,
+  status TEXT NOT NULL,               -- queued | running | done | stopped | failed
+  params TEXT NOT NULL DEFAULT '{}',
+  total INTEGER DEFAULT 0,
+  processed INTEGER DEFAULT 0,
+  stored INTEGER DEFAULT 0,
+  errors INTEGER DEFAULT 0,
+  last_error TEXT DEFAULT '',
+  stop_requested INTEGER DEFAULT 0,
+  lease_owner TEXT,
+  lease_until REAL DEFAULT 0,
+  created_at REAL NOT NULL,
+  started_at REAL,
+  finished_at REAL,
+  run_started_at REAL,
+  run_base INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs(kind, status);
+
+CREATE TABLE IF NOT EXISTS job_items (
+  job_id INTEGER NOT NULL,
+  seq INTEGER NOT NULL,
+  payload TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',  -- pending | done | error
+  error TEXT DEFAULT '',
+  updated_at REAL,
+  PRIMARY KEY(job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_job_items_status ON job_items(job_id, status);
 """
 
-def init_db(conn: Optional[sqlite3.Connection] = None) -> None:
-    close_after = False
-    if conn is None:
-        conn = get_conn()
-        close_after = True
+def schema_fingerprint() -> str:
+    h = hashlib.sha256()
+    h.update(str(SCHEMA_VERSION).encode())
+    h.update(SCHEMA_SQL.encode())
+    full_cols = FTS_BASE_COLS + ["commentary1", "commentary2", "commentary3"]
+    h.update(_fts_create_sql(full_cols).encode())
+    for stmt in _fts_trigger_sql(full_cols):
+        h.update(stmt.encode())
+    return h.hexdigest()[:16]
+
+def _read_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
     try:
-        conn.executescript(SCHEMA_SQL)
-        conn.commit()
-        ensure_fts(conn)
-    finally:
-        if close_after:
-            conn.close()
+        row = conn.execute("SELECT value FROM schema_meta WHERE key=?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None  # fresh or pre-versioning database
+    return row[0] if row else None
+
+def _write_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        "INSERT INTO schema_meta(key, value) VALUES(?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (key, value),
+    )
+
+def verses_rev(conn: sqlite3.Connection) -> str:
+    """Opaque marker that changes whenever verse rows are (re)ingested."""
+    return _read_meta(conn, "verses_rev") or ""
+
+def bump_verses_rev(conn: sqlite3.Connection) -> None:
+    _write_meta(conn, "verses_rev", f"{time.time():.6f}")
+
+def init_db(conn: Optional[sqlite3.Connection] = None, force: bool = False) -> None:
+    """
+    Ensure schema + FTS. When schema_meta already holds the current fingerprint
+    this is a single indexed SELECT: no DDL, no writer lock, no reindexing.
+    `force=True` re-runs everything (including an FTS rebuild).
+    """
+    if conn is None:
+        if not force and _read_meta(get_conn(), "fingerprint") == schema_fingerprint():
+            return
+        with writer() as w:
+            init_db(w, force=force)
+        return
+    fp = schema_fingerprint()
+    if not force and _read_meta(conn, "fingerprint") == fp:
+        return
+    conn.executescript(SCHEMA_SQL)
+    conn.commit()
+    ensure_fts(conn, force=force)
+    refresh_render(conn)  # backfill verses ingested before verse_render existed
+    _write_meta(conn, "schema_version", str(SCHEMA_VERSION))
+    _write_meta(conn, "fingerprint", fp)
+    conn.commit()
 
 # ---------- FTS helpers ----------
 
@@ -69,43 +345,213 @@ def _fts_sanitize(q: str) -> str:
     return q
 
 
-def ensure_fts(conn: sqlite3.Connection) -> None:
+FTS_BASE_COLS = ["title", "translation", "word_meanings", "roman", "colloquial"]
+FTS_TRIGGERS = ("verses_ai", "verses_ad", "verses_au")
+# Prefix indexes for 2- and 3-character prefixes, so short `kar*` / `dh*`
+# queries are one index lookup instead of a scan over every matching term.
+FTS_PREFIX = "2 3"
+
+# bm25 weight per indexed column (higher = a hit there counts for more).
+# Override with e.g. FTS_WEIGHTS="title=12,translation=6"; unnamed columns keep
+# their default. Weights are passed positionally in FTS column order, and
+# bm25 ignores weights past the last column, so one constant ranking
+# expression fits the index with or without the commentary columns.
+_FTS_WEIGHT_DEFAULTS = {
+    "title": 10.0, "translation": 5.0, "colloquial": 2.0, "word_meanings": 2.0, "roman": 1.0,
+    "commentary1": 1.0, "commentary2": 1.0, "commentary3": 1.0,
+}
+
+def _fts_weights(spec: str) -> Dict[str, float]:
+    weights = dict(_FTS_WEIGHT_DEFAULTS)
+    for part in (spec or "").split(","):
+        name, _, val = part.partition("=")
+        if name.strip() in weights and val.strip():
+            weights[name.strip()] = float(val)
+    return weights
+
+FTS_WEIGHTS = _fts_weights(os.getenv("FTS_WEIGHTS", ""))
+FTS_RANK_EXPR = "bm25(" + ", ".join(f"{FTS_WEIGHTS[c]:g}" for c in FTS_BASE_COLS + [
+    "commentary1", "commentary2", "commentary3"]) + ")"
+
+def _fts_columns(conn: sqlite3.Connection) -> List[str]:
     cols = [r[1] for r in conn.execute("PRAGMA table_info(verses)").fetchall()]
-    fts_cols = ["title", "translation", "word_meanings", "roman", "colloquial"]
+    fts_cols = list(FTS_BASE_COLS)
     for c in ("commentary1", "commentary2", "commentary3"):
         if c in cols:
             fts_cols.append(c)
+    return fts_cols
 
-    conn.execute("DROP TABLE IF EXISTS verses_fts")
+def _fts_create_sql(fts_cols: List[str]) -> str:
     col_defs = ",\n  ".join(fts_cols)
-    conn.execute(f"CREATE VIRTUAL TABLE verses_fts USING fts5(\n  {col_defs},\n  content='',\n  tokenize='unicode61 remove_diacritics 2'\n)")
+    return (
+        f"CREATE VIRTUAL TABLE verses_fts USING fts5(\n  {col_defs},\n"
+        "  content='verses',\n  content_rowid='id',\n"
+        f"  prefix='{FTS_PREFIX}',\n"
+        "  tokenize='unicode61 remove_diacritics 2'\n)"
+    )
 
+def _fts_is_current(conn: sqlite3.Connection, fts_cols: List[str]) -> bool:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='verses_fts'").fetchone()
+    # Covers legacy contentless tables (content=''), which cannot be maintained
+    # row-by-row, and any change to the column set, prefix or tokenizer options
+    if not row or row[0] != _fts_create_sql(fts_cols):
+        return False
+    trig = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name='verses'")}
+    return set(FTS_TRIGGERS) <= trig
+
+def _fts_trigger_sql(fts_cols: List[str]) -> List[str]:
     col_csv = ",".join(fts_cols)
-    conn.execute(f"INSERT INTO verses_fts(rowid,{col_csv}) SELECT rowid,{col_csv} FROM verses")
-    conn.commit()
+    new_vals = ",".join(f"new.{c}" for c in fts_cols)
+    old_vals = ",".join(f"old.{c}" for c in fts_cols)
+    changed = " OR ".join(f"old.{c} IS NOT new.{c}" for c in fts_cols)
+    return [
+        f"""CREATE TRIGGER verses_ai AFTER INSERT ON verses BEGIN
+  INSERT INTO verses_fts(rowid,{col_csv}) VALUES (new.id,{new_vals});
+END""",
+        f"""CREATE TRIGGER verses_ad AFTER DELETE ON verses BEGIN
+  INSERT INTO verses_fts(verses_fts,rowid,{col_csv}) VALUES ('delete',old.id,{old_vals});
+END""",
+        f"""CREATE TRIGGER verses_au AFTER UPDATE OF {col_csv} ON verses
+WHEN {changed}
+BEGIN
+  INSERT INTO verses_fts(verses_fts,rowid,{col_csv}) VALUES ('delete',old.id,{old_vals});
+  INSERT INTO verses_fts(rowid,{col_csv}) VALUES (new.id,{new_vals});
+END""",
+    ]
+
+def ensure_fts(conn: sqlite3.Connection, force: bool = False) -> None:
+    """
+    Make sure verses_fts exists as an external-content index over `verses`,
+    kept in sync by insert/update/delete triggers. Upserts therefore only
+    reindex the rows whose indexed text actually changed.
+    The index is rebuilt only when the indexed column set or table options
+    differ, a legacy contentless table is found, or `force` is set; the swap happens in one transaction so
+    readers never see an empty index.
+    """
+    fts_cols = _fts_columns(conn)
+    if not force and _fts_is_current(conn, fts_cols):
+        return
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for t in FTS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+        conn.execute("DROP TABLE IF EXISTS verses_fts")
+        conn.execute(_fts_create_sql(fts_cols))
+        for stmt in _fts_trigger_sql(fts_cols):
+            conn.execute(stmt)
+        conn.execute("INSERT INTO verses_fts(verses_fts) VALUES('rebuild')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+VERSE_COLS = (
+    "rownum", "audio_id", "chapter", "verse", "sanskrit", "roman", "colloquial", "translation",
+    "commentary1", "commentary2", "commentary3", "capsule_url", "word_meanings", "title",
+)
+_VERSE_COL_CSV = ",".join(VERSE_COLS)
+_VERSE_UPDATE = ",".join(f"{c}=excluded.{c}" for c in VERSE_COLS if c not in ("chapter", "verse"))
+# One constant statement, so the writer's statement cache keeps it prepared across ingests
+UPSERT_VERSE_SQL = (
+    f"INSERT INTO verses ({_VERSE_COL_CSV}) VALUES ({','.join('?' * len(VERSE_COLS))}) "
+    f"ON CONFLICT(chapter,verse) DO UPDATE SET {_VERSE_UPDATE}"
+)
+
+# bulk_upsert strategies:
+#   executemany — one prepared upsert run over all rows (default)
+#   staging     — executemany into a TEMP table, then one INSERT ... SELECT ... ON CONFLICT merge
+INGEST_STRATEGY = os.getenv("INGEST_STRATEGY", "executemany").strip().lower()
+
+def _verse_params(row: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(row.get(c, "") if c.startswith("commentary") else row.get(c) for c in VERSE_COLS)
 
 def upsert_verse(conn: sqlite3.Connection, row: Dict[str, Any]) -> None:
-    sql = (
-        "INSERT INTO verses (rownum,audio_id,chapter,verse,sanskrit,roman,colloquial,translation,commentary1,commentary2,commentary3,capsule_url,word_meanings,title) "
-        "VALUES (:rownum,:audio_id,:chapter,:verse,:sanskrit,:roman,:colloquial,:translation,:commentary1,:commentary2,:commentary3,:capsule_url,:word_meanings,:title) "
-        "ON CONFLICT(chapter,verse) DO UPDATE SET "
-        "rownum=excluded.rownum,audio_id=excluded.audio_id,sanskrit=excluded.sanskrit,roman=excluded.roman,"
-        "colloquial=excluded.colloquial,translation=excluded.translation,"
-        "commentary1=excluded.commentary1,commentary2=excluded.commentary2,commentary3=excluded.commentary3,"
-        "capsule_url=excluded.capsule_url,word_meanings=excluded.word_meanings,title=excluded.title;"
+    conn.execute(UPSERT_VERSE_SQL, _verse_params(row))
+
+def _verses_by_key(conn: sqlite3.Connection, keys: List[Tuple[int, int]], cols: str = "*") -> List[sqlite3.Row]:
+    out: List[sqlite3.Row] = []
+    for i in range(0, len(keys), 400):  # 800 bound parameters per query
+        part = keys[i:i + 400]
+        out += conn.execute(
+            f"SELECT {cols} FROM verses WHERE (chapter, verse) IN (VALUES "
+            + ",".join("(?,?)" for _ in part) + ")",
+            [x for k in part for x in k],
+        ).fetchall()
+    return out
+
+def refresh_render(conn: sqlite3.Connection, keys: Optional[Iterable[Tuple[int, int]]] = None) -> int:
+    """
+    Recompute verse_render for the given (chapter, verse) keys, or, with no
+    keys, for every verse that does not have a render row yet.
+    """
+    if keys is None:
+        rows = conn.execute("""
+            SELECT v.* FROM verses v
+            LEFT JOIN verse_render r ON r.chapter = v.chapter AND r.verse = v.verse
+            WHERE r.chapter IS NULL
+        """).fetchall()
+    else:
+        rows = _verses_by_key(conn, list(dict.fromkeys(keys)))
+    out = []
+    for r in rows:
+        d = dict(r)
+        rv = render_verse(d)
+        out.append((d["chapter"], d["verse"], json.dumps(rv["explain"], ensure_ascii=False),
+                    rv["list_title"], rv["list_snippet"], rv["rag_block"], rv["rag_block_c2"]))
+    conn.executemany(
+        "INSERT INTO verse_render(chapter, verse, explain, list_title, list_snippet, rag_block, rag_block_c2) "
+        "VALUES(?,?,?,?,?,?,?) ON CONFLICT(chapter, verse) DO UPDATE SET "
+        "explain=excluded.explain, list_title=excluded.list_title, list_snippet=excluded.list_snippet, "
+        "rag_block=excluded.rag_block, rag_block_c2=excluded.rag_block_c2",
+        out,
     )
-    conn.execute(sql, row)
+    return len(out)
 
-def bulk_upsert(conn: sqlite3.Connection, rows: Iterable[Dict[str, Any]]) -> int:
-    count = 0
-    for r in rows:
-        r.setdefault("commentary1", "")
-        r.setdefault("commentary2", "")
-        r.setdefault("commentary3", "")
-        upsert_verse(conn, r)
-        count += 1
-    conn.commit()
-    return count
+def _merge_via_staging(conn: sqlite3.Connection, params: List[Tuple[Any, ...]]) -> None:
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS verses_stage AS SELECT {_VERSE_COL_CSV} FROM verses WHERE 0")
+    conn.execute("DELETE FROM verses_stage")
+    conn.executemany(
+        f"INSERT INTO verses_stage ({_VERSE_COL_CSV}) VALUES ({','.join('?' * len(VERSE_COLS))})", params
+    )
+    # WHERE true disambiguates the upsert clause; ORDER BY rowid keeps "last row wins" for duplicates
+    conn.execute(
+        f"INSERT INTO verses ({_VERSE_COL_CSV}) SELECT {_VERSE_COL_CSV} FROM verses_stage WHERE true "
+        f"ORDER BY rowid ON CONFLICT(chapter,verse) DO UPDATE SET {_VERSE_UPDATE}"
+    )
+    conn.execute("DELETE FROM verses_stage")
+
+def bulk_upsert(conn: sqlite3.Connection, rows: Iterable[Dict[str, Any]],
+                strategy: Optional[str] = None, commit: bool = True) -> int:
+    """
+    Upsert verse rows (dicts keyed by VERSE_COLS; commentary columns optional),
+    refresh their verse_render rows and bump verses_rev, in one transaction
+    (left open with commit=False, for callers writing several batches).
+    Rows identical to what is stored are skipped, so re-uploading a sheet only
+    writes (and re-renders / re-indexes) the verses that changed.
+    Returns the number of input rows.
+    """
+    strategy = strategy or INGEST_STRATEGY
+    if strategy not in ("executemany", "staging"):
+        raise ValueError(f"unknown ingest strategy: {strategy!r}")
+    params = [_verse_params(r) for r in rows]
+    ci, vi = VERSE_COLS.index("chapter"), VERSE_COLS.index("verse")
+    latest = {(p[ci], p[vi]): p for p in params}  # duplicate keys: last row wins
+    stored = {(r["chapter"], r["verse"]): tuple(r) for r in _verses_by_key(conn, list(latest), _VERSE_COL_CSV)}
+    changed = [p for k, p in latest.items() if stored.get(k) != p]
+
+    if strategy == "staging":
+        _merge_via_staging(conn, changed)
+    else:
+        conn.executemany(UPSERT_VERSE_SQL, changed)
+    if changed:
+        refresh_render(conn, [(p[ci], p[vi]) for p in changed])
+        bump_verses_rev(conn)
+    if commit:
+        conn.commit()
+    return len(params)
 
 def fetch_exact(conn: sqlite3.Connection, chap: int, ver: int) -> Optional[sqlite3.Row]:
     cur = conn.execute("SELECT * FROM verses WHERE chapter=? AND verse=?", (chap, ver))
@@ -125,19 +571,37 @@ STOP = {
     "talk", "talks", "about", "on"
 }
 
-def search_fts(conn: sqlite3.Connection, q: str, limit: int = 10) -> List[sqlite3.Row]:
+# Ranked top-k in two steps. The inner query never touches `verses`: bm25 only
+# reads the index (doclists and per-row token counts), `rank MATCH` sets the
+# column weights, and ORDER BY rank is handled by FTS5 itself, so the sort runs
+# over (rowid, score) pairs. Only the best `limit` rowids are then joined to
+# the wide verses table (commentary text included). A constant statement with
+# bound parameters, so the statement cache keeps it prepared.
+SEARCH_FTS_SQL = """
+    SELECT v.*, f.rank AS fts_rank
+    FROM (
+        SELECT rowid, rank FROM verses_fts
+        WHERE verses_fts MATCH ? AND rank MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ) AS f
+    JOIN verses AS v ON v.id = f.rowid
+    ORDER BY f.rank
+"""
+
+def fts_match_query(q: str) -> str:
     """
     Build a friendly FTS query:
       - map 'vs', 'vs.', 'versus' -> OR
       - preserve/uppercase boolean ops (OR/AND/NOT/NEAR[/k])
-      - strip leading/trailing punctuation from tokens (so 'prajna?' -> 'prajna')
+      - strip leading/trailing punctuation from tokens (so 'prajna?' -> 'prajna'),
+        keeping a trailing '*' prefix marker ('kar*' is served by the prefix index)
       - remove tiny structural stopwords
       - if no operators present and multiple tokens, join with OR
-    Then run a sanitized MATCH against verses_fts.
     """
     raw = (q or "").strip()
     if not raw:
-        return []
+        return ""
 
     toks = [t for t in re.split(r"\s+", raw) if t]
 
@@ -160,7 +624,8 @@ def search_fts(conn: sqlite3.Connection, q: str, limit: int = 10) -> List[sqlite
             continue
 
         # use the original token minus punctuation for readability (diacritics preserved)
-        out.append(re.sub(r"^[^\w]+|[^\w]+$", "", t, flags=re.UNICODE))
+        tok = re.sub(r"^[^\w]+|[^\w]+$", "", t, flags=re.UNICODE)
+        out.append(tok + "*" if re.search(r"\w\*+[^\w]*$", t, flags=re.UNICODE) else tok)
 
     q_base = " ".join(out).strip()
     has_ops = bool(re.search(r'(?:"|\bOR\b|\bAND\b|\bNOT\b|\bNEAR(?:/\d+)?\b)', q_base))
@@ -172,21 +637,23 @@ def search_fts(conn: sqlite3.Connection, q: str, limit: int = 10) -> List[sqlite
             q2 = raw  # fallback
     else:
         q2 = q_base
+    return q2
+
+def search_fts(conn: sqlite3.Connection, q: str, limit: int = 10) -> List[sqlite3.Row]:
+    """
+    MATCH fts_match_query(q) against verses_fts and return the `limit` best
+    rows by weighted bm25 (FTS_WEIGHTS), best first. The top-k is picked
+    inside the FTS index; only those rowids are joined to `verses`.
+    """
+    raw = (q or "").strip()
+    if not raw:
+        return []
+    q2 = fts_match_query(raw)
 
     # DEBUG to Railway logs
     print(f"[DEBUG search_fts] user={raw!r} → fts_query={q2!r}, limit={limit}", flush=True)
 
-    # Inline as a SQL literal (escape single quotes)
-    q_lit = "'" + q2.replace("'", "''") + "'"
-
-    sql = f"""
-        SELECT v.*
-        FROM verses_fts
-        JOIN verses AS v ON v.rowid = verses_fts.rowid
-        WHERE verses_fts MATCH {q_lit}
-        LIMIT ?
-    """
-    cur = conn.execute(sql, (limit,))
+    cur = conn.execute(SEARCH_FTS_SQL, (q2, FTS_RANK_EXPR, limit))
     return cur.fetchall()
 
 
@@ -0,0 +1,188 @@
+# app/embed_cache.py — cache of query-text embeddings
+#
+# Popular questions are embedded over and over: once for the semantic cache
+# lookup and again for the retrieval vector query. Entries are keyed by a hash
+# of (embedding model tag, normalized text) — NFKC, case-folded, whitespace
+# collapsed, surrounding punctuation dropped — so "What is Karma?" and
+# "what is karma" share one vector. An in-process LRU (EMBED_CACHE_MEM_ITEMS)
+# sits in front of the embed_cache table of the main SQLite DB, where vectors
+# are stored as float32 bytes, shared by all workers and kept across restarts.
+# The table is trimmed back to EMBED_CACHE_MAX_ROWS by least-recent use
+# whenever new entries are written. There is no TTL: the model tag is part of
+# the key, and an embedding never goes stale for a fixed model.
+# Table reads and writes never raise: a locked or broken table is logged,
+# counted under "errors" and treated as a miss / skipped write, so vectors that
+# were already paid for still reach the caller.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .db import get_conn, writer
+
+ENABLED = os.getenv("EMBED_CACHE", "on").strip().lower() not in ("0", "off", "false", "no")
+MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "20000"))
+MEM_ITEMS = int(os.getenv("EMBED_CACHE_MEM_ITEMS", "2048"))
+TOUCH_EVERY_SEC = 300.0  # refresh last_used at most this often per entry (keeps hits write-free)
+
+_LOCK = threading.Lock()
+_STATS = {"mem_hits": 0, "db_hits": 0, "misses": 0, "puts": 0, "evicted": 0, "errors": 0}
+_MEM: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_TOUCHED: Dict[str, float] = {}  # key -> last time this process refreshed last_used
+
+_PUNCT_EDGES = re.compile(r"^[\s\W_]+|[\s\W_]+$", re.UNICODE)
+
+def _bump(key: str, by: int = 1) -> None:
+    with _LOCK:
+        _STATS[key] += by
+
+def _failed(op: str, e: Exception) -> None:
+    _bump("errors")
+    print(f"[embed_cache] {op} failed: {e!r}", flush=True)
+
+def normalize(text: str) -> str:
+    t = unicodedata.normalize("NFKC", text or "").casefold()
+    t = " ".join(t.split())
+    return _PUNCT_EDGES.sub("", t) or t
+
+def key_for(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x1f{normalize(text)}".encode("utf-8")).hexdigest()
+
+def _remember(key: str, vec: np.ndarray, touched: float) -> None:
+    with _LOCK:
+        _MEM[key] = vec
+        _TOUCHED[key] = touched
+        _MEM.move_to_end(key)
+        while len(_MEM) > MEM_ITEMS:
+            old, _ = _MEM.popitem(last=False)
+            _TOUCHED.pop(old, None)
+
+def get_many(model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+    """Cached float32 vectors, None where missing (or when the cache is off)."""
+    if not ENABLED:
+        return [None] * len(texts)
+    keys = [key_for(model, t) for t in texts]
+    out: List[Optional[np.ndarray]] = [None] * len(texts)
+    want: Dict[str, List[int]] = {}
+    stale: List[str] = []  # hits whose last_used in the table is due a refresh
+    now = time.time()
+    with _LOCK:
+        for i, k in enumerate(keys):
+            vec = _MEM.get(k)
+            if vec is not None:
+                _MEM.move_to_end(k)
+                out[i] = vec
+                if now - _TOUCHED.get(k, 0.0) > TOUCH_EVERY_SEC:
+                    _TOUCHED[k] = now
+                    stale.append(k)
+            else:
+                want.setdefault(k, []).append(i)
+    _bump("mem_hits", len(texts) - sum(len(v) for v in want.values()))
+    if want:
+        stale += _load(want, out, now)
+    if stale:
+        try:
+            with writer() as conn:
+                conn.executemany("UPDATE embed_cache SET last_used=?, hits=hits+1 WHERE key=?",
+                                 [(now, k) for k in stale])
+        except Exception as e:
+            _failed("touch", e)  # the hits are still good
+    return out
+
+def _load(want: Dict[str, List[int]], out: List[Optional[np.ndarray]], now: float) -> List[str]:
+    """Fill `out` from the table for the keys in `want`; returns keys whose last_used is stale."""
+    try:
+        rows = get_conn().execute(
+            f"SELECT key, embedding, last_used FROM embed_cache WHERE key IN ({','.join('?' * len(want))})",
+            list(want),
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            _failed("get", e)
+        rows = []  # table not created yet, or the DB is unavailable: misses
+    except Exception as e:
+        _failed("get", e)
+        rows = []
+    stale: List[str] = []
+    for r in rows:
+        vec = np.frombuffer(r["embedding"], dtype=np.float32)
+        for i in want.pop(r["key"]):
+            out[i] = vec
+            _bump("db_hits")
+        if now - r["last_used"] > TOUCH_EVERY_SEC:
+            stale.append(r["key"])
+            _remember(r["key"], vec, now)
+        else:
+            _remember(r["key"], vec, r["last_used"])
+    _bump("misses", sum(len(v) for v in want.values()))
+    return stale
+
+def put_many(model: str, texts: Sequence[str], vecs: Sequence[Sequence[float]]) -> List[np.ndarray]:
+    """
+    Store embeddings for texts; returns them as the float32 vectors later hits
+    will see. If the table write fails they are still returned (and kept in the
+    in-process LRU).
+    """
+    arrs = [np.asarray(v, dtype=np.float32).ravel() for v in vecs]
+    if not ENABLED or not arrs:
+        return arrs
+    now = time.time()
+    rows = {key_for(model, t): a for t, a in zip(texts, arrs)}
+    try:
+        n = _store(model, rows, now)
+    except Exception as e:
+        _failed("put", e)
+        n = 0
+    for k, a in rows.items():
+        _remember(k, a, now)
+    _bump("puts", len(rows))
+    if n:
+        _bump("evicted", n)
+    return arrs
+
+def _store(model: str, rows: Dict[str, np.ndarray], now: float) -> int:
+    with writer() as conn:
+        conn.executemany(
+            "INSERT INTO embed_cache(key, model, embedding, created_at, last_used, hits) VALUES(?,?,?,?,?,0) "
+            "ON CONFLICT(key) DO UPDATE SET embedding=excluded.embedding, last_used=excluded.last_used",
+            [(k, model, a.tobytes(), now, now) for k, a in rows.items()],
+        )
+        n = conn.execute(
+            "DELETE FROM embed_cache WHERE key IN ("
+            "  SELECT key FROM embed_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (MAX_ROWS,),
+        ).rowcount
+    return n
+
+def clear() -> int:
+    with _LOCK:
+        _MEM.clear()
+        _TOUCHED.clear()
+    with writer() as conn:
+        return conn.execute("DELETE FROM embed_cache").rowcount
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        out: Dict[str, Any] = dict(_STATS)
+        out["mem_items"] = len(_MEM)
+    hits = out["mem_hits"] + out["db_hits"]
+    lookups = hits + out["misses"]
+    out["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+    try:
+        out["rows"] = get_conn().execute("SELECT COUNT(1) FROM embed_cache").fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            _failed("stats", e)
+        out["rows"] = 0
+    except Exception as e:
+        _failed("stats", e)
+        out["rows"] = 0
+    out.update({"enabled": ENABLED, "max_rows": MAX_ROWS, "mem_capacity": MEM_ITEMS})
+    return out
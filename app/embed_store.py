@@ -1,46 +1,258 @@
 
+# app/embed_store.py — commentary chunk store (Chroma or a memory-mapped index)
+#
+# Chunk ids are a hash of (topic, commentator, text), so re-uploading the same
+# commentary finds its chunks already present and skips them instead of
+# embedding them again. New chunks are embedded here, in requests bounded by
+# EMBED_BATCH_MAX_ITEMS and EMBED_BATCH_MAX_CHARS, with rate limits and server
+# errors retried (EMBED_MAX_ATTEMPTS); a batch that still fails is counted and
+# the rest of the upload carries on. add_chunks returns a report of what
+# happened to every chunk.
+#
+# VECTOR_BACKEND picks where chunks live: `chroma` (default, a
+# PersistentClient under CHROMA_DIR) or `mmap` (vector_index.MmapIndex under
+# VECTOR_DIR: a memory-mapped matrix plus metadata sidecar, no Chroma import,
+# embeddings straight from llm.get_provider()). Both answer add_chunks/query
+# the same way; they do not share data — switch with
+# `python -m app.embed_store copy-to-mmap` to carry existing chunks over.
+import argparse
+import hashlib
 import os
-import uuid
-from typing import Dict, List, Optional
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import chromadb
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+from . import embed_cache, llm
+from .vector_index import MmapIndex
 
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").strip().lower()  # chroma | mmap
 CHROMA_DIR = os.getenv("CHROMA_DIR", os.path.join(os.getenv("DATA_DIR", "/data"), "chroma"))
-COLLECTION_NAME = os.getenv("COLLECTION_NAME", "gita_commentary_v1")
+VECTOR_DIR = os.getenv("VECTOR_DIR", os.path.join(os.getenv("DATA_DIR", "/data"), "vectors"))
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")  # float32 | float16 (new mmap indexes only)
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
 TOPIC_DEFAULT = os.getenv("TOPIC_DEFAULT", "gita")
+# Non-OpenAI providers embed into their own vector space: keep them apart
+EMBED_MODEL_TAG = EMBED_MODEL if llm.LLM_PROVIDER == "openai" else f"{llm.LLM_PROVIDER}/{EMBED_MODEL}"
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "gita_commentary_v1") + (
+    "" if llm.LLM_PROVIDER == "openai" else f"_{llm.LLM_PROVIDER}")
 
-_client: Optional[chromadb.PersistentClient] = None
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "96"))
+EMBED_BATCH_MAX_CHARS = int(os.getenv("EMBED_BATCH_MAX_CHARS", "100000"))  # ~25k tokens per request
+EMBED_MAX_ATTEMPTS = int(os.getenv("EMBED_MAX_ATTEMPTS", "4"))
+MAX_REPORTED_ERRORS = 5
+
+if VECTOR_BACKEND not in ("chroma", "mmap"):
+    raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND} (use chroma or mmap)")
+
+_client = None
 _collection = None
+_ef = None
+_index: Optional[MmapIndex] = None
+
+
+def _provider_embedding_function():
+    from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+    class ProviderEmbeddingFunction(EmbeddingFunction):
+        """Chroma adapter over llm.get_provider().embed (used for non-OpenAI providers)."""
+
+        def __init__(self, model_name: str = EMBED_MODEL):
+            self.model_name = model_name
+
+        def __call__(self, input: Documents) -> Embeddings:
+            return llm.get_provider().embed(self.model_name, list(input))
+
+        @staticmethod
+        def name() -> str:
+            return "gita_llm_provider"
+
+        def get_config(self) -> Dict:
+            return {"model_name": self.model_name}
+
+        @staticmethod
+        def build_from_config(config: Dict) -> "ProviderEmbeddingFunction":
+            return ProviderEmbeddingFunction(config.get("model_name", EMBED_MODEL))
+
+    return ProviderEmbeddingFunction(EMBED_MODEL)
+
+
+def get_embedding_function():
+    """Chroma embedding function for the collection (imports chromadb)."""
+    global _ef
+    if _ef is None:
+        if llm.LLM_PROVIDER == "openai":
+            from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+            _ef = OpenAIEmbeddingFunction(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                model_name=EMBED_MODEL,
+            )
+        else:
+            _ef = _provider_embedding_function()
+    return _ef
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed arbitrary texts with the collection's embedding model (blocking network call)."""
+    if VECTOR_BACKEND == "mmap":
+        return llm.get_provider().embed(EMBED_MODEL, list(texts))
+    return [list(map(float, e)) for e in get_embedding_function()(list(texts))]
+
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """
+    Question embeddings through embed_cache: texts that normalize alike share
+    one vector, and all misses go out in a single embedding request.
+    """
+    out: List[Optional[Any]] = embed_cache.get_many(EMBED_MODEL_TAG, texts)
+    misses: Dict[str, List[int]] = {}
+    for i, vec in enumerate(out):
+        if vec is None:
+            misses.setdefault(embed_cache.normalize(texts[i]), []).append(i)
+    if misses:
+        first = [texts[idx[0]] for idx in misses.values()]
+        for idx, vec in zip(misses.values(), embed_cache.put_many(EMBED_MODEL_TAG, first, embed_texts(first))):
+            for i in idx:
+                out[i] = vec
+    return [v.tolist() for v in out]
+
+
+def embed_query(text: str) -> List[float]:
+    return embed_queries([text])[0]
+
+
+def get_vector_index() -> MmapIndex:
+    global _index
+    if _index is None:
+        _index = MmapIndex(os.path.join(VECTOR_DIR, COLLECTION_NAME), VECTOR_DTYPE)
+    return _index
 
 
 def get_collection():
     global _client, _collection
     if _client is None:
+        import chromadb
         os.makedirs(CHROMA_DIR, exist_ok=True)
         _client = chromadb.PersistentClient(path=CHROMA_DIR)
     if _collection is None:
-        ef = OpenAIEmbeddingFunction(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model_name=EMBED_MODEL,
-        )
         _collection = _client.get_or_create_collection(
             name=COLLECTION_NAME,
-            embedding_function=ef,
+            embedding_function=get_embedding_function(),
             metadata={"topic": TOPIC_DEFAULT},
         )
     return _collection
 
 
-def add_chunks(chunks: List[str], metadatas: List[Dict]) -> int:
-    col = get_collection()
-    ids = [str(uuid.uuid4()) for _ in chunks]
-    col.add(documents=chunks, metadatas=metadatas, ids=ids)
-    return len(chunks)
+def chunk_id(text: str, metadata: Dict) -> str:
+    """Stable id: the same chunk of the same commentator's text always maps to one entry."""
+    key = "\x1f".join([str(metadata.get("topic") or ""), str(metadata.get("commentator") or ""), text])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def new_report() -> Dict[str, Any]:
+    return {"chunks": 0, "new": 0, "skipped": 0, "failed": 0, "embed_requests": 0, "errors": []}
+
+def _clean_meta(meta: Dict) -> Dict:
+    # Chroma metadata values must be str/int/float/bool
+    return {k: v for k, v in meta.items() if v is not None}
+
+def _batches(items: List[Tuple[str, str, Dict]]) -> Iterator[List[Tuple[str, str, Dict]]]:
+    batch: List[Tuple[str, str, Dict]] = []
+    chars = 0
+    for it in items:
+        if batch and (len(batch) >= EMBED_BATCH_MAX_ITEMS or chars + len(it[1]) > EMBED_BATCH_MAX_CHARS):
+            yield batch
+            batch, chars = [], 0
+        batch.append(it)
+        chars += len(it[1])
+    if batch:
+        yield batch
+
+def _embed_with_retry(texts: List[str], report: Dict[str, Any]) -> List[List[float]]:
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        report["embed_requests"] += 1
+        try:
+            return embed_texts(texts)
+        except Exception as e:
+            code = llm.error_status(e)
+            if attempt == EMBED_MAX_ATTEMPTS - 1 or (code is not None and code < 500 and code != 429):
+                raise  # out of attempts, or a client error retrying will not fix
+            time.sleep(llm.retry_delay(e, attempt, base=1.0, cap=30.0))
+    raise RuntimeError("unreachable")
+
+def add_chunks(chunks: List[str], metadatas: List[Dict],
+               report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Embed and store the chunks not already in the collection. Counts are added
+    to `report` (see new_report) when given, so one report can span an upload.
+    """
+    report = report if report is not None else new_report()
+    report["chunks"] += len(chunks)
+    items: Dict[str, Tuple[str, str, Dict]] = {}
+    for text, meta in zip(chunks, metadatas):
+        cid = chunk_id(text, meta)
+        if cid in items:
+            report["skipped"] += 1  # repeated within this upload
+            continue
+        items[cid] = (cid, text, _clean_meta(meta))
+    if not items:
+        return report
 
+    if VECTOR_BACKEND == "mmap":
+        store = get_vector_index()
+        present = store.has(items)
+    else:
+        store = get_collection()
+        present = set(store.get(ids=list(items), include=[])["ids"])
+    report["skipped"] += len(present)
+    todo = [it for cid, it in items.items() if cid not in present]
 
-def query(query_text: str, top_k: int = 8, where: Optional[Dict] = None):
-    col = get_collection()
+    for batch in _batches(todo):
+        try:
+            vecs = _embed_with_retry([t for _, t, _ in batch], report)
+            store.add(ids=[c for c, _, _ in batch], documents=[t for _, t, _ in batch],
+                      metadatas=[m for _, _, m in batch], embeddings=vecs)
+            report["new"] += len(batch)
+        except Exception as e:
+            report["failed"] += len(batch)
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append(f"{type(e).__name__}: {e}"[:300])
+    return report
+
+
+def query(query_text: str, top_k: int = 8, where: Optional[Dict] = None,
+          embedding: Optional[List[float]] = None):
+    """
+    Top-k chunks in Chroma's result shape (one inner list per query). The
+    question is embedded through embed_cache unless `embedding` is given.
+    """
     where = where or {"topic": TOPIC_DEFAULT}
-    return col.query(query_texts=[query_text], n_results=top_k, where=where)
+    vec = embedding if embedding is not None else embed_query(query_text)
+    if VECTOR_BACKEND == "mmap":
+        return get_vector_index().query(vec, top_k, where)
+    return get_collection().query(query_embeddings=[vec], n_results=top_k, where=where)
+
+
+def copy_chroma_to_mmap(page_size: int = 1000) -> int:
+    """Copy every chunk (with its stored embedding) from the Chroma collection into the mmap index."""
+    col, index = get_collection(), get_vector_index()
+    copied = offset = 0
+    while True:
+        got = col.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not got["ids"]:
+            return copied
+        copied += index.add(got["ids"], got["embeddings"], got["documents"], got["metadatas"])
+        offset += len(got["ids"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Commentary vector store maintenance")
+    ap.add_argument("command", choices=["copy-to-mmap", "stats"])
+    args = ap.parse_args()
+    if args.command == "copy-to-mmap":
+        n = copy_chroma_to_mmap()
+        print(f"[embed_store] copied {n} new chunks into {get_vector_index().path}")
+    else:
+        print(f"[embed_store] backend={VECTOR_BACKEND} "
+              f"chunks={get_vector_index().count() if VECTOR_BACKEND == 'mmap' else get_collection().count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -53,19 +53,19 @@ def _normalize_verse_mentions(text: str) -> str:
     text = re.sub(r"\b(\d{1,2})\s*[.:]\s*(\d{1,3})\b", r"[\1:\2]", text)
     return text.strip()
 
-def _ask_model(client, model, system, user, max_tokens, temperature=0.2):
+def _ask_model(provider, model, system, user, max_tokens, temperature=0.2):
     try:
-        rsp = client.chat.completions.create(
-            model=model,
-            messages=[{"role":"system","content":system},{"role":"user","content":user}],
+        return provider.complete(
+            model,
+            [{"role":"system","content":system},{"role":"user","content":user}],
+            max_tokens,
             temperature=temperature,
-            max_tokens=max_tokens,
+            retries=2,
         )
-        return (rsp.choices[0].message.content or "").strip()
     except Exception:
         return ""
 
-def _gen_summary_and_detail(client, model, question, ctx, style_hint, required_points):
+def _gen_summary_and_detail(provider, model, question, ctx, style_hint, required_points):
     base_system = (
         "You are a Bhagavad Gita assistant. Use ONLY the provided context. "
         "Write clean plain text (Markdown ok), with [chapter:verse] chips. No external sources."
@@ -82,7 +82,7 @@ def _gen_summary_and_detail(client, model, question, ctx, style_hint, required_p
         "Weave in [C:V] chips where appropriate. Avoid repetition; keep it flowing.\n"
     )
 
-    text = _ask_model(client, model, base_system, guide, max_tokens=1800)
+    text = _ask_model(provider, model, base_system, guide, max_tokens=1800)
     summ, detail = "", ""
 
     if "<<<SUMMARY>>>" in text and "<<<DETAIL>>>" in text:
@@ -106,7 +106,7 @@ def _gen_summary_and_detail(client, model, question, ctx, style_hint, required_p
     # If DETAIL too short, try once more with stronger expand cue
     if len(detail.split()) < 550:
         expand_guide = guide + "\nYour previous detail was too short. Expand to 700–900 words with clearer sections and examples.\n"
-        text2 = _ask_model(client, model, base_system, expand_guide, max_tokens=2200, temperature=0.25)
+        text2 = _ask_model(provider, model, base_system, expand_guide, max_tokens=2200, temperature=0.25)
         if "<<<DETAIL>>>" in text2:
             parts = re.split(r"<<<(SUMMARY|DETAIL)>>>", text2)
             it = iter(parts); _ = next(it, "")
@@ -123,16 +123,16 @@ def _gen_summary_and_detail(client, model, question, ctx, style_hint, required_p
     return summ.strip(), detail.strip()
 
 # Public API used by main.py
-def generate_answer_tiers(question, verse_whitelist, master_lookup, style_hint, required_points, client=None, model=None):
-    from openai import OpenAI
-    client = client or OpenAI()
+def generate_answer_tiers(question, verse_whitelist, master_lookup, style_hint, required_points, provider=None, model=None):
+    from .llm import get_provider
+    provider = provider or get_provider()
     model = model or "gpt-4o-mini"
 
     cvs = _parse_whitelist(verse_whitelist)
     ctx = _compose_context(cvs, master_lookup)
     if not ctx:
         # no context? degrade gracefully (still try to produce both sections)
-        s, d = _gen_summary_and_detail(client, model, question, "", style_hint, required_points)
+        s, d = _gen_summary_and_detail(provider, model, question, "", style_hint, required_points)
         return s, s, d  # (short/medium unused, long)
-    s, d = _gen_summary_and_detail(client, model, question, ctx, style_hint, required_points)
+    s, d = _gen_summary_and_detail(provider, model, question, ctx, style_hint, required_points)
     return s, s, d
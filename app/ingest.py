@@ -1,15 +1,35 @@
-
+# app/ingest.py — sheet and commentary parsing for the ingest endpoints
+#
+# Every reader takes a "source": raw bytes, a filesystem path, or a seekable
+# binary file object (the endpoints pass UploadFile.file, the multipart
+# parser's spooled temp file, so an upload is never held in memory whole).
+# Sheets are read in batches of INGEST_BATCH_ROWS (chunked read_csv,
+# read-only openpyxl iteration) and PDFs page by page, so peak memory depends
+# on the batch size, not the upload size. PDF page text comes from
+# pdf_extract's process pool (see there for PDF_WORKERS). Sheet batches are
+# staged in a scratch SQLite file on their own connection while parsing, so
+# the shared writer is only taken for the merge: one short transaction that
+# reads the staged rows back batch by batch.
 import io
 import os
 import re
-from typing import Dict, List, Tuple
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import pandas as pd
-from pypdf import PdfReader
+from openpyxl import load_workbook
 from docx import Document
 
-from .db import bulk_upsert, ensure_fts
-from . import embed_store
+from .db import VERSE_COLS, bulk_upsert, ensure_fts, writer
+from . import embed_store, pdf_extract
+
+Source = Union[bytes, str, os.PathLike, IO[bytes]]
+
+SHEET_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "2000"))
+EMBED_BATCH_CHUNKS = 256  # commentary chunks handed to embed_store per call
 
 RE_CV = re.compile(r"\b([1-9]|1[0-8])[:\. ](\d{1,2})\b")
 
@@ -17,77 +37,154 @@ REQUIRED_COLS = [
     "rownum","audio_id","chapter","verse","sanskrit","roman","colloquial",
     "translation","capsule_url","word_meanings","title"
 ]
+TEXT_COLS = [c for c in REQUIRED_COLS if c not in ("rownum", "chapter", "verse")]
+COMMENTARY_COLS = ["commentary1", "commentary2", "commentary3"]  # optional
+
+def _source(src: Source):
+    """bytes -> BytesIO; paths and file objects are passed through (rewound)."""
+    if isinstance(src, (bytes, bytearray)):
+        return io.BytesIO(src)
+    if hasattr(src, "seek"):
+        src.seek(0)
+    return src
+
+def _coerce_int_col(s: pd.Series) -> pd.Series:
+    """Column-wise int(str(x).strip()): integral values as Int64, anything else <NA>."""
+    num = pd.to_numeric(s.astype(str).str.strip(), errors="coerce")
+    return num.where(num.notna() & (num % 1 == 0)).astype("Int64")
+
+def _text_col(s: pd.Series) -> pd.Series:
+    return s.where(s.notna(), "").astype(str)
 
-def _coerce_int(x):
+def _sheet_columns(df: pd.DataFrame) -> Dict[str, str]:
+    cols = {str(c).strip().lower(): c for c in df.columns}
+    for rc in REQUIRED_COLS:
+        if rc not in cols:
+            raise ValueError(f"Missing required column: {rc}")
+    return cols
+
+def _frame_to_rows(df: pd.DataFrame, cols: Dict[str, str]) -> List[Dict]:
+    # Whole columns at a time: no per-row Series, one Python dict per kept row at the end
+    chap = _coerce_int_col(df[cols["chapter"]])
+    ver = _coerce_int_col(df[cols["verse"]])
+    keep = (chap.notna() & ver.notna()).to_numpy()
+    out_df = pd.DataFrame({
+        "rownum": _coerce_int_col(df[cols["rownum"]]),
+        "chapter": chap,
+        "verse": ver,
+        **{c: _text_col(df[cols[c]]) for c in TEXT_COLS},
+        # Commentary columns are optional; use if present
+        **{c: _text_col(df[cols[c]]) if c in cols else "" for c in COMMENTARY_COLS},
+    })[keep]
+    # object dtype turns Int64 into Python ints and <NA> into None for sqlite3
+    out_df = out_df.astype(object).where(out_df.notna(), None)
+    return out_df.to_dict("records")
+
+def _xlsx_frames(src, batch_rows: int) -> Iterator[pd.DataFrame]:
+    """First worksheet as DataFrames of batch_rows rows, via read-only (streaming) openpyxl."""
+    wb = load_workbook(src, read_only=True, data_only=True)
     try:
-        return int(str(x).strip())
-    except Exception:
-        return None
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+        width = len(header)
+        batch: List[tuple] = []
+        for r in rows:
+            batch.append(tuple(r[:width]) + (None,) * (width - len(r)))
+            if len(batch) >= batch_rows:
+                yield pd.DataFrame(batch, columns=header, dtype=object)
+                batch = []
+        # always yield once so a header-only sheet is still validated
+        yield pd.DataFrame(batch, columns=header, dtype=object)
+    finally:
+        wb.close()
 
-def load_sheet_to_rows(file_bytes: bytes, filename: str) -> List[Dict]:
+def iter_sheet_batches(src: Source, filename: str, batch_rows: int = SHEET_BATCH_ROWS) -> Iterator[List[Dict]]:
+    """Verse rows from a CSV/XLSX sheet, batch_rows at a time."""
     name = filename.lower()
     if name.endswith(".csv"):
+        # dtype=str keeps cell text as written regardless of how each chunk would be inferred;
         # keep_default_na=False prevents 'nan' strings later
-        df = pd.read_csv(io.BytesIO(file_bytes), keep_default_na=False)
+        frames = pd.read_csv(_source(src), dtype=str, keep_default_na=False, chunksize=batch_rows)
     elif name.endswith(".xlsx"):
-        df = pd.read_excel(io.BytesIO(file_bytes))
-        df = df.fillna("")  # avoid NaN -> 'nan'
+        frames = _xlsx_frames(_source(src), batch_rows)
     else:
         raise ValueError("Unsupported sheet format. Use CSV or XLSX.")
 
-    cols = {c.strip().lower(): c for c in df.columns}
-    for rc in REQUIRED_COLS:
-        if rc not in cols:
-            raise ValueError(f"Missing required column: {rc}")
+    cols = None
+    for df in frames:
+        if cols is None:
+            cols = _sheet_columns(df)
+        yield _frame_to_rows(df, cols)
+
+def load_sheet_to_rows(src: Source, filename: str) -> List[Dict]:
+    return [r for batch in iter_sheet_batches(src, filename) for r in batch]
+
+def _stage_sheet(src: Source, filename: str, path: str) -> None:
+    """Parse a sheet into table `stage` of the SQLite file at path (private connection, no shared lock)."""
+    stage = sqlite3.connect(path)
+    try:
+        stage.execute(f"CREATE TABLE stage ({','.join(VERSE_COLS)})")
+        insert = f"INSERT INTO stage VALUES ({','.join('?' * len(VERSE_COLS))})"
+        for batch in iter_sheet_batches(src, filename):
+            stage.executemany(insert, [tuple(r.get(c) for c in VERSE_COLS) for r in batch])
+        stage.commit()
+    finally:
+        stage.close()
+
+def _staged_batches(path: str, batch_rows: int = SHEET_BATCH_ROWS) -> Iterator[List[Dict]]:
+    stage = sqlite3.connect(path)
+    try:
+        cur = stage.execute(f"SELECT {','.join(VERSE_COLS)} FROM stage ORDER BY rowid")
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                return
+            yield [dict(zip(VERSE_COLS, r)) for r in rows]
+    finally:
+        stage.close()
+
+def ingest_sheet(src: Source, filename: str) -> int:
+    """
+    Stage a sheet, then upsert it into verses in one transaction (all rows or
+    none). Parsing runs before the writer is taken, so a slow or malformed
+    upload never holds up other writers; memory stays at one batch either way.
+    Returns rows read.
+    """
+    fd, path = tempfile.mkstemp(prefix="gita-sheet-", suffix=".db")
+    os.close(fd)
+    try:
+        _stage_sheet(src, filename, path)
+        n = 0
+        with writer() as conn:
+            ensure_fts(conn)  # commits on its own, and only when the FTS layout changed
+            for batch in _staged_batches(path):
+                n += bulk_upsert(conn, batch, commit=False)
+        return n
+    finally:
+        os.remove(path)
 
-    # Commentary columns are optional; use if present
-    has_c1 = "commentary1" in cols
-    has_c2 = "commentary2" in cols
-    has_c3 = "commentary3" in cols
-
-    def _get(row, key_lower):
-        if key_lower not in cols:
-            return ""
-        val = row.get(cols[key_lower], "")
-        # handle pandas NA cleanly
-        return "" if pd.isna(val) else str(val)
-
-    out: List[Dict] = []
-    for _, r in df.iterrows():
-        chap = _coerce_int(r[cols["chapter"]])
-        ver = _coerce_int(r[cols["verse"]])
-        if chap is None or ver is None:
-            continue
-        out.append({
-            "rownum": _coerce_int(r[cols["rownum"]]),
-            "audio_id": _get(r, "audio_id"),
-            "chapter": chap,
-            "verse": ver,
-            "sanskrit": _get(r, "sanskrit"),
-            "roman": _get(r, "roman"),
-            "colloquial": _get(r, "colloquial"),
-            "translation": _get(r, "translation"),
-            "capsule_url": _get(r, "capsule_url"),
-            "word_meanings": _get(r, "word_meanings"),
-            "title": _get(r, "title"),
-            "commentary1": _get(r, "commentary1") if has_c1 else "",
-            "commentary2": _get(r, "commentary2") if has_c2 else "",
-            "commentary3": _get(r, "commentary3") if has_c3 else "",
-        })
-    return out
 
+def _chunk_stream(pieces: Iterable[str], size: int = 1000, overlap: int = 120) -> Iterator[str]:
+    """
+    Windows of `size` chars advancing by size - overlap over the concatenated
+    pieces, without holding more than one window plus one piece.
+    """
+    buf = ""
+    emitted = False
+    for piece in pieces:
+        buf += piece.replace("\r", "\n")
+        while len(buf) >= size:
+            yield buf[:size]
+            emitted = True
+            buf = buf[size - overlap:]
+    if buf and (not emitted or len(buf) > overlap):
+        yield buf
 
 def _chunk_text(txt: str, size: int = 1000, overlap: int = 120) -> List[str]:
-    txt = txt.replace("\r", "\n")
-    parts: List[str] = []
-    i = 0
-    while i < len(txt):
-        j = min(len(txt), i + size)
-        parts.append(txt[i:j])
-        i = j - overlap
-        if i < 0:
-            i = 0
-    return parts
+    return list(_chunk_stream([txt], size, overlap))
 
 def _infer_cv(text: str) -> Tuple[int, int]:
     m = RE_CV.search(text)
@@ -95,34 +192,78 @@ def _infer_cv(text: str) -> Tuple[int, int]:
         return (0, 0)
     return int(m.group(1)), int(m.group(2))
 
-def pdf_to_chunks(file_bytes: bytes):
-    reader = PdfReader(io.BytesIO(file_bytes))
-    for i, page in enumerate(reader.pages, start=1):
-        text = page.extract_text() or ""
-        for chunk in _chunk_text(text):
-            ch, v = _infer_cv(chunk)
-            yield chunk, {"page": i, "chapter": ch, "verse": v}
-
-def docx_to_chunks(file_bytes: bytes):
-    doc = Document(io.BytesIO(file_bytes))
-    text = "\n".join([p.text for p in doc.paragraphs])
-    for chunk in _chunk_text(text):
+def _pdf_path(src: Source) -> Tuple[str, bool]:
+    """A path pool workers can open; (path, is_temp). Uploads are copied to a temp file."""
+    if isinstance(src, (str, os.PathLike)):
+        return os.fspath(src), False
+    fd, path = tempfile.mkstemp(prefix="gita-commentary-", suffix=".pdf")
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(_source(src), out, 1024 * 1024)
+    return path, True
+
+def pdf_to_chunks(src: Source, stats: Optional[Dict] = None):
+    """
+    Chunks in page order. Pages are extracted on pdf_extract's process pool and
+    chunked as they arrive, so embedding starts before the last page is parsed.
+    stats (optional) receives pages, pages_failed, extract_sec (time spent
+    waiting for page text) and pages_per_sec.
+    """
+    path, is_temp = _pdf_path(src)
+    pages = failed = 0
+    wait = 0.0
+    try:
+        it = pdf_extract.iter_pages(path)
+        while True:
+            t = time.perf_counter()
+            nxt = next(it, None)
+            wait += time.perf_counter() - t
+            if nxt is None:
+                break
+            i, text = nxt
+            pages += 1
+            if text is None:
+                failed += 1
+                continue
+            for chunk in _chunk_text(text):
+                ch, v = _infer_cv(chunk)
+                yield chunk, {"page": i, "chapter": ch, "verse": v}
+    finally:
+        if stats is not None:
+            stats.update(pages=pages, pages_failed=failed, extract_sec=round(wait, 3),
+                         pages_per_sec=round(pages / wait, 1) if wait > 0 else 0.0)
+        if is_temp:
+            os.remove(path)
+
+def docx_to_chunks(src: Source):
+    doc = Document(_source(src))
+    paras = (("\n" if i else "") + p.text for i, p in enumerate(doc.paragraphs))
+    for chunk in _chunk_stream(paras):
         ch, v = _infer_cv(chunk)
         yield chunk, {"page": None, "chapter": ch, "verse": v}
 
-def ingest_commentary(file_bytes: bytes, filename: str, topic: str, commentator: str, source: str) -> int:
+def ingest_commentary(src: Source, filename: str, topic: str, commentator: str, source: str) -> Dict:
+    """Chunk and embed a PDF/DOCX commentary. Returns embed_store's report (new/skipped/failed)."""
     name = filename.lower()
+    report = embed_store.new_report()
     if name.endswith(".pdf"):
-        kv = list(pdf_to_chunks(file_bytes))
+        kv = pdf_to_chunks(src, stats=report)
     elif name.endswith(".docx"):
-        kv = list(docx_to_chunks(file_bytes))
+        kv = docx_to_chunks(src)
     else:
         raise ValueError("Unsupported commentary format. Use PDF or DOCX.")
 
-    docs = [k for k, _ in kv]
-    metas = [{**meta, "topic": topic, "commentator": commentator, "source": source} for _, meta in kv]
-    return embed_store.add_chunks(docs, metas)
+    docs: List[str] = []
+    metas: List[Dict] = []
+    for doc, meta in kv:
+        docs.append(doc)
+        metas.append({**meta, "topic": topic, "commentator": commentator, "source": source})
+        if len(docs) >= EMBED_BATCH_CHUNKS:
+            embed_store.add_chunks(docs, metas, report)
+            docs, metas = [], []
+    if docs:
+        embed_store.add_chunks(docs, metas, report)
+    return report
 
-# New: helper to rebuild FTS after CSV ingest
+# Helper to verify the FTS index after CSV ingest (rows are synced by triggers)
 def finalize_ingest(conn):
     ensure_fts(conn)
@@ -0,0 +1,293 @@
+# app/llm.py — LLM provider interface
+#
+# Every completion and embedding in the app goes through get_provider():
+#
+#   LLM_PROVIDER=openai  (default) the OpenAI SDK. OPENAI_BASE_URL points it at
+#                        any OpenAI-compatible server, e.g. app.llm_stub_server.
+#   LLM_PROVIDER=stub    in-process, deterministic answers with an injectable
+#                        latency distribution and token rate, for load tests
+#                        and profiling without a live API.
+#
+# Providers raise on failure; callers decide whether to swallow errors (/ask)
+# or back off and retry (canonical_jobs). An exception with status_code=429 is
+# treated as a rate limit everywhere. Token usage of every completion is
+# reported to metrics.note_llm_usage.
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from . import metrics
+
+Messages = List[Dict[str, str]]
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").strip().lower()
+
+# Stub knobs (LLM_PROVIDER=stub, and app.llm_stub_server)
+STUB_LATENCY = os.getenv("LLM_STUB_LATENCY", "lognormal:0.35,0.4")   # time to first token, seconds
+STUB_TOKENS_PER_SEC = float(os.getenv("LLM_STUB_TOKENS_PER_SEC", "80"))
+STUB_MAX_TOKENS = int(os.getenv("LLM_STUB_MAX_TOKENS", "220"))        # cap on generated length
+STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))        # fraction of calls that 429
+STUB_SEED = os.getenv("LLM_STUB_SEED", "")
+STUB_EMBED_DIM = int(os.getenv("LLM_STUB_EMBED_DIM", "256"))
+# Regex over system + user prompt; matching calls return "" (a model that declines),
+# which lets benchmarks drive /ask into its RAG fallback on purpose
+STUB_EMPTY_MATCH = os.getenv("LLM_STUB_EMPTY_MATCH", "")
+
+def error_status(e: Exception) -> Optional[int]:
+    """HTTP status carried by a provider exception (SDK errors, stub 429s), if any."""
+    code = getattr(e, "status_code", None)
+    if code is None:
+        code = getattr(getattr(e, "response", None), "status_code", None)
+    return code
+
+def retry_delay(e: Exception, attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    """Seconds to wait before retry `attempt` (0-based): Retry-After if sent, else jittered exponential."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return min(cap, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return min(cap, base * (2 ** attempt)) * random.uniform(0.75, 1.25)
+
+class Provider:
+    """Interface shared by all backends."""
+    name = "base"
+
+    def complete(self, model: str, messages: Messages, max_tokens: int,
+                 temperature: float = 0.2, timeout: Optional[float] = None, retries: int = 0) -> str:
+        raise NotImplementedError
+
+    async def acomplete(self, model: str, messages: Messages, max_tokens: int,
+                        temperature: float = 0.2, timeout: Optional[float] = None) -> str:
+        raise NotImplementedError
+
+    def astream(self, model: str, messages: Messages, max_tokens: int,
+                temperature: float = 0.2, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def model_tag(self, model: str) -> str:
+        """Model name as recorded in caches and input hashes; keeps stub output apart from real output."""
+        return model
+
+# ---------- OpenAI ----------
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def __init__(self):
+        from openai import AsyncOpenAI, OpenAI
+        key = os.getenv("OPENAI_API_KEY")
+        self.client = OpenAI(api_key=key)
+        self.aclient = AsyncOpenAI(api_key=key, max_retries=1)
+
+    @staticmethod
+    def _usage(model: str, usage) -> None:
+        if usage is not None:
+            metrics.note_llm_usage(model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, retries=0):
+        rsp = self.client.with_options(max_retries=retries).chat.completions.create(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+        )
+        self._usage(model, rsp.usage)
+        return (rsp.choices[0].message.content or "").strip()
+
+    async def acomplete(self, model, messages, max_tokens, temperature=0.2, timeout=None):
+        rsp = await self.aclient.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+        )
+        self._usage(model, rsp.usage)
+        return (rsp.choices[0].message.content or "").strip()
+
+    async def astream(self, model, messages, max_tokens, temperature=0.2, timeout=None):
+        stream = await self.aclient.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
+            stream=True, stream_options={"include_usage": True}, timeout=timeout,
+        )
+        try:
+            async for chunk in stream:
+                self._usage(model, getattr(chunk, "usage", None))  # only on the final, choice-less chunk
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+    def embed(self, model, texts):
+        rsp = self.client.embeddings.create(model=model, input=list(texts))
+        return [list(map(float, d.embedding)) for d in rsp.data]
+
+# ---------- Stub ----------
+class StubRateLimitError(Exception):
+    status_code = 429
+
+def parse_latency(spec: str):
+    """
+    'fixed:S' | 'uniform:LO,HI' | 'normal:MU,SIGMA' | 'lognormal:MEDIAN,SIGMA'
+    -> sampler(rng) returning seconds (never negative).
+    """
+    kind, _, args = (spec or "fixed:0").partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] or [0.0]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        return lambda rng: max(0.0, vals[0])
+    if kind == "uniform":
+        return lambda rng: max(0.0, rng.uniform(vals[0], vals[1]))
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        mu = math.log(max(vals[0], 1e-6))
+        return lambda rng: rng.lognormvariate(mu, vals[1] if len(vals) > 1 else 0.0)
+    raise ValueError(f"unknown latency distribution: {spec!r}")
+
+_WORDS = (
+    "the self acts without attachment to results and offers every deed to Krishna "
+    "steadiness of mind comes from practice and detachment the wise see the same "
+    "in success and failure devotion purifies the heart and knowledge removes doubt"
+).split()
+_CITE_RE = re.compile(r"\[(\d{1,2}):(\d{1,3})\]")
+
+class StubProvider(Provider):
+    """
+    Deterministic offline backend. The text is a pure function of the prompt;
+    timing is time-to-first-token from STUB_LATENCY, then STUB_TOKENS_PER_SEC.
+    Tiered canonical prompts get <<<SHORT>>>/<<<MEDIUM>>>/<<<LONG>>> sections,
+    and verses cited in the prompt are cited back so downstream parsing runs.
+    """
+    name = "stub"
+
+    def __init__(self, latency: str = STUB_LATENCY, tokens_per_sec: float = STUB_TOKENS_PER_SEC,
+                 max_tokens: int = STUB_MAX_TOKENS, error_rate: float = STUB_ERROR_RATE,
+                 seed: Optional[str] = STUB_SEED, embed_dim: int = STUB_EMBED_DIM,
+                 empty_match: str = STUB_EMPTY_MATCH):
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.max_tokens = max_tokens
+        self.error_rate = error_rate
+        self.embed_dim = embed_dim
+        self.empty_re = re.compile(empty_match, re.S) if empty_match else None
+        self._rng = random.Random(seed) if seed else random.Random()
+        self._lock = threading.Lock()
+
+    def model_tag(self, model):
+        return f"stub/{model}"
+
+    # -- content --
+    def text_for(self, messages: Messages, max_tokens: int) -> str:
+        prompt = "\n".join(m.get("content") or "" for m in messages)
+        if self.empty_re and self.empty_re.search(prompt):
+            return ""
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        cites = list(dict.fromkeys(f"[{c}:{v}]" for c, v in _CITE_RE.findall(prompt)))[:4] \
+            or [f"[{digest[0] % 18 + 1}:{digest[1] % 20 + 1}]"]
+        n = max(8, min(max_tokens, self.max_tokens))
+
+        def para(offset: int, words: int) -> str:
+            out = [_WORDS[(digest[(offset + i) % len(digest)] + i) % len(_WORDS)] for i in range(words)]
+            return " ".join(out).capitalize() + f" {cites[offset % len(cites)]}."
+
+        if "<<<SHORT>>>" in prompt:
+            return (f"<<<SHORT>>>\n{para(0, max(6, n // 6))}\n"
+                    f"<<<MEDIUM>>>\n{para(1, max(6, n // 3))}\n"
+                    f"<<<LONG>>>\n{para(2, max(6, n // 2))}\n\n{para(3, max(6, n // 4))}")
+        paras = [para(i, max(6, n // 3)) for i in range(3)]
+        return "\n\n".join(paras)
+
+    # -- timing --
+    def _plan(self) -> float:
+        with self._lock:
+            if self.error_rate and self._rng.random() < self.error_rate:
+                raise StubRateLimitError("stub: rate limited")
+            return self.sample_latency(self._rng)
+
+    def _chunks(self, text: str) -> List[str]:
+        return re.findall(r"\S+\s*", text)
+
+    def _gen_time(self, text: str) -> float:
+        return len(self._chunks(text)) / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def usage(self, messages: Messages, text: str) -> Dict[str, int]:
+        """Whitespace-token estimate in the shape of an OpenAI usage block."""
+        prompt = sum(len((m.get("content") or "").split()) for m in messages)
+        completion = len(text.split())
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def _report(self, model: str, messages: Messages, text: str) -> None:
+        u = self.usage(messages, text)
+        metrics.note_llm_usage(self.model_tag(model), u["prompt_tokens"], u["completion_tokens"])
+
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, retries=0):
+        ttft = self._plan()
+        text = self.text_for(messages, max_tokens)
+        time.sleep(ttft + self._gen_time(text))
+        self._report(model, messages, text)
+        return text.strip()
+
+    async def acomplete(self, model, messages, max_tokens, temperature=0.2, timeout=None):
+        ttft = self._plan()
+        text = self.text_for(messages, max_tokens)
+        await asyncio.sleep(ttft + self._gen_time(text))
+        self._report(model, messages, text)
+        return text.strip()
+
+    async def astream(self, model, messages, max_tokens, temperature=0.2, timeout=None):
+        ttft = self._plan()
+        text = self.text_for(messages, max_tokens)
+        await asyncio.sleep(ttft)
+        gap = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+        for piece in self._chunks(text):
+            if gap:
+                await asyncio.sleep(gap)
+            yield piece
+        self._report(model, messages, text)
+
+    def stream_sync(self, messages: Messages, max_tokens: int) -> Iterator[str]:
+        """Blocking token stream, used by the HTTP stand-in."""
+        ttft = self._plan()
+        text = self.text_for(messages, max_tokens)
+        time.sleep(ttft)
+        gap = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+        for piece in self._chunks(text):
+            if gap:
+                time.sleep(gap)
+            yield piece
+
+    def embed(self, model, texts):
+        # hashed bag of words: shared words -> similar vectors, so the semantic cache behaves plausibly
+        out = []
+        for t in texts:
+            vec = [0.0] * self.embed_dim
+            for w in re.findall(r"\w+", (t or "").lower()):
+                h = hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest()
+                vec[int.from_bytes(h[:4], "little") % self.embed_dim] += 1.0 if h[4] & 1 else -1.0
+            norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+            out.append([x / norm for x in vec])
+        return out
+
+_PROVIDER: Optional[Provider] = None
+_PROVIDER_LOCK = threading.Lock()
+
+def get_provider() -> Provider:
+    global _PROVIDER
+    if _PROVIDER is None:
+        with _PROVIDER_LOCK:
+            if _PROVIDER is None:
+                if LLM_PROVIDER == "stub":
+                    _PROVIDER = StubProvider()
+                elif LLM_PROVIDER == "openai":
+                    _PROVIDER = OpenAIProvider()
+                else:
+                    raise ValueError(f"unknown LLM_PROVIDER: {LLM_PROVIDER!r}")
+    return _PROVIDER
+
+def set_provider(provider: Provider) -> None:
+    """Swap the process-wide provider (benchmarks, scripts)."""
+    global _PROVIDER
+    _PROVIDER = provider
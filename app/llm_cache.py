@@ -0,0 +1,117 @@
+# app/llm_cache.py — persistent completion cache for the /ask LLM calls
+#
+# Entries live in the llm_cache table of the main SQLite DB, keyed by a hash of
+# (model, system prompt, user prompt, max_tokens, temperature). Expired rows
+# (LLM_CACHE_TTL_SEC) are misses; the table is trimmed back to
+# LLM_CACHE_MAX_ROWS by least-recent use whenever a new entry is written.
+# get() and put() take the shared writer, so the request path calls them off
+# the event loop; they never raise (a locked or broken cache is logged, counted
+# under "errors" and treated as a miss / skipped write).
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .db import get_conn, writer
+
+ENABLED = os.getenv("LLM_CACHE", "on").strip().lower() not in ("0", "off", "false", "no")
+TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "5000"))
+TOUCH_EVERY_SEC = 300.0  # refresh last_used at most this often per entry (keeps hits write-free)
+
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "expired": 0, "puts": 0, "evicted": 0, "bypassed": 0, "errors": 0}
+
+def _bump(key: str, by: int = 1) -> None:
+    with _LOCK:
+        _STATS[key] += by
+
+def key_for(model: str, system: str, user: str, max_tokens: int,
+            temperature: float, bypass: bool = False) -> Optional[str]:
+    """Cache key for one completion, or None when caching is off for this call."""
+    if not ENABLED or bypass:
+        _bump("bypassed")
+        return None
+    raw = json.dumps([model, system, user, int(max_tokens), float(temperature)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _failed(op: str, e: Exception) -> None:
+    _bump("errors")
+    print(f"[llm_cache] {op} failed: {e!r}", flush=True)
+
+def get(key: Optional[str]) -> Optional[str]:
+    if key is None:
+        return None
+    try:
+        row = get_conn().execute(
+            "SELECT completion, created_at, last_used FROM llm_cache WHERE key=?", (key,)
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            _failed("get", e)
+        row = None  # table not created yet, or the DB is unavailable: a miss
+    now = time.time()
+    if row is None:
+        _bump("misses")
+        return None
+    if now - row["created_at"] > TTL_SEC:
+        _bump("expired")
+        _bump("misses")
+        return None
+    _bump("hits")
+    if now - row["last_used"] > TOUCH_EVERY_SEC:
+        try:
+            with writer() as conn:
+                conn.execute("UPDATE llm_cache SET last_used=?, hits=hits+1 WHERE key=?", (now, key))
+        except Exception as e:
+            _failed("touch", e)  # the hit is still good
+    return row["completion"]
+
+def put(key: Optional[str], model: str, completion: str) -> None:
+    """Store a completion (empty answers are never cached) and enforce TTL + size bounds. Never raises."""
+    if key is None or not completion:
+        return
+    now = time.time()
+    try:
+        n = _store(key, model, completion, now)
+    except Exception as e:
+        _failed("put", e)
+        return
+    _bump("puts")
+    if n:
+        _bump("evicted", n)
+
+def _store(key: str, model: str, completion: str, now: float) -> int:
+    with writer() as conn:
+        conn.execute(
+            "INSERT INTO llm_cache(key, model, completion, created_at, last_used, hits) VALUES(?,?,?,?,?,0) "
+            "ON CONFLICT(key) DO UPDATE SET completion=excluded.completion, "
+            "created_at=excluded.created_at, last_used=excluded.last_used",
+            (key, model, completion, now, now),
+        )
+        n = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - TTL_SEC,)).rowcount
+        n += conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "  SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (MAX_ROWS,),
+        ).rowcount
+    return n
+
+def clear() -> int:
+    with writer() as conn:
+        return conn.execute("DELETE FROM llm_cache").rowcount
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        out: Dict[str, Any] = dict(_STATS)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+    try:
+        out["rows"] = get_conn().execute("SELECT COUNT(1) FROM llm_cache").fetchone()[0]
+    except sqlite3.OperationalError:
+        out["rows"] = 0
+    out.update({"enabled": ENABLED, "ttl_sec": TTL_SEC, "max_rows": MAX_ROWS})
+    return out
@@ -0,0 +1,128 @@
+# app/llm_stub_server.py — OpenAI-compatible HTTP stand-in backed by llm.StubProvider
+#
+# Serves /v1/chat/completions (plain and stream=true), /v1/embeddings and
+# /v1/models with the stub's deterministic text, latency distribution and
+# token rate, so the real OpenAI SDK code path (HTTP, SSE parsing, retries)
+# can be exercised offline:
+#
+#   python -m app.llm_stub_server --port 8901 --latency lognormal:0.4,0.5 --tps 60
+#   OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=stub uvicorn app.main:app
+#
+# Stub 429s (--error-rate) come back as HTTP 429 with a Retry-After header.
+import argparse
+import base64
+import json
+import os
+import struct
+import time
+import uuid
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .llm import StubProvider, StubRateLimitError
+
+app = FastAPI(title="LLM stub")
+stub = StubProvider()
+
+def _rate_limited() -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": "1"},
+        content={"error": {"message": "stub: rate limited", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+    )
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model") or "stub"
+    messages = body.get("messages") or []
+    max_tokens = int(body.get("max_tokens") or body.get("max_completion_tokens") or 256)
+    cid = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        try:
+            text = await stub.acomplete(model, messages, max_tokens)
+        except StubRateLimitError:
+            return _rate_limited()
+        return {
+            "id": cid, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": stub.usage(messages, text),
+        }
+
+    pieces = stub.astream(model, messages, max_tokens)
+    try:
+        first = await pieces.__anext__()  # time to first token; a stub 429 surfaces here
+    except StubRateLimitError:
+        return _rate_limited()
+    except StopAsyncIteration:
+        first = ""
+
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    def chunk(delta: Dict[str, Any], finish: Any = None) -> str:
+        payload = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def events():
+        text = first
+        yield chunk({"role": "assistant", "content": first})
+        async for piece in pieces:
+            text += piece
+            yield chunk({"content": piece})
+        yield chunk({}, "stop")
+        if include_usage:  # OpenAI sends usage on one last chunk with no choices
+            payload = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [], "usage": stub.usage(messages, text)}
+            yield f"data: {json.dumps(payload)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    model = body.get("model") or "stub"
+    inputs = body.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    vecs = stub.embed(model, [str(x) for x in inputs])
+    as_b64 = body.get("encoding_format") == "base64"  # the OpenAI SDK asks for base64 by default
+    data = [
+        {"object": "embedding", "index": i,
+         "embedding": base64.b64encode(struct.pack(f"<{len(v)}f", *v)).decode() if as_b64 else v}
+        for i, v in enumerate(vecs)
+    ]
+    tokens = sum(len(str(x).split()) for x in inputs)
+    return {"object": "list", "data": data, "model": model, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.getenv("LLM_STUB_PORT", "8901")))
+    ap.add_argument("--latency", help="time-to-first-token distribution, e.g. fixed:0.2, lognormal:0.4,0.5")
+    ap.add_argument("--tps", type=float, help="streamed tokens per second")
+    ap.add_argument("--error-rate", type=float, help="fraction of requests answered with 429")
+    ap.add_argument("--seed", help="RNG seed for reproducible latency/error sequences")
+    args = ap.parse_args()
+
+    global stub
+    stub = StubProvider(
+        **{k: v for k, v in {
+            "latency": args.latency, "tokens_per_sec": args.tps,
+            "error_rate": args.error_rate, "seed": args.seed,
+        }.items() if v is not None}
+    )
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
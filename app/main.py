@@ -2,30 +2,39 @@
 import os
 import re
 import csv
+import asyncio
+import hashlib
+import json
 import time
+import shutil
+import sqlite3
 import threading
-from typing import Any, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from collections import defaultdict
 
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile, Header, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 # --- DB helpers from your project ---
 from .db import (
     get_conn,
+    writer,
+    open_pool,
+    close_pool,
+    pool_stats,
     init_db,
-    bulk_upsert,
-    fetch_exact,
-    fetch_neighbors,
     search_fts,
     stats,
-    ensure_fts,
 )
 
-from .ingest import load_sheet_to_rows, ingest_commentary
+from .ingest import ingest_sheet, ingest_commentary
+from . import (canonical_index, canonical_jobs, embed_cache, embed_store, llm, llm_cache, metrics, query_norm,
+               retrieval, semantic_cache, verse_store)
+from .render import render_verse
 
 # --- Environment ---
 ALLOW_ORIGINS = os.getenv("ALLOW_ORIGINS", "*")
@@ -39,11 +48,31 @@ RAG_SOURCE = os.getenv("RAG_SOURCE", "").strip().lower()  # e.g. "commentary2"
 DB_PATH = os.environ.get("DB_PATH", "/data/gita.db")
 ADMIN_TOKEN = (os.getenv("ADMIN_TOKEN", "gita-krishna") or "").strip()
 
-# --- OpenAI client ---
-from openai import OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))   # in-flight LLM calls per worker
+LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "45"))
+
+# --- LLM provider (see llm.py: openai, or the offline stub) ---
+# /ask awaits the async API so one slow completion never blocks the event loop.
+# The blocking API is only used from canonical generation threads.
+provider = llm.get_provider()
+LLM_MODEL_TAG = provider.model_tag(GEN_MODEL)  # model as recorded in caches and input hashes
+_LLM_SEM = asyncio.Semaphore(LLM_CONCURRENCY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled SQLite connections live for the life of the worker process
+    open_pool()
+    verse_store.reload()
+    canonical_index.reload()
+    query_norm.refresh_async()  # built off the boot path; first use waits for it
+    semantic_cache.refresh_async()
+    _resume_canonicals()
+    try:
+        yield
+    finally:
+        close_pool()
 
-app = FastAPI(title="Gita Q&A v2")
+app = FastAPI(title="Gita Q&A v2", lifespan=lifespan)
 
 # --- CORS ---
 if ALLOW_ORIGINS == "*":
@@ -70,19 +99,6 @@ init_db()
 RE_CV = re.compile(r"\b([1-9]|1[0-8])[:\. ](\d{1,2})\b")
 CITE_RE = re.compile(r"\[\s*(?:C\s*:\s*)?(\d{1,2})\s*[:.]\s*(\d{1,3})\s*\]")
 
-def _clean_text_preserve_lines(t: str) -> str:
-    """Preserve line breaks; remove HTML; avoid flattening to one line."""
-    if not t:
-        return ""
-    t = re.sub(r"(?i)<br\s*/?>", "\n", t)
-    t = re.sub(r"(?is)<p[^>]*>", "", t)
-    t = re.sub(r"(?is)</p>", "\n\n", t)
-    t = re.sub(r"(?is)<[^>]+>", "", t)
-    t = t.replace("\r\n", "\n").replace("\r", "\n")
-    t = re.sub(r"\n{4,}", "\n\n", t)
-    t = "\n".join(ln.rstrip() for ln in t.split("\n"))
-    return t.strip()
-
 def _normalize_md_answer(md: str) -> str:
     """
     Normalize model/seeded Markdown so it renders cleanly:
@@ -129,6 +145,10 @@ def _is_verses_listing_query(q: str) -> bool:
         ("show" in ql and "verses" in ql)
     )
 
+def _expand_query(q: str) -> str:
+    """Question as sent to search_fts: Sanskrit spellings corrected, synonyms added (see query_norm.py)."""
+    return query_norm.expand(q)
+
 def _extract_citations_from_text(text: str) -> List[str]:
     out: List[str] = []
     for m in CITE_RE.finditer(text or ""):
@@ -142,23 +162,9 @@ def _extract_citations_from_text(text: str) -> List[str]:
         seen.add(c); uniq.append(c)
     return uniq
 
-def _clean_text(t: str) -> str:
-    if not t:
-        return ""
-    t = re.sub(r"<br\s*/?>", "\n", t, flags=re.I)
-    t = re.sub(r"<[^>]+>", "", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t.replace("[C:V]", "").strip()
-
-def _best_text_block(row: Dict[str, Any], force_source: Optional[str] = None) -> str:
-    if force_source == "commentary2":
-        v = _clean_text(row.get("commentary2") or "")
-        return v or ""
-    for k in ("commentary2", "commentary1", "translation", "colloquial", "roman", "title"):
-        v = _clean_text(row.get(k) or "")
-        if v:
-            return v
-    return ""
+def _rendered(ch: int, v: int, row: Dict[str, Any]) -> Dict[str, Any]:
+    """Precomputed display text for a verse; renders on the spot if the store has not caught up."""
+    return verse_store.rendered(ch, v) or render_verse(row)
 
 def _make_dynamic_suggestions(user_q: str, cites: List[str]) -> List[str]:
     sug: List[str] = []
@@ -172,31 +178,137 @@ def _make_dynamic_suggestions(user_q: str, cites: List[str]) -> List[str]:
     return sug[:4]
 
 # --- LLM helpers -----------------------------------------------------------
-def _model_answer_guarded(question: str, max_tokens: int = 700) -> str:
-    system = (
-        "You are a Bhagavad Gita tutor. Answer clearly and helpfully, using only the Bhagavad Gita.\n"
-        "Prefer to weave in chapter:verse citations like [2:47] whenever you refer to a verse.\n"
-        "Do not cite or rely on other scriptures or external sources.\n"
-        "Use a natural structure (headings, short paragraphs, lists) in plain text.\n"
-        "If the question is not answerable from the Gita, say so briefly."
-    )
-    prompt = f"Question: {question}\n\nRespond as instructed above."
+def _in_background(fn: Callable[..., Any], *args: Any) -> None:
+    """
+    Run a cache write on the default thread pool without holding up the answer.
+    The write may wait for the shared SQLite writer; the cache modules never raise.
+    """
+    asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+def _messages(system: str, user: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+async def _chat(system: str, user: str, max_tokens: int, temperature: float = 0.2,
+                timeout: Optional[float] = None, use_cache: bool = True) -> str:
+    """
+    One completion under the per-worker concurrency cap, served from the
+    persistent completion cache when possible. Returns "" on error or timeout.
+    """
+    key = llm_cache.key_for(LLM_MODEL_TAG, system, user, max_tokens, temperature, bypass=not use_cache)
+    with metrics.span("llm_cache"):
+        cached = await asyncio.to_thread(llm_cache.get, key) if key is not None else None
+    if cached is not None:
+        metrics.note_llm_call(LLM_MODEL_TAG, "cache_hit")
+        return cached
+    timeout = timeout or LLM_TIMEOUT_SEC
+
+    async def _call() -> str:
+        async with _LLM_SEM:
+            return await provider.acomplete(GEN_MODEL, _messages(system, user), max_tokens,
+                                            temperature=temperature, timeout=timeout)
+
     try:
-        rsp = client.chat.completions.create(
-            model=GEN_MODEL,
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=max_tokens,
-        )
-        return (rsp.choices[0].message.content or "").strip()
+        # bounds the semaphore wait as well as the request itself
+        with metrics.span("llm"):
+            text = await asyncio.wait_for(_call(), timeout=timeout)
     except Exception:
+        metrics.note_llm_call(LLM_MODEL_TAG, "error")
         return ""
+    metrics.note_llm_call(LLM_MODEL_TAG, "ok")
+    if key is not None and text:
+        _in_background(llm_cache.put, key, LLM_MODEL_TAG, text)
+    return text
 
-def _synthesize_structured(question: str, ctx_lines: List[str],
-                           min_sections: int = 3, max_sections: int = 4,
-                           target_words_low: int = 350, target_words_high: int = 450,
-                           enforce_diversity_hint: Optional[List[str]] = None) -> str:
+async def _chat_stream(system: str, user: str, max_tokens: int, temperature: float = 0.2,
+                       timeout: Optional[float] = None, use_cache: bool = True) -> AsyncIterator[str]:
+    """
+    Streaming twin of _chat: yields content deltas, stops quietly on error or
+    timeout. A cache hit arrives as one delta; only complete streams are cached.
+    """
+    key = llm_cache.key_for(LLM_MODEL_TAG, system, user, max_tokens, temperature, bypass=not use_cache)
+    with metrics.span("llm_cache"):
+        cached = await asyncio.to_thread(llm_cache.get, key) if key is not None else None
+    if cached is not None:
+        metrics.note_llm_call(LLM_MODEL_TAG, "cache_hit")
+        yield cached
+        return
+    timeout = timeout or LLM_TIMEOUT_SEC
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + timeout
+    try:
+        await asyncio.wait_for(_LLM_SEM.acquire(), timeout=timeout)
+    except Exception:
+        return
+    stream = None
+    try:
+        stream = provider.astream(GEN_MODEL, _messages(system, user), max_tokens,
+                                  temperature=temperature, timeout=timeout)
+        parts: List[str] = []
+        while True:
+            try:
+                delta = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                break
+            if not parts:
+                metrics.add_stage("llm_first_token", loop.time() - started)
+            parts.append(delta)
+            yield delta
+        metrics.add_stage("llm", loop.time() - started)
+        metrics.note_llm_call(LLM_MODEL_TAG, "ok")
+        text = "".join(parts).strip()
+        if key is not None and text:
+            _in_background(llm_cache.put, key, LLM_MODEL_TAG, text)
+    except Exception:
+        metrics.note_llm_call(LLM_MODEL_TAG, "error")  # timeout or API error: nothing is cached
+    finally:
+        _LLM_SEM.release()
+        if stream is not None:
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+
+def _chat_sync(system: str, user: str, max_tokens: int, temperature: float = 0.2) -> str:
+    """
+    Blocking variant for canonical generation threads (never call from a
+    request handler). Errors propagate and the SDK does not retry, so the
+    canonical_jobs scheduler sees 429s and backs off itself.
+    """
+    return provider.complete(GEN_MODEL, _messages(system, user), max_tokens,
+                             temperature=temperature, timeout=LLM_TIMEOUT_SEC, retries=0)
+
+GUARDED_SYSTEM = (
+    "You are a Bhagavad Gita tutor. Answer clearly and helpfully, using only the Bhagavad Gita.\n"
+    "Prefer to weave in chapter:verse citations like [2:47] whenever you refer to a verse.\n"
+    "Do not cite or rely on other scriptures or external sources.\n"
+    "Use a natural structure (headings, short paragraphs, lists) in plain text.\n"
+    "If the question is not answerable from the Gita, say so briefly."
+)
+
+def _guarded_prompt(question: str) -> str:
+    return f"Question: {question}\n\nRespond as instructed above."
+
+async def _model_answer_guarded(question: str, max_tokens: int = 700, use_cache: bool = True) -> str:
+    return await _chat(GUARDED_SYSTEM, _guarded_prompt(question), max_tokens=max_tokens, use_cache=use_cache)
+
+DEFINITION_SYSTEM = (
+    "You are a Bhagavad Gita tutor. Define the term from the Gita only. "
+    "Include 2–3 inline verse citations like [chapter:verse] where relevant."
+)
+
+def _definition_prompt(q: str) -> str:
+    return f"Define briefly and clearly: {q}"
+
+async def _define_term(q: str, use_cache: bool = True) -> str:
+    return await _chat(DEFINITION_SYSTEM, _definition_prompt(q), max_tokens=380, use_cache=use_cache)
+
+STRUCTURED_SYSTEM = "Answer ONLY from the provided context. Plain text. Use [chapter:verse]."
+
+def _structured_prompt(question: str, ctx_lines: List[str],
+                       min_sections: int = 3, max_sections: int = 4,
+                       target_words_low: int = 350, target_words_high: int = 450,
+                       enforce_diversity_hint: Optional[List[str]] = None) -> str:
     ctx = "\n".join(ctx_lines)[:8000]
     diversity_hint = ""
     if enforce_diversity_hint:
@@ -204,7 +316,7 @@ def _synthesize_structured(question: str, ctx_lines: List[str],
             "Broaden citations across chapters where possible; avoid clustering from adjacent verses. "
             f"Prefer these distinct chapters if relevant: {', '.join(sorted(set(enforce_diversity_hint)))}.\n"
         )
-    prompt = (
+    return (
         "You are a Bhagavad Gita assistant. Use ONLY the Context below.\n"
         f"Write a structured answer with {min_sections}–{max_sections} thematic sections.\n"
         "- 2–4 sentences each, plain text, with [chapter:verse] citations where used.\n"
@@ -215,19 +327,10 @@ def _synthesize_structured(question: str, ctx_lines: List[str],
         "Context (each line = [chapter:verse] prose):\n"
         f"{ctx}\n"
     )
-    try:
-        rsp = client.chat.completions.create(
-            model=GEN_MODEL,
-            messages=[
-                {"role": "system", "content": "Answer ONLY from the provided context. Plain text. Use [chapter:verse]."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.2,
-            max_tokens=800,
-        )
-        return (rsp.choices[0].message.content or "").strip()
-    except Exception:
-        return ""
+
+async def _synthesize_structured(question: str, ctx_lines: List[str], use_cache: bool = True, **kw) -> str:
+    return await _chat(STRUCTURED_SYSTEM, _structured_prompt(question, ctx_lines, **kw),
+                       max_tokens=800, use_cache=use_cache)
 
 # ====================== HTML (unchanged UI) ======================
 @app.get("/", response_class=HTMLResponse)
@@ -265,14 +368,15 @@ def home():
     """
 
 # ====================== Ingest endpoints ======================
+# UploadFile.file is the multipart parser's spooled temp file (on disk past 1 MB).
+# Parsers read it in place, batch by batch, on a worker thread, so a large
+# upload neither sits in memory whole nor blocks the event loop.
 @app.post("/ingest_sheet_sql")
 async def ingest_sheet_sql(file: UploadFile = File(...)):
     try:
-        bytes_ = await file.read()
-        rows = load_sheet_to_rows(bytes_, file.filename)
-        conn = get_conn()
-        n = bulk_upsert(conn, rows)
-        ensure_fts(conn)
+        n = await asyncio.to_thread(ingest_sheet, file.file, file.filename)
+        await asyncio.to_thread(verse_store.reload)  # old snapshot serves until the swap
+        query_norm.refresh_async()
         return {"ingested_rows": n}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -285,33 +389,68 @@ async def ingest_commentary_route(
     source: str = Form("")
 ):
     try:
-        bytes_ = await file.read()
-        n = ingest_commentary(bytes_, file.filename, topic, commentator, source or file.filename)
-        return {"chunks_added": n}
+        report = await asyncio.to_thread(ingest_commentary, file.file, file.filename,
+                                         topic, commentator, source or file.filename)
+        return {"chunks_added": report["new"], "report": report}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # ====================== Lookup & debug ======================
 @app.get("/title/{ch}/{v}")
 async def get_title(ch: int, v: int):
-    conn = get_conn()
-    row = fetch_exact(conn, ch, v)
-    if not row:
+    title = verse_store.field(ch, v, "title")
+    if title is None:
         raise HTTPException(status_code=404, detail="Not found")
-    return {"chapter": ch, "verse": v, "title": row["title"] or ""}
+    return {"chapter": ch, "verse": v, "title": title}
 
 @app.get("/debug/verse/{ch}/{v}")
 async def debug_verse(ch: int, v: int):
-    conn = get_conn()
-    row = fetch_exact(conn, ch, v)
+    row = verse_store.get(ch, v)
     if not row:
         raise HTTPException(status_code=404, detail="Not found")
-    return dict(row)
+    return row
 
 @app.get("/debug/stats")
 async def debug_stats():
     conn = get_conn()
-    return stats(conn)
+    return {**stats(conn), "verse_store": verse_store.stats(),
+            "canonical_index": canonical_index.stats()}
+
+@app.get("/debug/pool")
+async def debug_pool():
+    return pool_stats()
+
+@app.get("/debug/llm_cache")
+async def debug_llm_cache():
+    return llm_cache.stats()
+
+@app.get("/debug/semantic_cache")
+async def debug_semantic_cache():
+    return semantic_cache.stats()
+
+@app.get("/debug/embed_cache")
+async def debug_embed_cache():
+    return embed_cache.stats()
+
+@app.get("/debug/query_norm")
+async def debug_query_norm(q: str = Query("", description="question to rewrite")):
+    out = query_norm.stats()
+    if q:
+        out["rewrite"] = query_norm.explain(q)
+    return out
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition: /ask latency and stage histograms, LLM calls and tokens."""
+    lc, sc, ec, pool = llm_cache.stats(), semantic_cache.stats(), embed_cache.stats(), pool_stats()
+    gauges = {
+        "gita_llm_cache_hit_ratio": ("LLM completion cache hit ratio since start.", lc["hit_rate"]),
+        "gita_semantic_cache_hit_ratio": ("Semantic answer cache hit ratio since start.", sc["hit_rate"]),
+        "gita_embed_cache_hit_ratio": ("Query embedding cache hit ratio since start (memory + table).", ec["hit_rate"]),
+        "gita_semantic_cache_indexed": ("Questions in the semantic cache index.", sc["indexed"]),
+        "gita_db_readers_open": ("Pooled SQLite reader connections.", pool["readers_open"]),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/suggest")
 async def suggest():
@@ -348,139 +487,56 @@ def debug_canonical(q: str):
 class AskPayload(BaseModel):
     question: str
     topic: Optional[str] = None
+    no_cache: bool = False  # bypass the LLM completion cache for this request
+    timings: bool = False   # add debug.timings (per-stage ms, LLM calls and tokens) to the response
 
-@app.post("/ask")
-async def ask(payload: AskPayload):
-    q = (payload.question or "").strip()
-    if not q:
-        raise HTTPException(status_code=400, detail="Empty question")
-
-    conn = get_conn()
-
-    # --- Direct verse path (Explain / Word Meaning)
+def _route_fast(q: str, conn) -> Optional[Dict[str, Any]]:
+    """
+    Routes that never call the LLM: direct verse (explain / word meaning),
+    canonical answers and thematic listings. None when the question still
+    needs a model answer.
+    """
+    # --- Direct verse path (Explain / Word Meaning), served from the in-memory verse store
     cv = _extract_ch_verse(q)
     if cv:
-        ch, v = cv
-        row_r = fetch_exact(conn, ch, v)
-        if not row_r:
-            return {
-                "mode": "error",
-                "answer": f"Chapter {ch}, Verse {v} does not exist.",
-                "citations": [],
-                "debug": {"mode": "explain", "error": "no_such_verse"}
-            }
-        row = dict(row_r)
-
-        if _is_word_meaning_query(q):
-            wm = row.get("word_meanings") or ""
-            return {
-                "mode": "word_meaning",
-                "chapter": ch, "verse": v,
-                "answer": wm if wm else NO_MATCH_MESSAGE,
-                "citations": [f"[{ch}:{v}]"],
-                "debug": {"mode": "word_meaning"}
-            }
-
-        neighbors = [dict(n) for n in fetch_neighbors(conn, ch, v, k=1)]
-        resp = {
-            "mode": "explain",
-            "chapter": ch,
-            "verse": v,
-            "title": row.get("title") or "",
-            "sanskrit": _clean_text_preserve_lines(row.get("sanskrit") or ""),
-            "roman": _clean_text_preserve_lines(row.get("roman") or ""),
-            "colloquial": _clean_text_preserve_lines(row.get("colloquial") or ""),
-            "translation": _clean_text_preserve_lines(row.get("translation") or ""),
-            "summary": _clean_text_preserve_lines(row.get("summary") or ""),
-            "word_meanings": _clean_text_preserve_lines(row.get("word_meanings") or ""),
-            "commentary2": _clean_text_preserve_lines(row.get("commentary2") or ""),
-            "commentary3": _clean_text_preserve_lines(row.get("commentary3") or ""),
-            "commentary1": _clean_text_preserve_lines(row.get("commentary1") or ""),
-            "capsule_url": row.get("capsule_url") or "",
-            "neighbors": [
-                {"chapter": int(n["chapter"]), "verse": int(n["verse"]), "translation": n.get("translation") or ""}
-                for n in neighbors
-            ],
-            "citations": [f"[{ch}:{v}]"],
-            "debug": {
-                "mode": "explain",
-                "used_db_summary": bool(row.get("summary")),
-                "summary_fallback_generated": False
-            }
-        }
-        return resp
+        with metrics.span("verse_lookup"):
+            return _route_verse(q, *cv)
 
-    # --- Canonical fast path ---
+    # --- Canonical fast path (exact/alias/trigram index, then sanitized FTS) ---
+    # A listing question only takes a canonical answer written for that exact
+    # wording; fuzzy matches would turn "which verses talk about X" into another topic.
+    listing = _is_verses_listing_query(q)
     try:
-        hit = []
-        try:
-            cur = conn.execute("""
-                SELECT q.id, q.micro_topic_id, q.intent, q.priority, q.question_text
-                FROM questions_fts
-                JOIN questions q ON q.id = questions_fts.rowid
-                WHERE questions_fts MATCH ?
-                ORDER BY bm25(questions_fts) ASC, q.priority ASC
-                LIMIT 1
-            """, (q,))
-            hit = [dict(r) for r in cur.fetchall()]
-        except Exception:
-            pass
-        if not hit:
-            cur = conn.execute("""
-                SELECT id, micro_topic_id, intent, priority, question_text
-                FROM questions
-                WHERE question_text LIKE '%'||?||'%'
-                ORDER BY priority ASC, id ASC
-                LIMIT 1
-            """, (q,))
-            hit = [dict(r) for r in cur.fetchall()]
-
-        if hit:
-            qrow = hit[0]
-            cur = conn.execute("""
-                SELECT length_tier, answer_text
-                FROM answers
-                WHERE question_id=?
-                ORDER BY CASE length_tier WHEN 'short' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END
-            """, (qrow["id"],))
-            ans_rows = [dict(r) for r in cur.fetchall()]
-            if ans_rows:
-                by_tier = {a['length_tier']: a['answer_text'] for a in ans_rows}
-                detail = _normalize_md_answer(by_tier.get("long", "") or "")
-                summary = _normalize_md_answer(by_tier.get("short", "") or "")
-                cites = _extract_citations_from_text(detail)
-                return {
-                    "mode": "canonical",
-                    "matched_question": qrow.get("question_text"),
-                    "answer": detail,         # Detail only
-                    "summary": summary,       # optional Summary
-                    "citations": [f"[{c}]" for c in cites[:8]],
-                    "suggestions": _make_dynamic_suggestions(q, cites[:5]),
-                    "embeddings_used": False,
-                    "debug": {"mode": "canonical", "qid": qrow["id"]}
-                }
+        with metrics.span("canonical_match"):
+            qrow = canonical_index.match(q, conn, fuzzy=not listing)
+        if qrow:
+            with metrics.span("canonical_answers"):
+                resp = _canonical_response(q, qrow, conn)
+            if resp:
+                return resp
     except Exception:
         pass
 
     # --- Thematic verse listing ---
-    q_expanded = _expand_query(q)
-    fts_rows = search_fts(conn, q_expanded, limit=60)
-    if _is_verses_listing_query(q):
-        diversified = _diversify_hits(
-            [(int(r["chapter"]), int(r["verse"]), dict(r)) for r in fts_rows],
-            per_chapter=2, max_total=20, neighbor_radius=1, min_distinct_chapters=3
-        )
-        lines: List[str] = []
-        cites: List[str] = []
-        for ch, v, data in diversified[:20]:
-            row = dict(data)
-            title = _clean_text(row.get("title") or "")
-            trans = _clean_text(row.get("translation") or row.get("roman") or row.get("colloquial") or "")
-            if trans and len(trans) > 220:
-                trans = trans[:220].rsplit(" ", 1)[0] + "…"
-            label = f"{ch}:{v}"
-            lines.append(f"{title} — {trans} [{label}]".strip())
-            cites.append(label)
+    if listing:
+        with metrics.span("expand_query"):
+            q_expanded = _expand_query(q)
+        with metrics.span("search_fts"):
+            fts_rows = search_fts(conn, q_expanded, limit=60)
+        with metrics.span("diversify"):
+            diversified = _diversify_hits(
+                [(int(r["chapter"]), int(r["verse"]), dict(r)) for r in fts_rows],
+                per_chapter=2, max_total=20, neighbor_radius=1, min_distinct_chapters=3
+            )
+        with metrics.span("context"):
+            lines: List[str] = []
+            cites: List[str] = []
+            for ch, v, data in diversified[:20]:
+                rv = _rendered(ch, v, dict(data))
+                title, trans = rv["list_title"], rv["list_snippet"]
+                label = f"{ch}:{v}"
+                lines.append(f"{title} — {trans} [{label}]".strip())
+                cites.append(label)
         answer = "\n\n".join(lines) if lines else NO_MATCH_MESSAGE
         return {
             "mode": "thematic_list",
@@ -491,99 +547,91 @@ async def ask(payload: AskPayload):
             "debug": {"mode": "thematic_list", "items": len(lines)}
         }
 
-    # --- Definition short path ---
-    if _is_definition_query(q) or (len(q.split()) <= 3):
-        system = (
-            "You are a Bhagavad Gita tutor. Define the term from the Gita only. "
-            "Include 2–3 inline verse citations like [chapter:verse] where relevant."
-        )
-        prompt = f"Define briefly and clearly: {q}"
-        try:
-            rsp = client.chat.completions.create(
-                model=GEN_MODEL,
-                messages=[{"role": "system", "content": system},
-                          {"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=380,
-            )
-            ans = (rsp.choices[0].message.content or "").strip()
-            ans = _normalize_md_answer(ans)
-        except Exception:
-            ans = ""
-        cites = _extract_citations_from_text(ans)
+    return None
+
+def _route_verse(q: str, ch: int, v: int) -> Dict[str, Any]:
+    """Explain / word-meaning answer for a chapter:verse reference."""
+    row = verse_store.get(ch, v)
+    if not row:
         return {
-            "mode": "definition",
-            "answer": ans if ans else NO_MATCH_MESSAGE,
-            "citations": [f"[{c}]" for c in cites[:8]],
-            "suggestions": ["More detail", "Show related verses"],
-            "embeddings_used": False,
-            "debug": {"mode": "definition", "model_only": True, "cites_found": len(cites)}
+            "mode": "error",
+            "answer": f"Chapter {ch}, Verse {v} does not exist.",
+            "citations": [],
+            "debug": {"mode": "explain", "error": "no_such_verse"}
         }
 
-    # --- Model-only thematic fallback ---
-    ans = _model_answer_guarded(q, max_tokens=700)
-    ans = _normalize_md_answer(ans)
-    if not ans:
-        merged = [(int(r["chapter"]), int(r["verse"]), dict(r)) for r in fts_rows]
-        if not merged:
-            return {
-                "mode": "broad",
-                "answer": NO_MATCH_MESSAGE,
-                "citations": [],
-                "suggestions": [],
-                "embeddings_used": False,
-                "debug": {"mode": "none", "reason": "no_hits"}
-            }
+    if _is_word_meaning_query(q):
+        wm = row.get("word_meanings") or ""
+        return {
+            "mode": "word_meaning",
+            "chapter": ch, "verse": v,
+            "answer": wm if wm else NO_MATCH_MESSAGE,
+            "citations": [f"[{ch}:{v}]"],
+            "debug": {"mode": "word_meaning"}
+        }
 
-        diversified = _diversify_hits(merged, per_chapter=2, max_total=12, neighbor_radius=1, min_distinct_chapters=3)
-        ctx_lines: List[str] = []
-        cites_unique: List[str] = []
-        chapters_in_ctx: List[str] = []
-        force_source = "commentary2" if RAG_SOURCE == "commentary2" else None
-
-        for ch, v, data in diversified:
-            row = dict(data)
-            block = _best_text_block(row, force_source=force_source)
-            if not block:
-                continue
-            if len(block) > 600:
-                block = block[:600].rsplit(" ", 1)[0] + "…"
-            ctx_lines.append(f"[{ch}:{v}] {block}")
-            cites_unique.append(f"{ch}:{v}")
-            chapters_in_ctx.append(str(ch))
-            if len(ctx_lines) >= 10:
-                break
+    neighbors = verse_store.neighbors(ch, v)
+    resp = {
+        "mode": "explain",
+        "chapter": ch,
+        "verse": v,
+        "title": row.get("title") or "",
+        **_rendered(ch, v, row)["explain"],
+        "capsule_url": row.get("capsule_url") or "",
+        "neighbors": [
+            {"chapter": int(n["chapter"]), "verse": int(n["verse"]), "translation": n.get("translation") or ""}
+            for n in neighbors
+        ],
+        "citations": [f"[{ch}:{v}]"],
+        "debug": {
+            "mode": "explain",
+            "used_db_summary": bool(row.get("summary")),
+            "summary_fallback_generated": False
+        }
+    }
+    return resp
 
-        if not ctx_lines:
-            return {
-                "mode": "broad",
-                "answer": NO_MATCH_MESSAGE,
-                "citations": [],
-                "suggestions": [],
-                "embeddings_used": False,
-                "debug": {"mode": "broad", "reason": "no_ctx"}
-            }
-
-        ans = _synthesize_structured(q, ctx_lines, min_sections=3, max_sections=4,
-                                     target_words_low=350, target_words_high=450,
-                                     enforce_diversity_hint=chapters_in_ctx)
-        ans = _normalize_md_answer(ans)
-        model_cites = _extract_citations_from_text(ans)
-        ordered: List[str] = []
-        seen = set()
-        for c in model_cites + cites_unique:
-            if c in seen: continue
-            seen.add(c); ordered.append(c)
+def _canonical_response(q: str, qrow: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Stored answer for a matched canonical question, or None if it has no answers yet."""
+    cur = conn.execute("""
+        SELECT length_tier, answer_text
+        FROM answers
+        WHERE question_id=?
+        ORDER BY CASE length_tier WHEN 'short' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END
+    """, (qrow["id"],))
+    ans_rows = [dict(r) for r in cur.fetchall()]
+    if not ans_rows:
+        return None
+    by_tier = {a['length_tier']: a['answer_text'] for a in ans_rows}
+    detail = _normalize_md_answer(by_tier.get("long", "") or "")
+    summary = _normalize_md_answer(by_tier.get("short", "") or "")
+    cites = _extract_citations_from_text(detail)
+    return {
+        "mode": "canonical",
+        "matched_question": qrow.get("question_text"),
+        "answer": detail,         # Detail only
+        "summary": summary,       # optional Summary
+        "citations": [f"[{c}]" for c in cites[:8]],
+        "suggestions": _make_dynamic_suggestions(q, cites[:5]),
+        "embeddings_used": False,
+        "debug": {"mode": "canonical", "qid": qrow["id"], "match": qrow["match"], "score": qrow["score"]}
+    }
 
-        return {
-            "mode": "rag",
-            "answer": ans if ans else NO_MATCH_MESSAGE,
-            "citations": [f"[{c}]" for c in ordered[:8]],
-            "suggestions": _make_dynamic_suggestions(q, ordered[:5]),
-            "embeddings_used": False,
-            "debug": {"mode": "rag_fallback", "rag_source": RAG_SOURCE or "mixed"}
-        }
+def _wants_definition(q: str) -> bool:
+    return _is_definition_query(q) or (len(q.split()) <= 3)
+
+def _definition_response(q: str, ans: str) -> Dict[str, Any]:
+    cites = _extract_citations_from_text(ans)
+    return {
+        "mode": "definition",
+        "answer": ans if ans else NO_MATCH_MESSAGE,
+        "citations": [f"[{c}]" for c in cites[:8]],
+        "suggestions": ["More detail", "Show related verses"],
+        "embeddings_used": False,
+        "debug": {"mode": "definition", "model_only": True, "cites_found": len(cites)}
+    }
 
+def _model_only_response(q: str, ans: str) -> Dict[str, Any]:
     cites = _extract_citations_from_text(ans)
     return {
         "mode": "model_only",
@@ -594,6 +642,270 @@ async def ask(payload: AskPayload):
         "debug": {"mode": "model_only"}
     }
 
+def _broad_no_match(debug_mode: str, reason: str) -> Dict[str, Any]:
+    return {
+        "mode": "broad",
+        "answer": NO_MATCH_MESSAGE,
+        "citations": [],
+        "suggestions": [],
+        "embeddings_used": False,
+        "debug": {"mode": debug_mode, "reason": reason}
+    }
+
+async def _retrieve(q: str, qvec: Optional[List[float]]) -> Tuple[List[Tuple[int, int, Dict]], Dict[str, Any]]:
+    """Hybrid FTS + commentary-vector hits for the RAG path (see retrieval.py)."""
+    with metrics.span("expand_query"):
+        q_expanded = _expand_query(q)
+    with metrics.span("retrieve"):
+        return await retrieval.hybrid_hits(q, q_expanded, qvec, topic=TOPIC_DEFAULT)
+
+def _rag_context(merged: List[Tuple[int, int, Dict]]) -> Tuple[List[str], List[str], List[str]]:
+    """Diversified [ch:v] context lines for synthesis -> (ctx_lines, cites, chapters)."""
+    with metrics.span("diversify"):
+        diversified = _diversify_hits(merged, per_chapter=2, max_total=12, neighbor_radius=1, min_distinct_chapters=3)
+    with metrics.span("context"):
+        return _build_rag_context(diversified)
+
+def _build_rag_context(diversified: List[Tuple[int, int, Dict]]) -> Tuple[List[str], List[str], List[str]]:
+    ctx_lines: List[str] = []
+    cites_unique: List[str] = []
+    chapters_in_ctx: List[str] = []
+    block_key = "rag_block_c2" if RAG_SOURCE == "commentary2" else "rag_block"
+
+    for ch, v, data in diversified:
+        block = _rendered(ch, v, data)[block_key]
+        if not block:
+            continue
+        ctx_lines.append(f"[{ch}:{v}] {block}")
+        cites_unique.append(f"{ch}:{v}")
+        chapters_in_ctx.append(str(ch))
+        if len(ctx_lines) >= 10:
+            break
+    return ctx_lines, cites_unique, chapters_in_ctx
+
+RAG_SHAPE = dict(min_sections=3, max_sections=4, target_words_low=350, target_words_high=450)
+
+def _rag_response(q: str, ans: str, cites_unique: List[str], retrieved: Dict[str, Any]) -> Dict[str, Any]:
+    model_cites = _extract_citations_from_text(ans)
+    ordered: List[str] = []
+    seen = set()
+    for c in model_cites + cites_unique:
+        if c in seen: continue
+        seen.add(c); ordered.append(c)
+
+    return {
+        "mode": "rag",
+        "answer": ans if ans else NO_MATCH_MESSAGE,
+        "citations": [f"[{c}]" for c in ordered[:8]],
+        "suggestions": _make_dynamic_suggestions(q, ordered[:5]),
+        "embeddings_used": isinstance(retrieved.get("vector"), int) and retrieved["vector"] > 0,
+        "debug": {"mode": "rag_fallback", "rag_source": RAG_SOURCE or "mixed", "retrieval": retrieved}
+    }
+
+async def _question_vector(q: str) -> Optional[List[float]]:
+    """Embedding of the question for the semantic cache; None if disabled or it takes too long."""
+    if not semantic_cache.ENABLED:
+        return None
+    try:
+        with metrics.span("embed_question"):
+            return await asyncio.wait_for(asyncio.to_thread(embed_store.embed_query, q),
+                                          timeout=semantic_cache.EMBED_TIMEOUT_SEC)
+    except Exception:
+        semantic_cache.note_embed_failure()
+        return None
+
+def _remember_answer(q: str, qvec: Optional[List[float]], resp: Dict[str, Any]) -> None:
+    if resp.get("mode") in ("definition", "model_only", "rag") and resp.get("answer") != NO_MATCH_MESSAGE:
+        if qvec is not None:
+            _in_background(semantic_cache.store, q, qvec, resp)
+
+def _with_timings(resp: Dict[str, Any], tr: metrics.Trace) -> Dict[str, Any]:
+    return {**resp, "debug": {**(resp.get("debug") or {}), "timings": tr.as_debug()}}
+
+@app.post("/ask")
+async def ask(payload: AskPayload):
+    q = (payload.question or "").strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty question")
+
+    tr = metrics.start_trace()
+    resp: Optional[Dict[str, Any]] = None
+    try:
+        resp = await _ask(q, not payload.no_cache)
+    finally:
+        metrics.finish(tr, "ask", resp.get("mode") if resp else "error")
+    return _with_timings(resp, tr) if payload.timings else resp
+
+async def _ask(q: str, use_cache: bool) -> Dict[str, Any]:
+    conn = get_conn()
+    resp = _route_fast(q, conn)
+    if resp is not None:
+        return resp
+
+    # --- Semantic cache: reuse the answer to a near-identical earlier question
+    qvec = await _question_vector(q) if use_cache else None
+    with metrics.span("semantic_lookup"):
+        hit = await asyncio.to_thread(semantic_cache.lookup, qvec) if qvec is not None else None
+    if hit is not None:
+        return hit
+    resp = await _answer_with_llm(q, qvec, use_cache)
+    _remember_answer(q, qvec, resp)
+    return resp
+
+async def _answer_with_llm(q: str, qvec: Optional[List[float]], use_cache: bool) -> Dict[str, Any]:
+    # --- Definition short path ---
+    if _wants_definition(q):
+        return _definition_response(q, _normalize_md_answer(await _define_term(q, use_cache=use_cache)))
+
+    # --- Model-only thematic fallback ---
+    ans = _normalize_md_answer(await _model_answer_guarded(q, max_tokens=700, use_cache=use_cache))
+    if ans:
+        return _model_only_response(q, ans)
+
+    # --- RAG over hybrid (FTS + commentary vector) hits ---
+    merged, retrieved = await _retrieve(q, qvec)
+    if not merged:
+        return _broad_no_match("none", "no_hits")
+    ctx_lines, cites_unique, chapters_in_ctx = _rag_context(merged)
+    if not ctx_lines:
+        return _broad_no_match("broad", "no_ctx")
+    ans = await _synthesize_structured(q, ctx_lines, use_cache=use_cache,
+                                       enforce_diversity_hint=chapters_in_ctx, **RAG_SHAPE)
+    return _rag_response(q, _normalize_md_answer(ans), cites_unique, retrieved)
+
+# ====================== /ask/stream (SSE) ======================
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _new_citations(buf: str, start: int, seen: set) -> Tuple[List[str], int]:
+    """
+    Scan buf[start:] with CITE_RE for chips not yet emitted.
+    Returns (new 'ch:v' labels, offset to resume from). A trailing '[' that
+    may still become a chip is rescanned once more text has arrived.
+    """
+    out: List[str] = []
+    resume = start
+    for m in CITE_RE.finditer(buf, start):
+        resume = m.end()
+        ch, v = int(m.group(1)), int(m.group(2))
+        label = f"{ch}:{v}"
+        if 1 <= ch <= 18 and 1 <= v <= 200 and label not in seen:
+            seen.add(label); out.append(label)
+    pending = buf.rfind("[", resume)
+    if pending != -1 and len(buf) - pending <= 16:
+        return out, pending
+    return out, len(buf)
+
+async def _stream_answer(mode: str, system: str, prompt: str, max_tokens: int,
+                         out: List[str], use_cache: bool = True) -> AsyncIterator[str]:
+    """Relay one completion as SSE (mode, token, citation); the full text is appended to `out`."""
+    yield _sse("mode", {"mode": mode})
+    buf, scan, seen = "", 0, set()
+    async for delta in _chat_stream(system, prompt, max_tokens=max_tokens, use_cache=use_cache):
+        buf += delta
+        yield _sse("token", {"text": delta})
+        new, scan = _new_citations(buf, scan, seen)
+        for c in new:
+            yield _sse("citation", {"cite": f"[{c}]"})
+    out.append(buf)
+
+@app.post("/ask/stream")
+async def ask_stream(payload: AskPayload):
+    """
+    Same routing as /ask, streamed as Server-Sent Events:
+      mode      {"mode": ...}            (sent again if the route falls back)
+      token     {"text": ...}            LLM routes only
+      citation  {"cite": "[2:47]"}       as soon as a chip appears in the text
+      result    full /ask payload        always last
+    """
+    q = (payload.question or "").strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty question")
+
+    tr = metrics.start_trace()
+    conn = get_conn()
+    try:
+        resp = _route_fast(q, conn)
+    except Exception:
+        metrics.finish(tr, "ask_stream", "error")
+        raise
+    use_cache = not payload.no_cache
+
+    def result(r: Dict[str, Any]) -> str:
+        return _sse("result", _with_timings(r, tr) if payload.timings else r)
+
+    async def events() -> AsyncIterator[str]:
+        metrics.bind(tr)  # the body is iterated outside the handler's context
+        mode = "error"
+        try:
+            if resp is not None:
+                mode = resp.get("mode")
+                yield _sse("mode", {"mode": mode})
+                yield result(resp)
+                return
+
+            qvec = await _question_vector(q) if use_cache else None
+            with metrics.span("semantic_lookup"):
+                hit = await asyncio.to_thread(semantic_cache.lookup, qvec) if qvec is not None else None
+            if hit is not None:
+                mode = hit.get("mode")
+                yield _sse("mode", {"mode": mode})
+                yield result(hit)
+                return
+
+            final: List[Dict[str, Any]] = []
+            async for ev in _stream_with_llm(q, qvec, use_cache, final, result):
+                yield ev
+            if final:
+                mode = final[0].get("mode")
+                _remember_answer(q, qvec, final[0])
+        finally:
+            metrics.finish(tr, "ask_stream", mode)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _stream_with_llm(q: str, qvec: Optional[List[float]], use_cache: bool, final: List[Dict[str, Any]],
+                           emit: Callable[[Dict[str, Any]], str]) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of _answer_with_llm; the result payload is appended
+    to `final` and rendered as the closing SSE event by `emit`.
+    """
+    def result(resp: Dict[str, Any]) -> str:
+        final.append(resp)
+        return emit(resp)
+
+    parts: List[str] = []
+    if _wants_definition(q):
+        async for ev in _stream_answer("definition", DEFINITION_SYSTEM, _definition_prompt(q), 380, parts, use_cache):
+            yield ev
+        yield result(_definition_response(q, _normalize_md_answer("".join(parts))))
+        return
+
+    async for ev in _stream_answer("model_only", GUARDED_SYSTEM, _guarded_prompt(q), 700, parts, use_cache):
+        yield ev
+    ans = _normalize_md_answer("".join(parts))
+    if ans:
+        yield result(_model_only_response(q, ans))
+        return
+
+    merged, retrieved = await _retrieve(q, qvec)
+    if not merged:
+        yield result(_broad_no_match("none", "no_hits"))
+        return
+    ctx_lines, cites_unique, chapters_in_ctx = _rag_context(merged)
+    if not ctx_lines:
+        yield result(_broad_no_match("broad", "no_ctx"))
+        return
+    parts = []
+    prompt = _structured_prompt(q, ctx_lines, enforce_diversity_hint=chapters_in_ctx, **RAG_SHAPE)
+    async for ev in _stream_answer("rag", STRUCTURED_SYSTEM, prompt, 800, parts, use_cache):
+        yield ev
+    yield result(_rag_response(q, _normalize_md_answer("".join(parts)), cites_unique, retrieved))
+
 # ====================== Retrieval diversification ======================
 def _diversify_hits(merged: List[Tuple[int, int, Dict]],
                     per_chapter: int = 2,
@@ -642,9 +954,9 @@ async def admin_sql(
     if ";" in q:
         raise HTTPException(status_code=400, detail="Only a single statement is allowed")
     try:
-        conn = get_conn()
-        conn.row_factory = None
-        cur = conn.execute(q)
+        cur = get_conn().cursor()
+        cur.row_factory = None  # per-cursor: the pooled connection is shared
+        cur.execute(q)
         cols = [c[0] for c in cur.description] if cur.description else []
         rows_raw = cur.fetchall() if cur.description else []
         rows = [dict(zip(cols, r)) for r in rows_raw]
@@ -657,9 +969,9 @@ async def admin_sql(
 @app.get("/debug/summary/{ch}/{v}")
 async def debug_summary(ch: int, v: int):
     try:
-        conn = get_conn()
-        conn.row_factory = None
-        cur = conn.execute(
+        cur = get_conn().cursor()
+        cur.row_factory = None
+        cur.execute(
             "SELECT chapter, verse, summary FROM verses WHERE chapter=? AND verse=?",
             (ch, v),
         )
@@ -683,19 +995,17 @@ async def admin_canonicals_ping(
 @app.post("/admin/canonicals/upload")
 async def admin_upload_canonicals(
     control: UploadFile = File(...),
-    master: UploadFile = File(...),
     x_admin_token: str = Header(None, convert_underscores=False),
 ):
+    # Generation reads verse context from the verses table (_compose_snippet_context),
+    # so only the control questions file is needed; a legacy `master` part is ignored.
     _require_admin(x_admin_token)
     try:
         os.makedirs("/data", exist_ok=True)
         control_path = "/data/control_questions_v3.csv"
-        master_path = "/data/Gita_Master_Index_v1.csv"
         with open(control_path, "wb") as f:
-            f.write(await control.read())
-        with open(master_path, "wb") as f:
-            f.write(await master.read())
-        return {"saved": {"control": control_path, "master": master_path}}
+            await asyncio.to_thread(shutil.copyfileobj, control.file, f, 1 << 20)
+        return {"saved": {"control": control_path}}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -746,10 +1056,11 @@ def _parse_whitelist(whitelist: str) -> List[Tuple[int,int]]:
         seen.add(p); out.append(p)
     return out
 
-def _compose_snippet_context(cv_list: List[Tuple[int,int]], master_lookup: Dict[Tuple[int,int], Dict[str,str]]) -> str:
+def _compose_snippet_context(cv_list: List[Tuple[int,int]]) -> str:
+    """Translation + commentary2 context lines, read from the ingested verses (verse_store)."""
     lines: List[str] = []
     for ch, v in cv_list:
-        row = master_lookup.get((ch, v)) or {}
+        row = verse_store.get(ch, v) or {}
         trans = (row.get("translation") or "").strip()
         comm2 = (row.get("commentary2") or "").strip()
         bits = []
@@ -760,8 +1071,8 @@ def _compose_snippet_context(cv_list: List[Tuple[int,int]], master_lookup: Dict[
             lines.append(f"[{ch}:{v}] {joined}")
     return "\n".join(lines)
 
-def _model_canonical_tiers(question: str, context_snippets: str,
-                           style_hint: str, required_points: str) -> Tuple[str,str,str]:
+def _canonical_tiers_prompt(question: str, context_snippets: str,
+                            style_hint: str, required_points: str) -> Tuple[str, str]:
     system = (
         "You are a Bhagavad Gita tutor. Answer ONLY from the Bhagavad Gita.\n"
         "Use [chapter:verse] chips when you cite verses. Vary structure naturally; don't force a template.\n"
@@ -781,18 +1092,9 @@ def _model_canonical_tiers(question: str, context_snippets: str,
         f"Required points (optional): {required_points or '—'}\n"
         "Begin."
     )
-    try:
-        rsp = client.chat.completions.create(
-            model=GEN_MODEL,
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": f"Question: {question}\n\n{guide}"}],
-            temperature=0.2,
-            max_tokens=1200,
-        )
-        text = (rsp.choices[0].message.content or "").strip()
-    except Exception:
-        text = ""
+    return system, f"Question: {question}\n\n{guide}"
 
+def _parse_canonical_tiers(text: str) -> Tuple[str,str,str]:
     short, medium, long = "", "", ""
     if "<<<SHORT>>>" in text:
         parts = re.split(r"<<<(SHORT|MEDIUM|LONG)>>>", text)
@@ -812,257 +1114,224 @@ def _model_canonical_tiers(question: str, context_snippets: str,
 
     return normalize(short), normalize(medium), normalize(long)
 
-def generate_answer_tiers(question: str, verse_whitelist: str,
-                          master_lookup: Dict[Tuple[int,int], Dict[str,str]],
-                          style_hint: str, required_points: str) -> Tuple[str,str,str]:
-    cvs = _parse_whitelist(verse_whitelist)
-    ctx = _compose_snippet_context(cvs, master_lookup)
-    if not ctx:
-        s = _model_answer_guarded(question, max_tokens=420)
-        return s, s, s
-    return _model_canonical_tiers(question, ctx, style_hint, required_points)
+def _store_canonical(conn, mt_id: int, q_text: str, short_md: str, long_md: str,
+                      input_hash: Optional[str] = None) -> int:
+    """
+    Upsert the question row and its Summary (short) + Detail (long) answers. Medium is ignored.
+    input_hash records what the answers were generated from (see _canonical_input_hash).
+    """
+    rowq = conn.execute("SELECT id FROM questions WHERE question_text=?", (q_text,)).fetchone()
+    if rowq:
+        qid = rowq["id"]
+    else:
+        cur = conn.execute("""
+            INSERT INTO questions(micro_topic_id, intent, priority, source, question_text)
+            VALUES(?, 'general', 5, 'seed', ?)
+        """, (mt_id, q_text))
+        qid = cur.lastrowid
+    for tier, text in (("short", short_md), ("long", long_md)):
+        conn.execute("""
+            INSERT INTO answers(question_id, length_tier, answer_text)
+            VALUES(?,?,?)
+            ON CONFLICT(question_id, length_tier) DO UPDATE SET answer_text=excluded.answer_text
+        """, (qid, tier, text))
+    if input_hash:
+        conn.execute("""
+            INSERT INTO canonical_inputs(question_id, input_hash, model, updated_at)
+            VALUES(?,?,?,?)
+            ON CONFLICT(question_id) DO UPDATE SET
+              input_hash=excluded.input_hash, model=excluded.model, updated_at=excluded.updated_at
+        """, (qid, input_hash, LLM_MODEL_TAG, time.time()))
+    return qid
+
+def _canonical_prompt(item: Dict[str, Any]) -> Tuple[str, str, int]:
+    """(system, user, max_tokens) for one item: tiered from its verse context, or guarded without one."""
+    if not item["ctx"]:
+        return GUARDED_SYSTEM, _guarded_prompt(item["q_text"]), 420
+    system, user = _canonical_tiers_prompt(item["q_text"], item["ctx"], item["style"], item["req_points"])
+    return system, user, 1200
+
+def _canonical_input_hash(item: Dict[str, Any]) -> str:
+    # everything the completion depends on: model, sampling, and the exact prompt
+    # (question, resolved verse context, style hint, required points, template)
+    system, user, max_tokens = _canonical_prompt(item)
+    blob = json.dumps([LLM_MODEL_TAG, 0.2, max_tokens, system, user], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _load_canonical_items(control_path: str) -> List[Dict[str, Any]]:
+    """Parse the control CSV into generation items with verse context and input hash resolved."""
+    with open(control_path, "r", encoding="utf-8") as f:
+        control_rows = list(csv.DictReader(f))
+
+    items: List[Dict[str, Any]] = []
+    for row in control_rows:
+        whitelist = (row.get("verse_whitelist") or "").strip()
+        item = {
+            "q_text": (row.get("question_text") or "").strip(),
+            "mt_id": int(row.get("micro_topic_id") or 0),
+            "style": (row.get("style") or "").strip(),
+            "req_points": (row.get("required_points") or "").strip(),
+            "ctx": _compose_snippet_context(_parse_whitelist(whitelist)),
+        }
+        item["input_hash"] = _canonical_input_hash(item)
+        items.append(item)
+    return items
+
+def _plan_canonicals(items: List[Dict[str, Any]], force: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Items whose stored input hash differs (all of them when force) -> (todo, summary)."""
+    stored: Dict[str, str] = {}
+    if not force:
+        try:
+            stored = {r["question_text"]: r["input_hash"] for r in get_conn().execute("""
+                SELECT q.question_text, ci.input_hash
+                FROM canonical_inputs ci JOIN questions q ON q.id = ci.question_id
+            """)}
+        except sqlite3.OperationalError:
+            pass  # question bank not migrated yet: everything is new
+    todo = [it for it in items if stored.get(it["q_text"]) != it["input_hash"]]
+    return todo, {
+        "total": len(items),
+        "calls": len(todo),
+        "unchanged": len(items) - len(todo),
+        "est_tokens": int(sum(_canonical_cost(it) for it in todo)),
+    }
+
+def _generate_canonical(item: Dict[str, Any]) -> Tuple[str, str]:
+    """(short_md, long_md) for one item; raises on LLM errors (see canonical_jobs)."""
+    system, user, max_tokens = _canonical_prompt(item)
+    text = _chat_sync(system, user, max_tokens=max_tokens)
+    if not item["ctx"]:
+        return text, text
+    short_md, _med, long_md = _parse_canonical_tiers(text)
+    return short_md, long_md
+
+def _canonical_cost(item: Dict[str, Any]) -> float:
+    # rough prompt tokens (~4 chars each) + completion budget, for the TPM bucket
+    if not item["ctx"]:
+        return len(item["q_text"]) / 4 + 500
+    return (len(item["ctx"]) + len(item["q_text"]) + len(item["style"]) + len(item["req_points"]) + 1500) / 4 + 1200
+
+def _store_canonical_item(conn, item: Dict[str, Any], result: Tuple[str, str]) -> None:
+    short_md, long_md = result
+    _store_canonical(conn, item["mt_id"], item["q_text"], short_md, long_md, item.get("input_hash"))
+
+def _store_canonical_batch(batch: List[Tuple[Dict[str, Any], Tuple[str, str]]]) -> None:
+    with writer() as conn:
+        for item, result in batch:
+            _store_canonical_item(conn, item, result)
 
 # ====================== Admin: synchronous run (uses correct context) ======================
+# Plain `def`: FastAPI runs it in the threadpool, so the long loop stays off the event loop
 @app.post("/admin/canonicals/run")
-async def admin_run_canonicals(
+def admin_run_canonicals(
     x_admin_token: str = Header(None, convert_underscores=False),
     control_path: str = "/data/control_questions_v3.csv",
-    master_path: str = "/data/Gita_Master_Index_v1.csv",
-    sleep_sec: float = 0.6,
+    workers: Optional[int] = None,
+    force: bool = Query(False),
+    dry_run: bool = Query(False),
 ):
     _require_admin(x_admin_token)
     try:
-        with open(control_path, "r", encoding="utf-8") as f:
-            control_rows = list(csv.DictReader(f))
-        with open(master_path, "r", encoding="utf-8") as f:
-            master_rows = list(csv.DictReader(f))
-
-        # >>> BUILD master_by_cv (translation + commentary2) <<<
-        master_by_cv: Dict[Tuple[int,int], Dict[str,str]] = {}
-        for r in master_rows:
-            try:
-                ch = int((r.get("chapter") or "").strip())
-                v  = int((r.get("verse") or "").strip())
-            except Exception:
-                continue
-            master_by_cv[(ch, v)] = {
-                "translation": (r.get("translation") or "").strip(),
-                "commentary2": (r.get("commentary2") or "").strip(),
-            }
-
-        import sqlite3
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        for row in control_rows:
-            q_text = (row.get("question_text") or "").strip()
-            mt_id = int(row.get("micro_topic_id") or 0)
-            whitelist = (row.get("verse_whitelist") or "").strip()
-            style = (row.get("style") or "").strip()
-            req_points = (row.get("required_points") or "").strip()
-
-            short_md, med_md, long_md = generate_answer_tiers(
-                question=q_text,
-                verse_whitelist=whitelist,
-                master_lookup=master_by_cv,
-                style_hint=style,
-                required_points=req_points
-            )
-
-            # Upsert question
-            cur.execute("SELECT id FROM questions WHERE question_text=?", (q_text,))
-            rowq = cur.fetchone()
-            if rowq:
-                qid = rowq["id"]
-            else:
-                cur.execute("""
-                    INSERT INTO questions(micro_topic_id, intent, priority, source, question_text)
-                    VALUES(?, 'general', 5, 'seed', ?)
-                """, (mt_id, q_text))
-                qid = cur.lastrowid
-
-            # Store Summary (short) + Detail (long). Ignore medium.
-            cur.execute("""
-                INSERT INTO answers(question_id, length_tier, answer_text)
-                VALUES(?,?,?)
-                ON CONFLICT(question_id, length_tier) DO UPDATE SET answer_text=excluded.answer_text
-            """, (qid, "short", short_md))
-            cur.execute("""
-                INSERT INTO answers(question_id, length_tier, answer_text)
-                VALUES(?,?,?)
-                ON CONFLICT(question_id, length_tier) DO UPDATE SET answer_text=excluded.answer_text
-            """, (qid, "long", long_md))
-
-            conn.commit()
-            if sleep_sec and sleep_sec > 0:
-                time.sleep(sleep_sec)
-
-        conn.close()
-        return {"status":"ok"}
+        todo, plan = _plan_canonicals(_load_canonical_items(control_path), force=force)
+        if dry_run:
+            return {"status": "dry_run", **plan}
+        counts = canonical_jobs.run_pool(
+            todo, _generate_canonical, _store_canonical_batch,
+            cost=_canonical_cost, workers=workers,
+        )
+        canonical_index.reload()
+        return {"status": "ok", **plan, **counts}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# ====================== Admin: background job (FIXED worker builds context) ======================
-JOB = {
-    "running": False,
-    "done": False,
-    "started_at": None,
-    "finished_at": None,
-    "processed": 0,
-    "total": 0,
-    "errors": 0,
-    "last_error": "",
-    "stop": False,
-}
-JOB_LOCK = threading.Lock()
-
-def _canonicals_worker(control_path: str, master_path: str, sleep_sec: float, wipe: bool):
-    with JOB_LOCK:
-        JOB.update({
-            "running": True, "done": False, "started_at": time.time(),
-            "finished_at": None, "processed": 0, "errors": 0, "last_error": "", "stop": False
-        })
+# ====================== Admin: background job (durable, see canonical_jobs) ======================
+def _canonicals_worker(job_id: int):
     try:
-        # Load CSVs
-        with open(control_path, "r", encoding="utf-8") as f:
-            control_rows = list(csv.DictReader(f))
-        with open(master_path, "r", encoding="utf-8") as f:
-            master_rows = list(csv.DictReader(f))
-
-        # >>> BUILD master_by_cv (THIS WAS THE BUG) <<<
-        master_by_cv: Dict[Tuple[int,int], Dict[str,str]] = {}
-        for r in master_rows:
-            try:
-                ch = int((r.get("chapter") or "").strip())
-                v  = int((r.get("verse") or "").strip())
-            except Exception:
-                continue
-            master_by_cv[(ch, v)] = {
-                "translation": (r.get("translation") or "").strip(),
-                "commentary2": (r.get("commentary2") or "").strip(),
-            }
-
-        total = len(control_rows)
-        with JOB_LOCK:
-            JOB["total"] = total
-
-        import sqlite3
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        # Optional wipe of prior *seed* canonicals
-        if wipe:
-            cur.execute("""
-                DELETE FROM answers
-                WHERE question_id IN (SELECT id FROM questions WHERE source='seed')
-            """)
-            cur.execute("DELETE FROM questions WHERE source='seed'")
-            try:
-                cur.execute("INSERT INTO questions_fts(questions_fts) VALUES('rebuild')")
-            except Exception:
-                pass
-            conn.commit()
-
-        # Upsert per control row
-        for idx, row in enumerate(control_rows, start=1):
-            with JOB_LOCK:
-                if JOB["stop"]:
-                    break
-
-            q_text = (row.get("question_text") or "").strip()
-            mt_id = int(row.get("micro_topic_id") or 0)
-            whitelist = (row.get("verse_whitelist") or "").strip()
-            style = (row.get("style") or "").strip()
-            req_points = (row.get("required_points") or "").strip()
-
-            short_md, med_md, long_md = generate_answer_tiers(
-                question=q_text,
-                verse_whitelist=whitelist,
-                master_lookup=master_by_cv,
-                style_hint=style,
-                required_points=req_points
-            )
-
-            cur.execute("SELECT id FROM questions WHERE question_text=?", (q_text,))
-            rowq = cur.fetchone()
-            if rowq:
-                qid = rowq["id"]
-            else:
-                cur.execute("""
-                    INSERT INTO questions(micro_topic_id, intent, priority, source, question_text)
-                    VALUES(?, 'general', 5, 'seed', ?)
-                """, (mt_id, q_text))
-                qid = cur.lastrowid
-
-            # Write Summary (short) + Detail (long). Ignore medium.
-            cur.execute("""
-                INSERT INTO answers(question_id, length_tier, answer_text)
-                VALUES(?,?,?)
-                ON CONFLICT(question_id, length_tier) DO UPDATE SET answer_text=excluded.answer_text
-            """, (qid, "short", short_md))
-            cur.execute("""
-                INSERT INTO answers(question_id, length_tier, answer_text)
-                VALUES(?,?,?)
-                ON CONFLICT(question_id, length_tier) DO UPDATE SET answer_text=excluded.answer_text
-            """, (qid, "long", long_md))
-            conn.commit()
-
-            with JOB_LOCK:
-                JOB["processed"] = idx
-
-            if sleep_sec and sleep_sec > 0:
-                time.sleep(sleep_sec)
-
-        conn.close()
-    except Exception as e:
-        with JOB_LOCK:
-            JOB["errors"] += 1
-            JOB["last_error"] = str(e)
+        canonical_jobs.run_job(job_id, _generate_canonical, _store_canonical_item, cost=_canonical_cost)
     finally:
-        with JOB_LOCK:
-            JOB["running"] = False
-            JOB["done"] = True
-            JOB["finished_at"] = time.time()
+        canonical_index.reload()
 
+def _start_canonicals_worker(job_id: int) -> None:
+    threading.Thread(target=_canonicals_worker, args=(job_id,), daemon=True).start()
+
+def _resume_canonicals() -> Optional[int]:
+    """Pick up an unfinished job after a restart; other workers stand by on its lease."""
+    try:
+        job = canonical_jobs.active_job(get_conn())
+    except sqlite3.OperationalError:
+        return None
+    if job:
+        _start_canonicals_worker(job["id"])
+        return job["id"]
+    return None
+
+# Plain `def`: loads the control CSV and writes the job items off the event loop
 @app.post("/admin/canonicals/start")
-async def admin_canonicals_start(
+def admin_canonicals_start(
     x_admin_token: str = Header(None, convert_underscores=False),
     control_path: str = "/data/control_questions_v3.csv",
-    master_path: str = "/data/Gita_Master_Index_v1.csv",
-    sleep_sec: float = 0.6,
+    workers: Optional[int] = None,
     wipe: bool = Query(False),
+    resume: bool = Query(False),
+    force: bool = Query(False),
+    dry_run: bool = Query(False),
 ):
     _require_admin(x_admin_token)
-    with JOB_LOCK:
-        if JOB["running"]:
-            return {"status": "already_running", "processed": JOB["processed"], "total": JOB["total"]}
-        JOB.update({"stop": False})
-    t = threading.Thread(target=_canonicals_worker, args=(control_path, master_path, sleep_sec, wipe), daemon=True)
-    t.start()
-    return {"status": "started", "wipe": wipe}
+    job = canonical_jobs.active_job(get_conn())
+    if job:
+        if canonical_jobs.lease_alive(job):
+            return {"status": "already_running", "job_id": job["id"], "processed": job["processed"], "total": job["total"]}
+        _start_canonicals_worker(job["id"])
+        return {"status": "resumed", "job_id": job["id"], "processed": job["processed"], "total": job["total"]}
+    if resume:
+        with writer() as conn:
+            job_id = canonical_jobs.reopen_last(conn)
+        if job_id is None:
+            return {"status": "nothing_to_resume"}
+        _start_canonicals_worker(job_id)
+        return {"status": "resumed", "job_id": job_id}
+
+    # only rows whose generation input changed since their answers were stored
+    todo, plan = _plan_canonicals(_load_canonical_items(control_path), force=force or wipe)
+    if dry_run:
+        return {"status": "dry_run", "wipe": wipe, **plan}
+    if not todo:
+        return {"status": "up_to_date", **plan}
+    with writer() as conn:
+        # Optional wipe of prior *seed* canonicals, once per job (a resume never re-wipes)
+        if wipe:
+            conn.execute("""
+                DELETE FROM answers
+                WHERE question_id IN (SELECT id FROM questions WHERE source='seed')
+            """)
+            conn.execute("""
+                DELETE FROM canonical_inputs
+                WHERE question_id IN (SELECT id FROM questions WHERE source='seed')
+            """)
+            conn.execute("DELETE FROM questions WHERE source='seed'")
+            try:
+                conn.execute("INSERT INTO questions_fts(questions_fts) VALUES('rebuild')")
+            except Exception:
+                pass
+        job_id = canonical_jobs.create_job(conn, todo, {
+            "control_path": control_path, "workers": workers, "wipe": wipe, "force": force,
+        })
+    _start_canonicals_worker(job_id)
+    return {"status": "started", "job_id": job_id, "wipe": wipe, **plan}
 
 @app.get("/admin/canonicals/status")
 async def admin_canonicals_status(
     x_admin_token: str = Header(None, convert_underscores=False),
 ):
     _require_admin(x_admin_token)
-    with JOB_LOCK:
-        out = dict(JOB)
-    pct = 0.0
-    if out["total"]:
-        pct = round(100.0 * (out["processed"] / float(out["total"])), 2)
-    out["percent"] = pct
-    return out
+    return canonical_jobs.status(get_conn())
 
 @app.post("/admin/canonicals/stop")
-async def admin_canonicals_stop(
+def admin_canonicals_stop(
     x_admin_token: str = Header(None, convert_underscores=False),
 ):
     _require_admin(x_admin_token)
-    with JOB_LOCK:
-        if not JOB["running"]:
+    with writer() as conn:
+        if not canonical_jobs.request_stop(conn):
             return {"status": "not_running"}
-        JOB["stop"] = True
     return {"status": "stopping"}
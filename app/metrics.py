@@ -0,0 +1,189 @@
+# app/metrics.py — per-stage timings for /ask and a Prometheus text exposition
+#
+# A request opens a Trace (start_trace); code on the request path wraps each
+# stage in `with span("search_fts"):`, and LLM providers report token usage
+# through note_llm_usage(). Both land on the current Trace via a contextvar,
+# so helpers need no extra arguments and spans outside a request (canonical
+# generation threads, scripts) cost one contextvar lookup. finish() files the
+# trace into process-local histograms labelled by the mode the request ended
+# in; render() serves them at GET /metrics.
+#
+# Metrics are per worker process: with several uvicorn workers each scrape
+# sees the worker that answered it.
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond in-memory stages up to slow LLM completions
+BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                              0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Trace:
+    __slots__ = ("t0", "stages", "llm_calls", "llm_cache_hits", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}  # stage -> seconds, summed if a stage repeats
+        self.llm_calls = 0
+        self.llm_cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def as_debug(self) -> Dict[str, Any]:
+        """Shape returned in debug.timings."""
+        return {
+            "total_ms": round(self.elapsed() * 1000.0, 2),
+            "stages_ms": {k: round(v * 1000.0, 2) for k, v in self.stages.items()},
+            "llm": {"calls": self.llm_calls, "cache_hits": self.llm_cache_hits,
+                    "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens},
+        }
+
+_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("ask_trace", default=None)
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)  # non-cumulative; cumulated on render
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.counts[i] += 1
+                break
+        self.sum += v
+        self.count += 1
+
+_LOCK = threading.Lock()
+_REQUEST_SECONDS: Dict[Tuple[str, str], _Histogram] = {}       # (endpoint, mode)
+_STAGE_SECONDS: Dict[Tuple[str, str], _Histogram] = {}         # (mode, stage)
+_LLM_CALLS: Dict[Tuple[str, str], int] = {}                    # (model, outcome)
+_LLM_TOKENS: Dict[Tuple[str, str], int] = {}                   # (model, prompt|completion)
+
+def start_trace() -> Trace:
+    tr = Trace()
+    _TRACE.set(tr)
+    return tr
+
+def current() -> Optional[Trace]:
+    return _TRACE.get()
+
+def bind(tr: Trace) -> None:
+    """Make tr current in another context (e.g. a StreamingResponse body)."""
+    _TRACE.set(tr)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    tr = _TRACE.get()
+    if tr is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        tr.add(stage, time.perf_counter() - t)
+
+def add_stage(stage: str, seconds: float) -> None:
+    """Record a stage measured by the caller (e.g. time to first streamed token)."""
+    tr = _TRACE.get()
+    if tr is not None:
+        tr.add(stage, seconds)
+
+def note_llm_call(model: str, outcome: str) -> None:
+    """outcome: ok | cache_hit | error."""
+    tr = _TRACE.get()
+    if tr is not None:
+        if outcome == "cache_hit":
+            tr.llm_cache_hits += 1
+        else:
+            tr.llm_calls += 1
+    with _LOCK:
+        _LLM_CALLS[(model, outcome)] = _LLM_CALLS.get((model, outcome), 0) + 1
+
+def note_llm_usage(model: str, prompt_tokens: int, completion_tokens: int) -> None:
+    """Token usage as reported by the provider (estimated by the stub)."""
+    tr = _TRACE.get()
+    if tr is not None:
+        tr.prompt_tokens += prompt_tokens
+        tr.completion_tokens += completion_tokens
+    with _LOCK:
+        for kind, n in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+            _LLM_TOKENS[(model, kind)] = _LLM_TOKENS.get((model, kind), 0) + int(n or 0)
+
+def finish(tr: Trace, endpoint: str, mode: Optional[str]) -> None:
+    """File a finished request into the per-mode histograms."""
+    mode = mode or "unknown"
+    total = tr.elapsed()
+    with _LOCK:
+        _REQUEST_SECONDS.setdefault((endpoint, mode), _Histogram()).observe(total)
+        for stage, sec in tr.stages.items():
+            _STAGE_SECONDS.setdefault((mode, stage), _Histogram()).observe(sec)
+
+# ---------- exposition ----------
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _render_histogram(out: List[str], name: str, help_: str, names: Sequence[str],
+                      series: Dict[Tuple[str, ...], _Histogram]) -> None:
+    out.append(f"# HELP {name} {help_}")
+    out.append(f"# TYPE {name} histogram")
+    for key in sorted(series):
+        h = series[key]
+        cum = 0
+        for b, c in zip(BUCKETS, h.counts):
+            cum += c
+            le = 'le="%g"' % b
+            out.append(f"{name}_bucket{_labels(names, key, le)} {cum}")
+        le = 'le="+Inf"'
+        out.append(f"{name}_bucket{_labels(names, key, le)} {h.count}")
+        out.append(f"{name}_sum{_labels(names, key)} {h.sum:.6f}")
+        out.append(f"{name}_count{_labels(names, key)} {h.count}")
+
+def _render_counter(out: List[str], name: str, help_: str, names: Sequence[str],
+                    series: Dict[Tuple[str, ...], float]) -> None:
+    out.append(f"# HELP {name} {help_}")
+    out.append(f"# TYPE {name} counter")
+    for key in sorted(series):
+        out.append(f"{name}{_labels(names, key)} {series[key]}")
+
+def render(gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+    """Prometheus text format (0.0.4). gauges: name -> (help, value), sampled by the caller."""
+    out: List[str] = []
+    with _LOCK:
+        _render_histogram(out, "gita_ask_request_seconds", "End-to-end /ask latency by final mode.",
+                          ("endpoint", "mode"), _REQUEST_SECONDS)
+        _render_histogram(out, "gita_ask_stage_seconds", "Time spent in each /ask stage by final mode.",
+                          ("mode", "stage"), _STAGE_SECONDS)
+        _render_counter(out, "gita_llm_calls_total", "LLM completions by outcome (ok, cache_hit, error).",
+                        ("model", "outcome"), dict(_LLM_CALLS))
+        _render_counter(out, "gita_llm_tokens_total", "LLM tokens reported by the provider.",
+                        ("model", "type"), dict(_LLM_TOKENS))
+    for name, (help_, value) in sorted((gauges or {}).items()):
+        out.append(f"# HELP {name} {help_}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {value}")
+    return "\n".join(out) + "\n"
+
+def reset() -> None:
+    with _LOCK:
+        _REQUEST_SECONDS.clear()
+        _STAGE_SECONDS.clear()
+        _LLM_CALLS.clear()
+        _LLM_TOKENS.clear()
@@ -0,0 +1,122 @@
+# app/pdf_extract.py — PDF page text extraction on a process pool
+#
+# pypdf's extract_text is pure-Python CPU work, so a long commentary keeps one
+# core busy for minutes. iter_pages() splits the document into runs of
+# PDF_PAGES_PER_TASK pages, fans them out to PDF_WORKERS processes (each opens
+# the file itself; only page text crosses the process boundary) and yields
+# pages back in document order as soon as the next one is ready, with at most
+# PDF_WORKERS * 2 runs in flight so memory stays bounded. Short documents, or
+# PDF_WORKERS=1, are extracted in-process.
+#
+# This module only imports pypdf: pool workers start from a forkserver and
+# never load pandas, chromadb or the app.
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+def _page_text(reader: PdfReader, i: int) -> Optional[str]:
+    try:
+        return reader.pages[i].extract_text() or ""
+    except Exception:
+        return None  # a malformed page should not sink the whole document
+
+# Per-process reader for the file a worker was last given, so consecutive runs
+# of the same document skip re-parsing the xref table and trailer.
+_READER: Optional[Tuple[Tuple[str, int, int], PdfReader]] = None
+
+def _reader(path: str) -> PdfReader:
+    global _READER
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if _READER is None or _READER[0] != key:
+        _READER = (key, PdfReader(path))
+    return _READER[1]
+
+def extract_range(path: str, start: int, stop: int) -> List[Optional[str]]:
+    """Text of pages [start, stop) (0-based); None for a page that failed to parse."""
+    reader = _reader(path)
+    return [_page_text(reader, i) for i in range(start, min(stop, len(reader.pages)))]
+
+def page_count(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+            if ctx.get_start_method() == "forkserver":
+                ctx.set_forkserver_preload([__name__])  # workers fork with pypdf already imported
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+            _POOL_WORKERS = workers
+        return _POOL
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_pages(path: str, workers: Optional[int] = None,
+               pages_per_task: Optional[int] = None) -> Iterator[Tuple[int, Optional[str]]]:
+    """(1-based page number, text or None) for every page, in order."""
+    workers = WORKERS if workers is None else workers
+    per_task = max(1, pages_per_task or PAGES_PER_TASK)
+    reader = PdfReader(path)
+    n = len(reader.pages)
+    if workers <= 1 or n < PARALLEL_MIN_PAGES:
+        for i in range(n):
+            yield i + 1, _page_text(reader, i)
+        return
+    del reader
+
+    pool = _pool(workers)
+    starts = iter(range(0, n, per_task))
+    pending: Deque = deque()
+
+    def submit() -> None:
+        start = next(starts, None)
+        if start is not None:
+            pending.append((start, pool.submit(extract_range, path, start, start + per_task)))
+
+    done = 0  # pages yielded so far
+    try:
+        try:
+            for _ in range(workers * 2):
+                submit()
+            while pending:
+                start, fut = pending.popleft()
+                texts = fut.result()
+                submit()
+                for k, text in enumerate(texts):
+                    done = start + k + 1
+                    yield done, text
+        except BrokenProcessPool:
+            # a worker died (OOM, crash in a native decoder): finish the document
+            # here and let the next one start a fresh pool
+            _discard_pool(pool)
+            pending.clear()
+            reader = PdfReader(path)
+            for i in range(done, n):
+                yield i + 1, _page_text(reader, i)
+    finally:
+        for _, fut in pending:  # consumer stopped early or a task failed
+            fut.cancel()
@@ -0,0 +1,387 @@
+# app/query_norm.py — spelling/transliteration correction and synonyms for verse FTS queries
+#
+# Sanskrit terms arrive in many spellings ("sthitha prajna", "bhakthi",
+# "saranagathi") and most of them match nothing in verses_fts. expand()
+# rewrites a question just before search_fts, in microseconds, from an index
+# over the corpus vocabulary. For each query term:
+#
+#   1. known   — a term verses_fts already has (any column) is left alone
+#   2. fold    — transliteration folding on both sides (sh/s, th/t, ri/r,
+#                ee/i, doubled letters, a final visarga h ...): an unknown
+#                term whose folded key is a dictionary key takes its spelling
+#   3. delete  — symmetric-delete (SymSpell) lookup over the folded keys:
+#                deletes of every key up to QUERY_NORM_MAX_EDIT edits are
+#                precomputed, so candidates are dict hits, then verified with
+#                an optimal-string-alignment distance
+#   4. prefix  — a folded key that starts dictionary keys, i.e. an
+#                uninflected stem ("sthitaprajna" -> "sthitaprajnasya")
+# An unknown term is first tried joined with the next one ("sthitha prajna").
+#
+# The dictionary is the title / roman / colloquial / word_meanings vocabulary,
+# read from the verses_fts_vocab table, so terms come out tokenized exactly as
+# FTS5 indexed them. The other columns (translation, commentaries) only count
+# as known words, which keeps English from being "corrected" into Sanskrit.
+# Corrected terms then pick up aliases from the synonym map ("surrender" ->
+# "refuge"), kept only when the alias occurs in the corpus. Aliases are added
+# to plain queries only; a query with FTS operators just gets its spellings
+# fixed, so its boolean structure stands.
+#
+# Like verse_store, the index is an immutable snapshot swapped on reload. It
+# takes a few hundred ms to build, so it is built on a background thread at
+# boot and after ingest (refresh_async); other workers notice db.verses_rev
+# changing (checked at most every QUERY_NORM_CHECK_SEC) and rebuild the same
+# way, serving the previous snapshot meanwhile.
+import bisect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .db import get_conn, verses_rev
+
+ENABLED = os.getenv("QUERY_NORM", "on").strip().lower() not in ("0", "off", "false", "no")
+MAX_EDIT = int(os.getenv("QUERY_NORM_MAX_EDIT", "2"))
+CHECK_SEC = float(os.getenv("QUERY_NORM_CHECK_SEC", "5"))
+SYNONYMS_PATH = os.getenv("QUERY_SYNONYMS_PATH", "")  # JSON {"term": ["alias", ...]} merged over SYNONYMS
+DICT_COLS = ("title", "roman", "colloquial", "word_meanings")
+PREFIX_LEN = 7       # deletes are generated from the first PREFIX_LEN characters of a key
+MIN_LEN = 4          # shorter terms are never corrected
+MIN_STEM = 5         # shortest folded key tried as a prefix of dictionary terms
+ALTERNATIVES = 3     # spellings kept per corrected term in a plain query
+MAX_ALIASES = 8      # synonym terms appended per query
+MEMO_ITEMS = 10000   # remembered corrections per index snapshot
+
+# term -> aliases. Both sides go through the same correction as queries when
+# the index is built, so Sanskrit can be written in any common spelling here.
+SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "surrender": ("refuge", "saranagati"),
+    "saranagati": ("surrender", "refuge"),
+    "sthitaprajna": ("steady", "wisdom"),
+    "bhakti": ("devotion", "devotee"),
+    "devotion": ("bhakti",),
+    "karma": ("action", "work"),
+    "jnana": ("knowledge", "wisdom"),
+    "dhyana": ("meditation",),
+    "meditation": ("dhyana",),
+    "atman": ("self", "soul"),
+    "soul": ("atman",),
+    "moksha": ("liberation",),
+    "liberation": ("moksha",),
+    "dharma": ("duty", "righteousness"),
+    "duty": ("dharma",),
+    "svadharma": ("duty",),
+    "yajna": ("sacrifice",),
+    "sacrifice": ("yajna",),
+    "sannyasa": ("renunciation",),
+    "tyaga": ("relinquishment", "renunciation"),
+    "renunciation": ("sannyasa", "tyaga"),
+    "krodha": ("anger",),
+    "anger": ("krodha", "wrath"),
+    "kama": ("desire", "lust"),
+    "desire": ("kama",),
+    "guna": ("qualities", "modes"),
+    "samatvam": ("evenness", "equanimity"),
+    "equanimity": ("evenness", "balanced"),
+    "maya": ("illusion", "delusion"),
+    "avatar": ("incarnation", "manifest"),
+    "ahimsa": ("harmlessness", "noninjury"),
+    "shraddha": ("faith",),
+    "faith": ("shraddha",),
+    "prakriti": ("nature",),
+    "purusha": ("spirit",),
+}
+
+_OPS = {"and", "or", "not", "near", "vs", "versus"}
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_FOLDS = (("chh", "c"), ("ch", "c"), ("sh", "s"), ("th", "t"), ("dh", "d"), ("bh", "b"), ("kh", "k"),
+          ("gh", "g"), ("ph", "p"), ("jh", "j"), ("jny", "jn"), ("gny", "jn"), ("gy", "jn"), ("ri", "r"),
+          ("ee", "i"), ("oo", "u"), ("w", "v"))
+_DOUBLED = re.compile(r"(.)\1+")
+
+_LOCK = threading.Lock()
+_STATS = {"queries": 0, "rewritten": 0, "terms_corrected": 0, "aliases_added": 0}
+
+def _bump(key: str, by: int = 1) -> None:
+    with _LOCK:
+        _STATS[key] += by
+
+def words(text: str) -> List[str]:
+    """Terms as the unicode61 tokenizer sees them: diacritics stripped, case-folded."""
+    t = unicodedata.normalize("NFKD", text or "")
+    t = "".join(c for c in t if not unicodedata.combining(c)).casefold()
+    return _WORD_RE.findall(t)
+
+def fold(term: str) -> str:
+    """Transliteration-insensitive key: 'sthitha' -> 'stita', 'krishna' -> 'krsna'."""
+    for a, b in _FOLDS:
+        term = term.replace(a, b)
+    term = _DOUBLED.sub(r"\1", term)
+    return term[:-1] if len(term) > 3 and term.endswith("h") else term
+
+def _deletes(word: str, n: int) -> Set[str]:
+    out = {word}
+    frontier = {word}
+    for _ in range(n):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        out |= frontier
+    return out
+
+def _distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance, or limit + 1 once it is certain to
+    exceed limit. The common prefix and suffix are trimmed first (candidates
+    mostly share the query's stem) and a letter-count bound rejects most of the
+    rest; only then is the band |i - j| <= limit of the DP table filled.
+    """
+    over = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return over
+    n = min(len(a), len(b))
+    start = 0
+    while start < n and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < n - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), over)
+    # letters one side has in surplus: each edit removes at most one per side
+    surplus_a = sum(max(0, a.count(c) - b.count(c)) for c in set(a))
+    surplus_b = sum(max(0, b.count(c) - a.count(c)) for c in set(b))
+    if max(surplus_a, surplus_b) > limit:
+        return over
+    prev2: List[int] = []
+    prev = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        cur = [over] * (len(b) + 1)
+        if i <= limit:
+            cur[0] = i
+        ai = a[i - 1]
+        for j in range(lo, hi + 1):
+            bj = b[j - 1]
+            v = prev[j - 1] + (ai != bj)
+            if prev[j] + 1 < v:
+                v = prev[j] + 1
+            if cur[j - 1] + 1 < v:
+                v = cur[j - 1] + 1
+            if i > 1 and j > 1 and ai == b[j - 2] and a[i - 2] == bj and prev2[j - 2] + 1 < v:
+                v = prev2[j - 2] + 1
+            cur[j] = v
+        if min(cur[lo - 1:hi + 1]) > limit:
+            return over
+        prev2, prev = prev, cur
+    return min(prev[-1], over)
+
+class _Index:
+    __slots__ = ("known", "freq", "keys", "sorted_keys", "deletes", "aliases", "memo", "rev", "loaded_at",
+                 "build_ms")
+
+    def __init__(self, vocab: Iterable[Tuple[str, str, int]], synonyms: Dict[str, Iterable[str]], rev: str):
+        t0 = time.perf_counter()
+        self.known: Set[str] = set()
+        self.freq: Dict[str, int] = {}  # dictionary term -> documents containing it
+        for term, col, docs in vocab:
+            self.known.add(term)
+            if col in DICT_COLS and term.isalpha():
+                self.freq[term] = self.freq.get(term, 0) + docs
+        self.keys: Dict[str, str] = {}  # folded key -> most frequent dictionary term
+        for term, n in self.freq.items():
+            k = fold(term)
+            best = self.keys.get(k)
+            if best is None or (n, best) > (self.freq[best], term):
+                self.keys[k] = term
+        self.sorted_keys = sorted(self.keys)
+        self.deletes: Dict[str, List[str]] = {}
+        for k in self.keys:
+            for d in _deletes(k[:PREFIX_LEN], MAX_EDIT):
+                self.deletes.setdefault(d, []).append(k)
+        self.memo: Dict[str, List[str]] = {}  # unknown term -> candidates, for repeated questions
+        self.aliases: Dict[str, Tuple[str, ...]] = {}  # folded key -> corpus terms
+        for term, alts in synonyms.items():
+            found: List[str] = []
+            for alt in alts:
+                for w in words(alt):
+                    c = [w] if w in self.known else self.candidates(w)
+                    if c and c[0] not in found:
+                        found.append(c[0])
+            for w in words(term):
+                if found:
+                    self.aliases[fold(w)] = tuple(found)
+        self.rev = rev
+        self.loaded_at = time.time()
+        self.build_ms = (time.perf_counter() - t0) * 1000.0
+
+    def candidates(self, term: str) -> List[str]:
+        """Dictionary spellings for an unknown term, best first; [] if nothing is close."""
+        k = fold(term)
+        if k in self.keys:
+            return [self.keys[k]]
+        limit = 1 if len(k) <= 5 else MAX_EDIT
+        dist: Dict[str, int] = {}
+        for d in _deletes(k[:PREFIX_LEN], limit):
+            for cand in self.deletes.get(d, ()):
+                if cand not in dist:
+                    dist[cand] = _distance(k, cand, limit)
+        hits = sorted((n, -self.freq[self.keys[c]], c) for c, n in dist.items() if n <= limit)
+        if hits:
+            return [self.keys[c] for n, _, c in hits[:ALTERNATIVES] if n == hits[0][0]]
+        if len(k) >= MIN_STEM:
+            stems: List[str] = []
+            i = bisect.bisect_left(self.sorted_keys, k)
+            while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(k) and len(stems) < 50:
+                stems.append(self.keys[self.sorted_keys[i]])
+                i += 1
+            return sorted(stems, key=lambda t: -self.freq[t])[:ALTERNATIVES]
+        return []
+
+    def correct(self, term: str) -> Optional[List[str]]:
+        """None when the term is fine as it is, else its dictionary spellings (maybe [])."""
+        if term in self.known or len(term) < MIN_LEN or not term.isalpha():
+            return None
+        hit = self.memo.get(term)
+        if hit is None:
+            if len(self.memo) >= MEMO_ITEMS:
+                self.memo.clear()
+            hit = self.memo[term] = self.candidates(term)
+        return hit
+
+_INDEX: Optional[_Index] = None
+_LOAD_LOCK = threading.Lock()
+_last_check = 0.0
+# one long-lived thread, so rebuilds reuse its pooled reader connection
+_BUILDER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-norm")
+_pending: Optional[Future] = None
+
+def _synonyms() -> Dict[str, Iterable[str]]:
+    syn: Dict[str, Iterable[str]] = dict(SYNONYMS)
+    if SYNONYMS_PATH:
+        with open(SYNONYMS_PATH, "r", encoding="utf-8") as f:
+            syn.update({k: tuple(v) for k, v in json.load(f).items()})
+    return syn
+
+def reload() -> int:
+    """Rebuild the index from verses_fts_vocab. Returns the dictionary size."""
+    global _INDEX, _last_check
+    with _LOAD_LOCK:
+        conn = get_conn()
+        rev = verses_rev(conn)
+        try:
+            vocab = [(r[0], r[1], r[2]) for r in conn.execute("SELECT term, col, doc FROM verses_fts_vocab")]
+        except sqlite3.OperationalError:
+            vocab = []  # schema not initialized yet
+        _INDEX = _Index(vocab, _synonyms(), rev)
+        _last_check = time.time()
+        return len(_INDEX.freq)
+
+def refresh_async() -> Future:
+    """Rebuild on the background thread; readers keep the current snapshot until the swap."""
+    global _pending
+    with _LOCK:
+        if _pending is None or _pending.done():
+            _pending = _BUILDER.submit(reload)
+        return _pending
+
+def _index() -> _Index:
+    global _last_check
+    idx = _INDEX
+    if idx is None:
+        refresh_async().result()  # first use before the boot build finished: wait for it
+        return _INDEX
+    now = time.time()
+    if now - _last_check > CHECK_SEC:
+        _last_check = now
+        if verses_rev(get_conn()) != idx.rev:
+            refresh_async()
+    return idx
+
+def _is_op(token: str) -> bool:
+    core = token.strip(".,;:!?()'").lower()
+    return core in _OPS or core.startswith("near/")
+
+def _rewrite(q: str) -> Tuple[str, Dict[str, List[str]], List[str]]:
+    """(rewritten query, {unknown term: spellings used}, aliases added)."""
+    idx = _index()
+    raw = [t for t in (q or "").split() if t]
+    plain = not any(_is_op(t) or '"' in t for t in raw)
+
+    # operators, phrases and prefix terms pass through untouched; other tokens become terms
+    parts: List[Tuple[bool, str]] = []
+    for t in raw:
+        if _is_op(t) or '"' in t or t.endswith("*"):
+            parts.append((False, t))
+        else:
+            parts.extend((True, w) for w in words(t))
+
+    out: List[str] = []
+    corrected: Dict[str, List[str]] = {}
+    i = 0
+    while i < len(parts):
+        is_term, tok = parts[i]
+        fix = idx.correct(tok) if is_term else None
+        if fix is None:
+            out.append(tok)
+            i += 1
+            continue
+        if i + 1 < len(parts) and parts[i + 1][0]:
+            joined = tok + parts[i + 1][1]
+            jfix = [joined] if joined in idx.known else idx.correct(joined)
+            if jfix:
+                corrected[f"{tok} {parts[i + 1][1]}"] = jfix
+                out.extend(jfix if plain else jfix[:1])
+                i += 2
+                continue
+        if fix:
+            corrected[tok] = fix
+            out.extend(fix if plain else fix[:1])
+        else:
+            out.append(tok)
+        i += 1
+
+    aliases: List[str] = []
+    if plain:
+        have = set(out)
+        # the user's own spelling may be the alias key ("sthitha prajna" -> sthitaprajna)
+        for tok in out + [k.replace(" ", "") for k in corrected]:
+            for alias in idx.aliases.get(fold(tok), ()):
+                if alias not in have and len(aliases) < MAX_ALIASES:
+                    have.add(alias)
+                    aliases.append(alias)
+    return " ".join(out + aliases), corrected, aliases
+
+def expand(q: str) -> str:
+    """q with misspelt Sanskrit terms corrected and synonyms appended, ready for search_fts."""
+    if not ENABLED:
+        return q
+    rewritten, corrected, aliases = _rewrite(q)
+    _bump("queries")
+    if corrected or aliases:
+        _bump("rewritten")
+        _bump("terms_corrected", len(corrected))
+        _bump("aliases_added", len(aliases))
+    return rewritten
+
+def explain(q: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    rewritten, corrected, aliases = _rewrite(q)
+    return {"query": q, "expanded": rewritten, "corrected": corrected, "aliases": aliases,
+            "took_us": round((time.perf_counter() - t0) * 1e6, 1)}
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        out: Dict[str, Any] = dict(_STATS)
+    idx = _INDEX
+    out["enabled"] = ENABLED
+    if idx is None:
+        out["loaded"] = False
+        return out
+    out.update({"loaded": True, "known_terms": len(idx.known), "dictionary_terms": len(idx.freq),
+                "keys": len(idx.keys), "delete_entries": len(idx.deletes), "alias_keys": len(idx.aliases),
+                "build_ms": round(idx.build_ms, 1), "rev": idx.rev, "loaded_at": idx.loaded_at})
+    return out
@@ -0,0 +1,63 @@
+# app/render.py — display-ready verse text, computed once at ingest
+#
+# These are pure functions of the stored verse text, so bulk_upsert persists
+# their output in verse_render and the request path only reads it back.
+import re
+from typing import Any, Dict, Optional
+
+# Fields returned by the explain route, cleaned with line breaks preserved
+EXPLAIN_FIELDS = (
+    "sanskrit", "roman", "colloquial", "translation", "summary",
+    "word_meanings", "commentary2", "commentary3", "commentary1",
+)
+LIST_SNIPPET_CHARS = 220
+RAG_BLOCK_CHARS = 600
+
+def clean_text_preserve_lines(t: str) -> str:
+    """Preserve line breaks; remove HTML; avoid flattening to one line."""
+    if not t:
+        return ""
+    t = re.sub(r"(?i)<br\s*/?>", "\n", t)
+    t = re.sub(r"(?is)<p[^>]*>", "", t)
+    t = re.sub(r"(?is)</p>", "\n\n", t)
+    t = re.sub(r"(?is)<[^>]+>", "", t)
+    t = t.replace("\r\n", "\n").replace("\r", "\n")
+    t = re.sub(r"\n{4,}", "\n\n", t)
+    t = "\n".join(ln.rstrip() for ln in t.split("\n"))
+    return t.strip()
+
+def clean_text(t: str) -> str:
+    if not t:
+        return ""
+    t = re.sub(r"<br\s*/?>", "\n", t, flags=re.I)
+    t = re.sub(r"<[^>]+>", "", t)
+    t = re.sub(r"\s+", " ", t).strip()
+    return t.replace("[C:V]", "").strip()
+
+def best_text_block(row: Dict[str, Any], force_source: Optional[str] = None) -> str:
+    if force_source == "commentary2":
+        v = clean_text(row.get("commentary2") or "")
+        return v or ""
+    for k in ("commentary2", "commentary1", "translation", "colloquial", "roman", "title"):
+        v = clean_text(row.get(k) or "")
+        if v:
+            return v
+    return ""
+
+def truncate_words(t: str, limit: int) -> str:
+    if t and len(t) > limit:
+        return t[:limit].rsplit(" ", 1)[0] + "…"
+    return t
+
+def render_verse(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything the request path shows for one verse, already cleaned and truncated."""
+    return {
+        "explain": {k: clean_text_preserve_lines(row.get(k) or "") for k in EXPLAIN_FIELDS},
+        "list_title": clean_text(row.get("title") or ""),
+        "list_snippet": truncate_words(
+            clean_text(row.get("translation") or row.get("roman") or row.get("colloquial") or ""),
+            LIST_SNIPPET_CHARS,
+        ),
+        "rag_block": truncate_words(best_text_block(row), RAG_BLOCK_CHARS),
+        "rag_block_c2": truncate_words(best_text_block(row, force_source="commentary2"), RAG_BLOCK_CHARS),
+    }
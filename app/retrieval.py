@@ -0,0 +1,116 @@
+# app/retrieval.py — hybrid (FTS + vector) verse retrieval for the /ask RAG path
+#
+# hybrid_hits() runs two retrievers concurrently, each in a worker thread with
+# its own latency budget:
+#   fts     search_fts over the verses table; the budget is enforced inside
+#           SQLite with a progress handler, so a slow MATCH is aborted rather
+#           than left running
+#   vector  embed the question (reusing the semantic-cache vector when there
+#           is one) and query the commentary store for chunks that carry a
+#           chapter/verse; several chunks of one verse count once, at their
+#           best rank
+# A retriever that misses its budget or fails is dropped and the request goes
+# on with the other one, so a cold Chroma or a slow embedding call degrades
+# to FTS-only instead of stalling. The verse rankings are merged with
+# reciprocal-rank fusion (score = sum of 1 / (RAG_RRF_K + rank)), and the
+# fused (chapter, verse, row) list feeds _diversify_hits unchanged.
+import asyncio
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .db import get_conn, search_fts
+from . import embed_store, metrics, verse_store
+
+HYBRID = os.getenv("RAG_HYBRID", "on").strip().lower() not in ("0", "off", "false", "no")
+FTS_BUDGET_SEC = float(os.getenv("RAG_FTS_BUDGET_MS", "250")) / 1000.0
+VECTOR_BUDGET_SEC = float(os.getenv("RAG_VECTOR_BUDGET_MS", "800")) / 1000.0  # embedding + query
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+FTS_LIMIT = 60
+VECTOR_TOP_K = int(os.getenv("RAG_VECTOR_TOP_K", "24"))  # chunks; several may map to one verse
+
+Key = Tuple[int, int]
+
+class _OverBudget(Exception):
+    pass
+
+def _fts(query: str, deadline: float) -> List[Dict[str, Any]]:
+    conn = get_conn()
+    # checked every 1000 VM steps: aborts the statement once the budget is spent
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+    try:
+        with metrics.span("search_fts"):
+            return [dict(r) for r in search_fts(conn, query, limit=FTS_LIMIT)]
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            raise _OverBudget() from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+def _vector(question: str, qvec: Optional[List[float]], topic: str) -> List[Key]:
+    """Distinct (chapter, verse) of the nearest commentary chunks, best first."""
+    with metrics.span("search_vector"):
+        where = {"$and": [{"topic": topic}, {"chapter": {"$gt": 0}}, {"verse": {"$gt": 0}}]}
+        res = embed_store.query(question, top_k=VECTOR_TOP_K, where=where, embedding=qvec)
+    keys: List[Key] = []
+    seen = set()
+    for meta in (res.get("metadatas") or [[]])[0]:
+        key = (int(meta.get("chapter") or 0), int(meta.get("verse") or 0))
+        if key not in seen and verse_store.get(*key):
+            seen.add(key)
+            keys.append(key)
+    return keys
+
+async def _run(fn, budget: float, *args) -> Tuple[Optional[Any], str]:
+    """(result, status); status is ok | timeout | error."""
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout=budget), "ok"
+    except (asyncio.TimeoutError, _OverBudget):
+        return None, "timeout"
+    except Exception:
+        return None, "error"
+
+def rrf(rankings: Sequence[Sequence[Key]], k: int = RRF_K) -> List[Key]:
+    """Keys ordered by reciprocal-rank fusion score; ties keep first-seen order."""
+    score: Dict[Key, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            score[key] += 1.0 / (k + rank)
+    return sorted(score, key=lambda key: -score[key])
+
+async def hybrid_hits(question: str, fts_query: str, qvec: Optional[List[float]] = None,
+                      topic: str = embed_store.TOPIC_DEFAULT) -> Tuple[List[Tuple[int, int, Dict]], Dict[str, Any]]:
+    """
+    Fused (chapter, verse, row) hits, best first, and a debug summary:
+    {"fts": n | status, "vector": n | status | "off", "fused": n}.
+    """
+    tasks = [_run(_fts, FTS_BUDGET_SEC, fts_query, time.perf_counter() + FTS_BUDGET_SEC)]
+    if HYBRID:
+        tasks.append(_run(_vector, VECTOR_BUDGET_SEC, question, qvec, topic))
+    results = await asyncio.gather(*tasks)
+
+    fts_rows, fts_status = results[0]
+    vec_keys, vec_status = results[1] if HYBRID else (None, "off")
+    rows: Dict[Key, Dict] = {}
+    fts_keys: List[Key] = []
+    for r in fts_rows or []:
+        key = (int(r["chapter"]), int(r["verse"]))
+        if key not in rows:
+            rows[key] = r
+            fts_keys.append(key)
+
+    with metrics.span("fuse"):
+        merged: List[Tuple[int, int, Dict]] = []
+        for key in rrf([fts_keys, vec_keys or []]):
+            row = rows.get(key) or verse_store.get(*key)
+            if row:
+                merged.append((key[0], key[1], dict(row)))
+    info = {
+        "fts": len(fts_keys) if fts_status == "ok" else fts_status,
+        "vector": len(vec_keys) if vec_status == "ok" else vec_status,
+        "fused": len(merged),
+    }
+    return merged, info
@@ -0,0 +1,196 @@
+# app/semantic_cache.py — reuse /ask answers for near-duplicate questions
+#
+# Each LLM-backed answer is stored with the embedding of its question
+# (embed_store.EMBED_MODEL_TAG). A new question is embedded once, compared by
+# cosine similarity against an in-memory float32 matrix of cached questions,
+# and the stored response is reused when the best match clears
+# SEMANTIC_CACHE_THRESHOLD. Rows expire after SEMANTIC_CACHE_TTL_SEC and the
+# table is trimmed to SEMANTIC_CACHE_MAX_ROWS by least-recent use. The matrix
+# is reloaded every SEMANTIC_CACHE_REFRESH_SEC on a background thread; lookup()
+# and store() block on SQLite, so the request path runs them off the event loop.
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .db import get_conn, writer
+from .embed_store import EMBED_MODEL_TAG
+
+ENABLED = os.getenv("SEMANTIC_CACHE", "on").strip().lower() not in ("0", "off", "false", "no")
+THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+TTL_SEC = float(os.getenv("SEMANTIC_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+MAX_ROWS = int(os.getenv("SEMANTIC_CACHE_MAX_ROWS", "5000"))
+REFRESH_SEC = float(os.getenv("SEMANTIC_CACHE_REFRESH_SEC", "60"))  # pick up rows written by other workers
+EMBED_TIMEOUT_SEC = float(os.getenv("SEMANTIC_CACHE_EMBED_TIMEOUT_SEC", "3"))
+TOUCH_EVERY_SEC = 300.0
+
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0, "embed_failures": 0, "errors": 0, "refreshes": 0}
+
+# Immutable snapshot (ids, vecs, loaded_at): ids[i] is the semantic_cache row whose
+# unit-length embedding is vecs[i]. Readers take the reference once; writers build
+# a new tuple and swap it in under _LOCK, so a lookup never sees a half update.
+_Snapshot = Tuple[np.ndarray, Optional[np.ndarray], float]
+_index: _Snapshot = (np.zeros(0, dtype=np.int64), None, 0.0)
+
+# Reloads run here, never on the request path; lookups use the current snapshot meanwhile.
+_REFRESHER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache")
+_pending: Optional[Future] = None
+
+def _bump(key: str, by: int = 1) -> None:
+    with _LOCK:
+        _STATS[key] += by
+
+def _failed(op: str, e: Exception) -> None:
+    _bump("errors")
+    print(f"[semantic_cache] {op} failed: {e!r}", flush=True)
+
+def note_embed_failure() -> None:
+    _bump("embed_failures")
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+def _load_index() -> None:
+    global _index
+    try:
+        rows = get_conn().execute(
+            "SELECT id, embedding FROM semantic_cache WHERE model=? AND created_at >= ?",
+            (EMBED_MODEL_TAG, time.time() - TTL_SEC),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    vecs = np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows else None
+    with _LOCK:
+        # Keep rows this process appended after the SELECT above read the table
+        cur_ids, cur_vecs, _ = _index
+        newer = cur_ids > (ids.max() if ids.size else -1)
+        if cur_vecs is not None and newer.any() and (vecs is None or vecs.shape[1] == cur_vecs.shape[1]):
+            ids = np.concatenate([ids, cur_ids[newer]])
+            vecs = cur_vecs[newer] if vecs is None else np.vstack([vecs, cur_vecs[newer]])
+        _index = (ids, vecs, time.time())
+        _STATS["refreshes"] += 1
+
+def _reload_quietly() -> None:
+    try:
+        _load_index()
+    except Exception as e:
+        _failed("refresh", e)
+
+def refresh_async() -> Future:
+    """Reload the index on the background thread; lookups keep the current snapshot until the swap."""
+    global _pending
+    with _LOCK:
+        if _pending is None or _pending.done():
+            _pending = _REFRESHER.submit(_reload_quietly)
+        return _pending
+
+def lookup(vec: Optional[Sequence[float]]) -> Optional[Dict[str, Any]]:
+    """
+    Cached response for the nearest previous question, or None below THRESHOLD.
+    Blocking (matrix product, SQLite); call it off the event loop. Never raises.
+    """
+    if vec is None or not ENABLED:
+        return None
+    try:
+        return _lookup(vec)
+    except Exception as e:
+        _failed("lookup", e)
+        _bump("misses")
+        return None
+
+def _lookup(vec: Sequence[float]) -> Optional[Dict[str, Any]]:
+    ids, vecs, loaded_at = _index
+    if time.time() - loaded_at > REFRESH_SEC:
+        refresh_async()
+    q = _unit(vec)
+    if vecs is None or vecs.shape[1] != q.shape[0]:
+        _bump("misses")
+        return None
+    sims = vecs @ q
+    best = int(np.argmax(sims))
+    sim = float(sims[best])
+    if sim < THRESHOLD:
+        _bump("misses")
+        return None
+    row_id = int(ids[best])
+    row = get_conn().execute(
+        "SELECT question, response, created_at, last_used FROM semantic_cache WHERE id=?", (row_id,)
+    ).fetchone()
+    now = time.time()
+    if row is None or now - row["created_at"] > TTL_SEC:
+        _bump("misses")
+        return None
+    _bump("hits")
+    if now - row["last_used"] > TOUCH_EVERY_SEC:
+        try:
+            with writer() as conn:
+                conn.execute("UPDATE semantic_cache SET last_used=?, hits=hits+1 WHERE id=?", (now, row_id))
+        except Exception as e:
+            _failed("touch", e)  # the hit is still good
+    resp = json.loads(row["response"])
+    resp.setdefault("debug", {})["semantic_cache"] = {
+        "similarity": round(sim, 4),
+        "matched_question": row["question"],
+    }
+    return resp
+
+def store(question: str, vec: Optional[Sequence[float]], response: Dict[str, Any]) -> None:
+    """Remember an answer under its question embedding. Blocking; never raises."""
+    if vec is None or not ENABLED:
+        return
+    try:
+        _store(question, _unit(vec), response)
+    except Exception as e:
+        _failed("store", e)
+
+def _store(question: str, q: np.ndarray, response: Dict[str, Any]) -> None:
+    global _index
+    now = time.time()
+    with writer() as conn:
+        cur = conn.execute(
+            "INSERT INTO semantic_cache(question, model, embedding, response, created_at, last_used, hits) "
+            "VALUES(?,?,?,?,?,?,0)",
+            (question, EMBED_MODEL_TAG, q.tobytes(), json.dumps(response, ensure_ascii=False), now, now),
+        )
+        new_id = cur.lastrowid
+        n = conn.execute("DELETE FROM semantic_cache WHERE created_at < ?", (now - TTL_SEC,)).rowcount
+        n += conn.execute(
+            "DELETE FROM semantic_cache WHERE id IN ("
+            "  SELECT id FROM semantic_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (MAX_ROWS,),
+        ).rowcount
+    _bump("stores")
+    if n:
+        _bump("evicted", n)
+        refresh_async()
+        return
+    with _LOCK:
+        ids, vecs, loaded_at = _index
+        if vecs is None or vecs.shape[1] == q.shape[0]:
+            _index = (np.append(ids, np.int64(new_id)), q[None, :] if vecs is None else np.vstack([vecs, q]),
+                      loaded_at)
+
+def clear() -> int:
+    with writer() as conn:
+        n = conn.execute("DELETE FROM semantic_cache").rowcount
+    _load_index()
+    return n
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        out: Dict[str, Any] = dict(_STATS)
+        out["indexed"] = int(_index[0].shape[0])
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+    out.update({"enabled": ENABLED, "threshold": THRESHOLD, "ttl_sec": TTL_SEC,
+                "max_rows": MAX_ROWS, "model": EMBED_MODEL_TAG})
+    return out
@@ -0,0 +1,329 @@
+# app/vector_index.py — memory-mapped vector index for commentary chunks
+#
+# A lighter alternative to the Chroma collection (VECTOR_BACKEND=mmap in
+# embed_store): tens of thousands of chunks fit comfortably in one matrix,
+# and a brute-force dot product over it is a few milliseconds. One directory
+# per collection:
+#
+#   vectors.bin   unit-length embeddings, count x dim, float32 or float16
+#   meta.jsonl    one line per row: {"id", "off", "len", "meta"}
+#   docs.bin      UTF-8 chunk text; meta rows point into it by byte offset
+#   index.json    {"dim", "dtype", "count", "meta_bytes", "docs_bytes", ...}
+#
+# index.json is the commit record. A writer (flock on .lock, so uvicorn workers
+# can ingest concurrently) trims the data files back to the committed sizes,
+# appends, fsyncs and then replaces index.json; readers only ever look at the
+# committed prefix, so a crash mid-append loses that batch and nothing else.
+# Readers memory-map vectors.bin and docs.bin (workers share the page cache
+# and open in milliseconds) and pick up new rows by re-reading only the tail
+# of meta.jsonl when index.json changes.
+#
+# query() answers in Chroma's shape (ids/documents/metadatas/distances, one
+# inner list per query) with cosine distance, and supports the `where` subset
+# the app uses: equality, $eq/$ne/$in/$nin/$gt/$gte/$lt/$lte, $and/$or.
+# Filters are evaluated on factorized metadata columns before scoring.
+import fcntl
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+
+DTYPES = {"float32": np.float32, "float16": np.float16}
+SCORE_BLOCK_ROWS = 1024  # rows gathered/upcast per step: the scratch block stays in cache
+
+class _Column:
+    """One metadata key, factorized: codes[i] indexes uniques (-1 = key absent on row i)."""
+    __slots__ = ("codes", "uniques", "lookup", "_arr", "_num")
+
+    def __init__(self):
+        self.codes: List[int] = []
+        self.uniques: List[Any] = []
+        self.lookup: Dict[Any, int] = {}
+        self._arr: Optional[np.ndarray] = None
+        self._num: Optional[np.ndarray] = None
+
+    def append(self, value: Any) -> None:
+        code = -1
+        if value is not None:
+            key = (type(value) is bool, value)  # keep True apart from 1
+            code = self.lookup.get(key, -1)
+            if code < 0:
+                code = len(self.uniques)
+                self.lookup[key] = code
+                self.uniques.append(value)
+        self.codes.append(code)
+        self._arr = self._num = None
+
+    def code(self, value: Any) -> int:
+        return self.lookup.get((type(value) is bool, value), -2)  # -2 never matches a row
+
+    def array(self) -> np.ndarray:
+        if self._arr is None:
+            self._arr = np.asarray(self.codes, dtype=np.int32)
+        return self._arr
+
+    def numeric(self) -> np.ndarray:
+        """Per-row float value (nan where absent or not a number), for range filters."""
+        if self._num is None:
+            vals = np.array([float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+                             for v in self.uniques] + [np.nan], dtype=np.float64)
+            codes = self.array()
+            self._num = vals[np.where(codes >= 0, codes, len(self.uniques))]
+        return self._num
+
+class MmapIndex:
+    def __init__(self, path: str, dtype: str = "float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype} (use float32 or float16)")
+        self.path = path
+        self.new_dtype = dtype  # used only when the index is created
+        self._lock = threading.Lock()
+        self._stamp: Optional[tuple] = None
+        self._reset()
+
+    # ---------- files ----------
+    def _f(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_header(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._f("index.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._f(".lock"), "a+b") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    # ---------- reader state ----------
+    def _reset(self) -> None:
+        self.header: Dict[str, Any] = {}
+        self.ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.offsets: List[int] = []
+        self.lengths: List[int] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.columns: Dict[str, _Column] = {}
+        self._vecs: Optional[np.ndarray] = None
+        self._docs: Optional[mmap.mmap] = None
+        self._meta_bytes = 0
+
+    def refresh(self) -> None:
+        """Pick up rows committed since the last call (by this or another process)."""
+        try:
+            st = os.stat(self._f("index.json"))
+            stamp = (st.st_ino, st.st_mtime_ns)  # replaced, never rewritten in place
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            hdr = self._read_header()
+            if hdr is None:
+                self._reset()
+                self._stamp = stamp
+                return
+            if self.header and (hdr["dim"] != self.header["dim"] or hdr["meta_bytes"] < self._meta_bytes):
+                self._reset()  # rebuilt underneath us
+            self._load_meta_tail(hdr["meta_bytes"])
+            n, dim = hdr["count"], hdr["dim"]
+            self._vecs = (np.memmap(self._f("vectors.bin"), dtype=DTYPES[hdr["dtype"]], mode="r", shape=(n, dim))
+                          if n else np.zeros((0, dim), dtype=DTYPES[hdr["dtype"]]))
+            # the previous maps are left to the GC: a concurrent query may still hold them
+            self._docs = None
+            if hdr["docs_bytes"]:
+                with open(self._f("docs.bin"), "rb") as f:
+                    self._docs = mmap.mmap(f.fileno(), hdr["docs_bytes"], access=mmap.ACCESS_READ)
+            self.header = hdr
+            self._stamp = stamp
+
+    def _load_meta_tail(self, meta_bytes: int) -> None:
+        if meta_bytes <= self._meta_bytes:
+            return
+        with open(self._f("meta.jsonl"), "rb") as f:
+            f.seek(self._meta_bytes)
+            tail = f.read(meta_bytes - self._meta_bytes)
+        for line in tail.splitlines():
+            rec = json.loads(line)
+            row = len(self.ids)
+            self.ids.append(rec["id"])
+            self.row_of[rec["id"]] = row
+            self.offsets.append(rec["off"])
+            self.lengths.append(rec["len"])
+            meta = rec.get("meta") or {}
+            self.metas.append(meta)
+            for key in meta.keys() - self.columns.keys():
+                col = self.columns[key] = _Column()
+                col.codes = [-1] * row
+            for key, col in self.columns.items():
+                col.append(meta.get(key))
+        self._meta_bytes = meta_bytes
+
+    def count(self) -> int:
+        self.refresh()
+        return len(self.ids)
+
+    def has(self, ids: Iterable[str]) -> Set[str]:
+        """The subset of ids already stored."""
+        self.refresh()
+        return {i for i in ids if i in self.row_of}
+
+    def document(self, row: int, docs: Optional[mmap.mmap] = None) -> str:
+        off, n = self.offsets[row], self.lengths[row]
+        return (docs or self._docs)[off:off + n].decode("utf-8") if n else ""
+
+    # ---------- writes ----------
+    def add(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+            documents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> int:
+        """Append rows whose id is not stored yet; returns how many were added."""
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        if vecs.ndim != 2 or len(vecs) != len(ids):
+            raise ValueError("embeddings must be one vector per id")
+        with self._write_lock():
+            hdr = self._read_header() or {
+                "version": 1, "dim": int(vecs.shape[1]), "dtype": self.new_dtype,
+                "count": 0, "meta_bytes": 0, "docs_bytes": 0,
+            }
+            if vecs.shape[1] != hdr["dim"]:
+                raise ValueError(f"embedding dim {vecs.shape[1]} does not match index dim {hdr['dim']}")
+            self.refresh()
+            seen = set(self.row_of)
+            keep = []
+            for i, cid in enumerate(ids):
+                if cid not in seen:
+                    seen.add(cid)
+                    keep.append(i)
+            if not keep:
+                return 0
+
+            vecs = vecs[keep]
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            vecs = (vecs / np.where(norms > 0, norms, 1.0)).astype(DTYPES[hdr["dtype"]])
+            docs_off = hdr["docs_bytes"]
+            doc_blob = bytearray()
+            meta_lines = []
+            for i in keep:
+                b = (documents[i] or "").encode("utf-8")
+                meta_lines.append(json.dumps({"id": ids[i], "off": docs_off + len(doc_blob), "len": len(b),
+                                              "meta": metadatas[i]}, ensure_ascii=False))
+                doc_blob += b
+            meta_blob = ("\n".join(meta_lines) + "\n").encode("utf-8")
+
+            itemsize = np.dtype(DTYPES[hdr["dtype"]]).itemsize
+            self._append("vectors.bin", hdr["count"] * hdr["dim"] * itemsize, vecs.tobytes())
+            self._append("docs.bin", hdr["docs_bytes"], bytes(doc_blob))
+            self._append("meta.jsonl", hdr["meta_bytes"], meta_blob)
+            hdr = {**hdr, "count": hdr["count"] + len(keep),
+                   "docs_bytes": hdr["docs_bytes"] + len(doc_blob),
+                   "meta_bytes": hdr["meta_bytes"] + len(meta_blob)}
+            tmp = self._f("index.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(hdr, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._f("index.json"))
+        self.refresh()
+        return len(keep)
+
+    def _append(self, name: str, committed: int, data: bytes) -> None:
+        with open(self._f(name), "a+b") as f:
+            f.truncate(committed)  # drop anything a crashed writer left past the commit point
+            f.seek(committed)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---------- queries ----------
+    def _cond(self, key: str, cond: Any) -> np.ndarray:
+        col = self.columns.get(key)
+        n = len(self.ids)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        mask = np.ones(n, dtype=bool)
+        for op, val in cond.items():
+            if col is None:
+                mask &= op in ("$ne", "$nin")
+                continue
+            codes = col.array()
+            if op == "$eq":
+                mask &= codes == col.code(val)
+            elif op == "$ne":
+                mask &= codes != col.code(val)
+            elif op in ("$in", "$nin"):
+                hit = np.isin(codes, [col.code(v) for v in val])
+                mask &= hit if op == "$in" else ~hit
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                num = col.numeric()
+                with np.errstate(invalid="ignore"):
+                    mask &= {"$gt": num > val, "$gte": num >= val, "$lt": num < val, "$lte": num <= val}[op]
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+        return mask
+
+    def _mask(self, where: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, cond in where.items():
+            if key == "$and":
+                for sub in cond:
+                    mask &= self._mask(sub)
+            elif key == "$or":
+                any_ = np.zeros(len(self.ids), dtype=bool)
+                for sub in cond:
+                    any_ |= self._mask(sub)
+                mask &= any_
+            else:
+                mask &= self._cond(key, cond)
+        return mask
+
+    @staticmethod
+    def _scores(mat: np.ndarray, q: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is None and mat.dtype == np.float32:
+            return mat @ q  # straight off the mapped pages, no copy
+        n = len(rows) if rows is not None else len(mat)
+        out = np.empty(n, dtype=np.float32)
+        for a in range(0, n, SCORE_BLOCK_ROWS):
+            b = min(n, a + SCORE_BLOCK_ROWS)
+            block = mat[rows[a:b]] if rows is not None else mat[a:b]
+            out[a:b] = block.astype(np.float32, copy=False) @ q
+        return out
+
+    def query(self, embedding: Sequence[float], top_k: int = 8,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        self.refresh()
+        # rows only ever get appended, and metadata before vectors: everything below
+        # the snapshot's row count is consistent even if a refresh runs meanwhile
+        mat, docs = self._vecs, self._docs
+        empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        if mat is None or not len(mat) or top_k <= 0:
+            return empty
+        q = np.asarray(embedding, dtype=np.float32).ravel()
+        if q.shape[0] != mat.shape[1]:
+            raise ValueError(f"query dim {q.shape[0]} does not match index dim {mat.shape[1]}")
+        norm = float(np.linalg.norm(q))
+        q = q / norm if norm else q
+
+        rows = np.flatnonzero(self._mask(where)[:len(mat)]) if where else None
+        if rows is not None and len(rows) == 0:
+            return empty
+        scores = self._scores(mat, q, rows)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        hit_rows = rows[top] if rows is not None else top
+        return {
+            "ids": [[self.ids[r] for r in hit_rows]],
+            "documents": [[self.document(r, docs) for r in hit_rows]],
+            "metadatas": [[dict(self.metas[r]) for r in hit_rows]],
+            "distances": [[float(1.0 - s) for s in scores[top]]],
+        }
@@ -0,0 +1,158 @@
+# app/verse_store.py — process-local, read-only copy of the verses table
+#
+# The corpus is small (~700 rows), so the explain / word-meaning path, /title
+# and /debug/verse read from memory instead of SQLite. Rows are stored as
+# tuples in one list ordered by (chapter, verse), addressed through a
+# (chapter, verse) -> slot map, with each verse's ±1 neighbours precomputed.
+#
+# Display-ready text (verse_render, written at ingest) is kept alongside each
+# row so the request path does no regex work on corpus text.
+#
+# A reload builds a complete new snapshot and swaps a single module global, so
+# readers always see either the old or the new corpus, never a mix. Ingest in
+# this process reloads on a worker thread; other workers notice db.verses_rev
+# changing. That check runs at most every VERSE_STORE_CHECK_SEC on a background
+# thread, which also does any reload, so requests only read the current snapshot
+# and never touch SQLite (the one exception: first use before the boot load).
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db import get_conn, verses_rev
+from .render import render_verse
+
+CHECK_SEC = float(os.getenv("VERSE_STORE_CHECK_SEC", "5"))
+
+class _Snapshot:
+    __slots__ = ("fields", "col", "rows", "slot", "neighbors", "renders", "rev", "loaded_at")
+
+    def __init__(self, fields: Tuple[str, ...], rows: List[tuple],
+                 renders: List[Dict[str, Any]], rev: str):
+        self.fields = fields
+        self.col = {f: i for i, f in enumerate(fields)}
+        self.rows = rows
+        ci, vi = self.col["chapter"], self.col["verse"]
+        self.slot: Dict[Tuple[int, int], int] = {(r[ci], r[vi]): i for i, r in enumerate(rows)}
+        self.neighbors: List[Tuple[int, ...]] = [
+            tuple(self.slot[(r[ci], v)] for v in (r[vi] - 1, r[vi] + 1) if (r[ci], v) in self.slot)
+            for r in rows
+        ]
+        self.renders = renders
+        self.rev = rev
+        self.loaded_at = time.time()
+
+_STORE: Optional[_Snapshot] = None
+_LOAD_LOCK = threading.Lock()
+_last_check = 0.0
+
+_REFRESHER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verse-store")
+_PENDING_LOCK = threading.Lock()
+_pending: Optional[Future] = None
+
+def _as_int(x: Any) -> Any:
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return x
+
+def reload() -> int:
+    """Rebuild the snapshot from SQLite and swap it in. Returns the verse count."""
+    global _STORE, _last_check
+    with _LOAD_LOCK:
+        conn = get_conn()
+        rev = verses_rev(conn)
+        cur = conn.execute("SELECT * FROM verses ORDER BY chapter, verse")
+        fields = tuple(c[0] for c in cur.description)
+        ci, vi = fields.index("chapter"), fields.index("verse")
+        rows = []
+        for r in cur.fetchall():
+            t = ["" if x is None else x for x in r]
+            t[ci], t[vi] = _as_int(t[ci]), _as_int(t[vi])
+            rows.append(tuple(t))
+        stored = {
+            (r["chapter"], r["verse"]): {
+                "explain": json.loads(r["explain"]),
+                "list_title": r["list_title"] or "",
+                "list_snippet": r["list_snippet"] or "",
+                "rag_block": r["rag_block"] or "",
+                "rag_block_c2": r["rag_block_c2"] or "",
+            }
+            for r in conn.execute("SELECT * FROM verse_render").fetchall()
+        }
+        # rows written by other tools may lack a render: compute it once here
+        renders = [stored.get((t[ci], t[vi])) or render_verse(dict(zip(fields, t))) for t in rows]
+        _STORE = _Snapshot(fields, rows, renders, rev)
+        _last_check = time.time()
+        return len(rows)
+
+def _refresh() -> None:
+    snap = _STORE
+    try:
+        if snap is None or verses_rev(get_conn()) != snap.rev:
+            reload()
+    except Exception as e:
+        print(f"[verse_store] refresh failed: {e!r}", flush=True)  # keep serving the old snapshot
+
+def refresh_async() -> Future:
+    """Reload on the background thread if verses_rev moved; readers keep the current snapshot until the swap."""
+    global _pending
+    with _PENDING_LOCK:
+        if _pending is None or _pending.done():
+            _pending = _REFRESHER.submit(_refresh)
+        return _pending
+
+def _store() -> _Snapshot:
+    global _last_check
+    snap = _STORE
+    if snap is None:
+        reload()  # first use before the boot load
+        return _STORE
+    now = time.time()
+    if now - _last_check > CHECK_SEC:
+        _last_check = now
+        refresh_async()
+    return snap
+
+def get(ch: int, v: int) -> Optional[Dict[str, Any]]:
+    snap = _store()
+    i = snap.slot.get((ch, v))
+    if i is None:
+        return None
+    return dict(zip(snap.fields, snap.rows[i]))
+
+def field(ch: int, v: int, name: str, default: str = "") -> Optional[str]:
+    """Single column without materializing the row; None if the verse does not exist."""
+    snap = _store()
+    i = snap.slot.get((ch, v))
+    if i is None:
+        return None
+    j = snap.col.get(name)
+    return snap.rows[i][j] if j is not None else default
+
+def rendered(ch: int, v: int) -> Optional[Dict[str, Any]]:
+    """Display-ready text for a verse (see render.render_verse)."""
+    snap = _store()
+    i = snap.slot.get((ch, v))
+    return snap.renders[i] if i is not None else None
+
+def neighbors(ch: int, v: int) -> List[Dict[str, Any]]:
+    """Adjacent verses (v-1, v+1) in the same chapter: chapter, verse, translation."""
+    snap = _store()
+    i = snap.slot.get((ch, v))
+    if i is None:
+        return []
+    ci, vi, ti = snap.col["chapter"], snap.col["verse"], snap.col["translation"]
+    return [
+        {"chapter": snap.rows[j][ci], "verse": snap.rows[j][vi], "translation": snap.rows[j][ti]}
+        for j in snap.neighbors[i]
+    ]
+
+def stats() -> Dict[str, Any]:
+    snap = _STORE
+    if snap is None:
+        return {"loaded": False}
+    return {"loaded": True, "verses": len(snap.rows), "fields": len(snap.fields),
+            "rev": snap.rev, "loaded_at": snap.loaded_at}
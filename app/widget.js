@@ -1,6 +1,6 @@
-// Gita Q&A v2 — v2.10 (word-meaning intercept + list fix + small polish)
+// Gita Q&A v2 — v2.11 (streamed answers over /ask/stream)
 const GitaWidget = (() => {
-  console.log('[GW] init v2.10');
+  console.log('[GW] init v2.11');
 
   // ===== Field query addon =====
   const FIELD_SYNONYMS = {
@@ -198,6 +198,43 @@ const GitaWidget = (() => {
     return r.json();
   }
 
+  // POST and read a Server-Sent Events reply. handlers[event](data) is called per event;
+  // resolves with the data of the final `result` event (null if the stream ended without one).
+  async function streamJSON(url, body, handlers = {}) {
+    const r = await fetch(url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+      body: JSON.stringify(body)
+    });
+    if (!r.ok || !r.body) throw new Error(r.ok ? 'Streaming not supported' : await r.text());
+    const reader = r.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = '', result = null;
+    function dispatch(block) {
+      let event = 'message', data = '';
+      block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      if (!data) return;
+      const parsed = JSON.parse(data);
+      if (event === 'result') result = parsed;
+      if (handlers[event]) handlers[event](parsed);
+    }
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true }).replace(/\r\n?/g, '\n');
+      let i;
+      while ((i = buf.indexOf('\n\n')) !== -1) {
+        dispatch(buf.slice(0, i));
+        buf = buf.slice(i + 2);
+      }
+    }
+    if (buf.trim()) dispatch(buf);
+    return result;
+  }
+
   function toPlain(text) {
     if (text == null) return '';
     let t = String(text)
@@ -490,6 +527,38 @@ const GitaWidget = (() => {
       autoScroll();
     }
 
+    // Placeholder bot message that renders tokens as they stream in
+    function startLiveMessage() {
+      const msg = el('div', { class: 'msg bot live' });
+      const pills = el('div', { class: 'citations' });
+      const body = el('div', { class: 'md sect' });
+      const cites = new Set();
+      let text = '', queued = false;
+      msg.appendChild(pills);
+      msg.appendChild(el('div', { class: 'bubble' }, body));
+      log.appendChild(msg);
+      function paint() {
+        queued = false;
+        body.innerHTML = mdToHtml(text.replace(/\[C:V\]/g, ''));
+        autoScroll();
+      }
+      return {
+        reset() { text = ''; paint(); },
+        append(t) {
+          text += t;
+          if (!queued) { queued = true; requestAnimationFrame(paint); }
+        },
+        cite(c) {
+          const cv = normalizeCitations([c])[0];
+          if (!cv || cites.has(cv)) return;
+          cites.add(cv);
+          const p = renderCitations([cv], (ch, v) => doAsk(`Explain ${ch}.${v}`));
+          if (p) [...p.childNodes].forEach(n => pills.appendChild(n));
+        },
+        remove() { msg.remove(); }
+      };
+    }
+
     function enhanceInlineCitations(bubble, onExplain) {
       const RE = CITE_TEXT_RE;
       const walker = document.createTreeWalker(bubble, NodeFilter.SHOW_TEXT, null);
@@ -600,15 +669,31 @@ const GitaWidget = (() => {
         console.error('[field-intercept] error', e);
       }
 
-      // ---- Default flow ----
+      // ---- Default flow (streamed; plain /ask if streaming is unavailable) ----
       pushMessage('user', q);
       try {
         sendBtn.classList.add('loading');
-        const res = await fetchJSON(`${apiBase}/ask`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ question: q, topic: 'gita' })
-        });
+        const payload = { question: q, topic: 'gita' };
+        const live = startLiveMessage();
+        let res = null;
+        try {
+          res = await streamJSON(`${apiBase}/ask/stream`, payload, {
+            mode: () => live.reset(),
+            token: (d) => live.append(d.text || ''),
+            citation: (d) => live.cite(d.cite)
+          });
+        } catch (e) {
+          console.warn('[GW] stream failed, falling back to /ask', e);
+        } finally {
+          live.remove();
+        }
+        if (!res) {
+          res = await fetchJSON(`${apiBase}/ask`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+          });
+        }
         const citations = Array.isArray(res.citations) ? res.citations : [];
         // suppress the top pill if the main result is an Explain for a single verse
         let suppressCv = '';